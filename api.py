@@ -3,7 +3,7 @@ from resources.designation import DesignationList
 from resources.specialty import SpecialtyList
 from resources.language import LanguageList
 from resources.user.user_auth import (TokenRefresh, UserCsrf, UserLogin,
-                                      UserLogout)
+                                      UserLogout, UserLogoutEverywhere)
 from resources.user.user_is import (UserIsAuthenticated, UserIsLoggedInAs)
 from resources.user.user_password import (UserForgotPasswordRequest,
                                           UserForgotPasswordUpdate,
@@ -17,6 +17,7 @@ from resources.user.user_profile import (AdminManagedProfile,
 from resources.user.user_register import (RegistrationConfirmation,
                                           RegistrationConfirmationResend,
                                           UserRegister)
+from resources.user.user_map import ProviderTiles, UserSearchClusters
 from resources.user.user_search import UserSearch
 
 def add_resources(app, api):
@@ -38,6 +39,8 @@ def add_resources(app, api):
 
     api.add_resource(UserLogout, '/logout')
 
+    api.add_resource(UserLogoutEverywhere, '/logout/all')
+
     api.add_resource(TokenRefresh, '/refresh')
 
     api.add_resource(UserProfile, '/users/<string:user_uuid>/profile')
@@ -71,6 +74,11 @@ def add_resources(app, api):
     api.add_resource(
         UserSearch, '/users/<int:specialty_id>&<int:radius>&<int:page>&<string:sort_by>')
 
+    api.add_resource(
+        UserSearchClusters, '/users/<int:specialty_id>/clusters/<int:z>/<int:x>/<int:y>')
+
+    api.add_resource(ProviderTiles, '/tiles/<int:z>/<int:x>/<int:y>.mvt')
+
     api.add_resource(DesignationList, '/designations')
 
     api.add_resource(SpecialtyList, '/specialties')
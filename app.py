@@ -5,6 +5,7 @@ from models.language import LanguageModel
 from models.designation import DesignationModel
 from models.procedural_wait_time import ProceduralWaitTimeModel
 from models.address import AddressModel
+from models.searchable_provider import SearchableProviderModel
 from flask import Flask
 from extensions import cors, db, jwt, ma, csrf  # , tali
 from flask_restful import Resource
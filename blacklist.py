@@ -1,5 +1,329 @@
+"""
+Revoking tokens before they expire.
+
+A single token is revoked by its jti (one redis key per token), which is what logging out does.
+Every token of a user is revoked by a watermark: one redis key per user saying tokens issued before
+a time are revoked. Watermarks are set when a user changes their password or logs out everywhere,
+and expire once every token they could revoke has, so redis holds at most one per user however often they're set.
+
+Revocations are rare and checks are on every request, so every worker keeps what it needs to check in memory:
+the watermarks it looked up (or that there was none), and a Bloom filter of the revoked jtis. Only a jti
+the filter (probably) holds is looked up in redis. Both are kept current by listening for revocations
+on redis pub/sub channels, and while a worker isn't listening (eg, redis restarted) it looks everything up.
+"""
+from collections import Counter, OrderedDict
+from threading import Lock, Thread
+from time import monotonic, sleep, time
+
+from flask import current_app
+from metrics import increment_counters
+from redis.exceptions import RedisError
+
+from bloom_filter import BloomFilter
 from config import BaseConfig
 from extensions import redis_store
 
+WATERMARK_CHANNEL = 'token_watermarks'
+REVOKED_JTIS_CHANNEL = 'revoked_jtis'
+# the jtis revoked (and not expired yet), scored by when they expire, for workers to build their filters from
+REVOKED_JTIS_KEY = 'revoked_jtis'
+
+# seconds between calls to a listener's tick
+LISTEN_TICK_INTERVAL = 5
+# seconds between pings of a pub/sub connection, it's given up on after two without an answer
+LISTEN_PING_INTERVAL = 30
+LISTEN_RECONNECT_INTERVAL = 1
+
+# seconds between rebuilds of the revoked jti filter, which drops the expired ones
+REVOKED_FILTER_REBUILD_INTERVAL = 3600
+
+
+def watermark_key(uuid: str) -> str:
+    return 'tokens_valid_after:{}'.format(uuid)
+
+
 def revoke_token(jti):
-    redis_store.set(jti, 'true', BaseConfig.JWT_ACCESS_TOKEN_EXPIRES * 1.2)
\ No newline at end of file
+    lifetime = BaseConfig.JWT_ACCESS_TOKEN_EXPIRES * 1.2
+    now = time()
+
+    pipeline = redis_store.pipeline()
+    pipeline.set(jti, 'true', lifetime)
+    pipeline.zadd(REVOKED_JTIS_KEY, {jti: now + lifetime.total_seconds()})
+    pipeline.zremrangebyscore(REVOKED_JTIS_KEY, '-inf', now)
+    pipeline.publish(REVOKED_JTIS_CHANNEL, jti)
+    pipeline.execute()
+
+    # this worker doesn't wait for its own message, the next request may come with the revoked token
+    if revoked_token_filter is not None:
+        revoked_token_filter.add(jti)
+
+
+def revoke_user_tokens(uuid: str):
+    """
+    Revokes every token of a user issued before this second.
+    Tokens issued later in the second are kept, so the user can be given new ones right away.
+    """
+    watermark = int(time())
+    lifetime = max(BaseConfig.JWT_ACCESS_TOKEN_EXPIRES, BaseConfig.JWT_REFRESH_TOKEN_EXPIRES) * 1.2
+
+    pipeline = redis_store.pipeline(transaction=False)
+    pipeline.set(watermark_key(uuid), watermark, lifetime)
+    pipeline.publish(WATERMARK_CHANNEL, '{} {}'.format(uuid, watermark))
+    pipeline.execute()
+
+    # same as above
+    if token_watermarks is not None:
+        token_watermarks.add(uuid, watermark)
+
+
+def is_token_revoked(decrypted_token: dict) -> bool:
+    watermarks = get_token_watermarks()
+    uuid = decrypted_token['identity']
+
+    watermark = watermarks.get(uuid) if watermarks else get_watermark(uuid)
+
+    if watermark is not None and decrypted_token['iat'] < watermark:
+        return True
+
+    revoked = get_revoked_token_filter()
+
+    if revoked:
+        return revoked.is_revoked(decrypted_token['jti'])
+
+    return redis_store.get(decrypted_token['jti']) is not None
+
+
+def get_watermark(uuid: str) -> int:
+    watermark = redis_store.get(watermark_key(uuid))
+    return int(watermark) if watermark is not None else None
+
+
+def listen(channel: str, listener):
+    """
+    Passes listener what's published on channel, forever (run it in a thread):
+    listener.subscribed() once the subscription is confirmed, nothing published after that is missed,
+    listener.receive(data) with every message (as bytes),
+    listener.tick() at least every LISTEN_TICK_INTERVAL seconds,
+    listener.unsubscribed() whenever the connection is lost (or stops answering pings), messages may be missed
+    """
+    while True:
+        pubsub = redis_store.pubsub()
+
+        try:
+            pubsub.subscribe(channel)
+            answered_at = pinged_at = monotonic()
+
+            while monotonic() - answered_at < 2 * LISTEN_PING_INTERVAL:
+                message = pubsub.get_message(timeout=LISTEN_TICK_INTERVAL)
+
+                if message is not None:
+                    answered_at = monotonic()
+
+                    if message['type'] == 'subscribe':
+                        listener.subscribed()
+                    elif message['type'] == 'message':
+                        listener.receive(message['data'])
+
+                listener.tick()
+
+                if monotonic() - pinged_at >= LISTEN_PING_INTERVAL:
+                    pubsub.ping()
+                    pinged_at = monotonic()
+        except RedisError:
+            pass
+        finally:
+            listener.unsubscribed()
+            pubsub.reset()
+
+        sleep(LISTEN_RECONNECT_INTERVAL)
+
+
+class TokenWatermarks:
+
+    def __init__(self, size: int):
+        """
+        size: how many users' watermarks are kept at most, the least recently used go first
+        """
+        self.size = size
+        self.watermarks = OrderedDict()
+        self.lock = Lock()
+        self.is_listening = False
+        # bumped whenever the watermarks are forgotten, so a lookup from before isn't kept
+        self.generation = 0
+
+    def get(self, uuid: str) -> int:
+        """
+        Returns the watermark of a user (as a unix time), or None if they don't have one
+        """
+        with self.lock:
+            if self.is_listening and uuid in self.watermarks:
+                self.watermarks.move_to_end(uuid)
+                return self.watermarks[uuid]
+
+            generation = self.generation
+
+        watermark = get_watermark(uuid)
+
+        with self.lock:
+            # a watermark published while we looked it up is newer than what we found
+            if self.is_listening and self.generation == generation and uuid not in self.watermarks:
+                self.set(uuid, watermark)
+
+        return watermark
+
+    def set(self, uuid: str, watermark: int):
+        # the lock must be held
+        self.watermarks[uuid] = watermark
+        self.watermarks.move_to_end(uuid)
+
+        while len(self.watermarks) > self.size:
+            self.watermarks.popitem(last=False)
+
+    def add(self, uuid: str, watermark: int):
+        with self.lock:
+            # workers' clocks differ a little, a watermark never moves back
+            self.set(uuid, max(watermark, self.watermarks.get(uuid) or 0))
+
+    def subscribed(self):
+        with self.lock:
+            self.is_listening = True
+
+    def receive(self, data: bytes):
+        uuid, watermark = data.decode('utf-8').split(' ')
+        self.add(uuid, int(watermark))
+
+    def tick(self):
+        pass
+
+    def unsubscribed(self):
+        with self.lock:
+            self.is_listening = False
+            self.watermarks.clear()
+            self.generation += 1
+
+
+class RevokedTokenFilter:
+
+    def __init__(self, capacity: int, error_rate: float):
+        """
+        capacity: how many revoked jtis the filter is sized for, it's rebuilt when it holds more
+        error_rate: the share of jtis that aren't revoked the filter says (probably) are, when it's full
+        """
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bloom_filter = None
+        self.built_at = None
+        self.lock = Lock()
+        # counted here and added to the shared metrics every tick, or every check would cost a redis call after all
+        self.counters = Counter()
+
+    def is_revoked(self, jti: str) -> bool:
+        with self.lock:
+            is_ready = self.bloom_filter is not None
+            is_probably_revoked = not is_ready or jti in self.bloom_filter
+
+            self.counters['revoked_token_checks'] += 1
+
+            if not is_ready:
+                self.counters['revoked_token_filter_fallbacks'] += 1
+            elif not is_probably_revoked:
+                self.counters['revoked_token_redis_calls_avoided'] += 1
+
+        if not is_probably_revoked:
+            return False
+
+        is_revoked = redis_store.get(jti) is not None
+
+        if is_ready and not is_revoked:
+            with self.lock:
+                self.counters['revoked_token_filter_false_positives'] += 1
+
+        return is_revoked
+
+    def add(self, jti: str):
+        with self.lock:
+            if self.bloom_filter is not None:
+                self.bloom_filter.add(jti)
+
+    def build(self):
+        """
+        Builds a new filter of the jtis revoked in redis (and not expired)
+        """
+        bloom_filter = BloomFilter(self.capacity, self.error_rate)
+
+        for jti in redis_store.zrangebyscore(REVOKED_JTIS_KEY, time(), '+inf'):
+            bloom_filter.add(jti.decode('utf-8'))
+
+        with self.lock:
+            self.bloom_filter = bloom_filter
+            self.built_at = monotonic()
+
+    def subscribed(self):
+        # every jti revoked from here on is received, and every one revoked before is in redis already
+        self.build()
+
+    def receive(self, data: bytes):
+        self.add(data.decode('utf-8'))
+
+    def tick(self):
+        with self.lock:
+            counters, self.counters = self.counters, Counter()
+            is_outdated = self.bloom_filter is not None and (
+                self.bloom_filter.count > self.capacity or
+                monotonic() - self.built_at > REVOKED_FILTER_REBUILD_INTERVAL)
+
+        if counters:
+            increment_counters(counters)
+
+        if is_outdated:
+            # messages wait while we build, and are added to the new filter
+            self.build()
+
+    def unsubscribed(self):
+        with self.lock:
+            self.bloom_filter = None
+
+
+# one of each per worker, created (and listening) on first use
+token_watermarks = None
+revoked_token_filter = None
+listeners_lock = Lock()
+
+
+def get_token_watermarks() -> TokenWatermarks:
+    """
+    Returns this workers watermarks, or None if TOKEN_WATERMARK_CACHE_SIZE is 0
+    """
+    global token_watermarks
+
+    size = current_app.config['TOKEN_WATERMARK_CACHE_SIZE']
+
+    if not size:
+        return None
+
+    with listeners_lock:
+        if token_watermarks is None:
+            token_watermarks = TokenWatermarks(size)
+            Thread(target=listen, args=(WATERMARK_CHANNEL, token_watermarks), daemon=True).start()
+
+    return token_watermarks
+
+
+def get_revoked_token_filter() -> RevokedTokenFilter:
+    """
+    Returns this workers revoked jti filter, or None if REVOKED_TOKEN_FILTER_CAPACITY is 0
+    """
+    global revoked_token_filter
+
+    config = current_app.config
+
+    if not config['REVOKED_TOKEN_FILTER_CAPACITY']:
+        return None
+
+    with listeners_lock:
+        if revoked_token_filter is None:
+            revoked_token_filter = RevokedTokenFilter(config['REVOKED_TOKEN_FILTER_CAPACITY'],
+                                                      config['REVOKED_TOKEN_FILTER_ERROR_RATE'])
+            Thread(target=listen, args=(REVOKED_JTIS_CHANNEL, revoked_token_filter), daemon=True).start()
+
+    return revoked_token_filter
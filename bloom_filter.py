@@ -0,0 +1,41 @@
+"""
+A Bloom filter: a set that answers "definitely not in it" or "probably in it", in a fixed amount of memory
+however long the items are. Items can't be removed, so a filter is rebuilt to drop them.
+"""
+from hashlib import blake2b
+from math import ceil, log
+
+
+class BloomFilter:
+
+    def __init__(self, capacity: int, error_rate: float):
+        """
+        capacity: how many items it is sized for
+        error_rate: the share of items it doesn't hold that it says it does (false positives),
+        once it holds capacity items
+        """
+        # the optimal number of bits, and of bits set per item, for the capacity and error rate
+        self.size = ceil(-capacity * log(error_rate) / log(2) ** 2)
+        self.hash_count = max(1, round(self.size / capacity * log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, item: str):
+        """
+        Returns the bits an item sets, from two hashes combined (Kirsch-Mitzenmacher)
+        """
+        digest = blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        # odd, so the positions don't repeat
+        second = int.from_bytes(digest[8:], 'little') | 1
+
+        return [(first + index * second) % self.size for index in range(self.hash_count)]
+
+    def add(self, item: str):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & 1 << (position & 7) for position in self.positions(item))
@@ -0,0 +1,243 @@
+"""
+Authorization claims carried in access tokens, so endpoints can authorize (and say who's logged in)
+without loading the user.
+
+Every access token carries the claims of its user from when it was issued, and the users claims version.
+Changing any of the claimed columns bumps the version (in redis), so older tokens are turned away
+(like expired ones) and the client refreshes them, which issues a token with the current claims.
+Changes committed through the models bump it by themselves, after changing claimed columns
+any other way (eg, by hand in the database) call bump_claims_version.
+
+Versions are checked on every request, so every worker keeps the versions it looked up in memory.
+Bumps are published on a redis pub/sub channel (see blacklist.listen), and every worker forgets the bumped versions,
+while a worker isn't listening (eg, redis restarted) it looks every version up.
+"""
+from collections import OrderedDict
+from threading import Lock, Thread
+from time import sleep
+
+from flask import current_app
+from metrics import increment_counters
+from redis.exceptions import RedisError
+from sqlalchemy import event, inspect
+
+from blacklist import listen
+from extensions import db, redis_store
+
+CLAIMS_VERSIONS_CHANNEL = 'claims_versions'
+
+# a bump is tried this many times, waiting BUMP_RETRY_INTERVAL seconds (doubling) in between
+BUMP_ATTEMPTS = 3
+BUMP_RETRY_INTERVAL = 0.1
+
+# the UserModel columns copied into the claims
+CLAIMED_COLUMNS = ('id', 'user_type', 'is_verified_professional', 'is_initial_setup_complete',
+                   'name', 'email', 'profile_picture_link')
+
+
+def claims_version_key(uuid: str) -> str:
+    return 'claims_version:{}'.format(uuid)
+
+
+def get_claims_version(uuid: str) -> int:
+    """
+    Returns the users claims version, as it is in redis
+    """
+    return int(redis_store.get(claims_version_key(uuid)) or 0)
+
+
+# the users whose bumps failed, they're tried again with the next bump
+pending_bumps = set()
+pending_bumps_lock = Lock()
+
+
+def bump_claims_version(*uuids):
+    """
+    Turns away the access tokens issued to the users so far, so they're refreshed with their current claims.
+    Bumps that failed before are tried again along with these.
+    Raises a RedisError if redis can't be reached after BUMP_ATTEMPTS tries, the bumps are kept and tried again
+    with the next one (and by every worker listening for bumps once redis is back, see ClaimsVersions.tick).
+    """
+    with pending_bumps_lock:
+        uuids = set(uuids) | pending_bumps
+        pending_bumps.clear()
+
+    if not uuids:
+        return
+
+    for attempt in range(BUMP_ATTEMPTS):
+        try:
+            # in a transaction, so a version is never bumped without the workers being told
+            pipeline = redis_store.pipeline()
+
+            for uuid in uuids:
+                pipeline.incr(claims_version_key(uuid))
+                pipeline.publish(CLAIMS_VERSIONS_CHANNEL, uuid)
+
+            pipeline.execute()
+            break
+        except RedisError:
+            if attempt == BUMP_ATTEMPTS - 1:
+                with pending_bumps_lock:
+                    pending_bumps.update(uuids)
+
+                increment_counters({'claims_version_bump_failures': 1})
+                raise
+
+            sleep(BUMP_RETRY_INTERVAL * 2 ** attempt)
+
+    # this worker doesn't wait for its own messages, the next request may come with an outdated token
+    if claims_versions is not None:
+        for uuid in uuids:
+            claims_versions.forget(uuid)
+
+
+def build_claims(user, version: int = None) -> dict:
+    """
+    Returns the claims for a users access tokens, with their current claims version unless version is given
+    """
+    claims = {column: getattr(user, column) for column in CLAIMED_COLUMNS}
+    claims['version'] = get_claims_version(user.uuid) if version is None else version
+
+    return claims
+
+
+def load_claims(uuid: str) -> dict:
+    """
+    Returns the claims for a users access tokens (or {} if there's no such user), as they are in the database.
+    The version is read before the user, so a change committed in between leaves the claims with
+    the version before it (and the token is refreshed again), never the old values with the new version.
+    """
+    # import down here to avoid circular imports
+    from models.user import UserModel
+
+    version = get_claims_version(uuid)
+
+    # not find_by_uuid, its caches can be behind the database. populate_existing reloads the user
+    # if it's in the session already (after flushing any changes to it)
+    user = UserModel.query.populate_existing().filter_by(uuid=uuid).first()
+
+    if user is None:
+        return {}
+
+    return build_claims(user, version)
+
+
+def are_claims_current(uuid: str, claims: dict) -> bool:
+    """
+    Returns whether claims (from a token of the user with uuid) are still what build_claims would return
+    """
+    versions = get_claims_versions()
+    version = versions.get(uuid) if versions else get_claims_version(uuid)
+
+    # tokens issued before claims existed have none
+    return claims.get('version') == version
+
+
+def listen_for_claim_changes(model):
+    """
+    Bumps the claims version of users once a change to a claimed column is committed
+    (not before, or a token refreshed in between would be issued the old claims with the new version)
+    """
+    @event.listens_for(model, 'after_update')
+    def note_claim_changes(mapper, connection, target):
+        state = inspect(target)
+
+        if any(state.attrs[column].history.has_changes() for column in CLAIMED_COLUMNS):
+            state.session.info.setdefault('changed_claims_uuids', set()).add(target.uuid)
+
+    @event.listens_for(db.session, 'after_commit')
+    def bump_claims_versions(session):
+        try:
+            bump_claims_version(*session.info.pop('changed_claims_uuids', ()))
+        except RedisError:
+            # the change is committed already, the bumps are tried again later (see bump_claims_version)
+            pass
+
+
+class ClaimsVersions:
+
+    def __init__(self, size: int):
+        """
+        size: how many users' versions are kept at most, the least recently used go first
+        """
+        self.size = size
+        self.versions = OrderedDict()
+        self.lock = Lock()
+        self.is_listening = False
+        # bumped whenever a version is forgotten, so a lookup from before isn't kept
+        self.generation = 0
+
+    def get(self, uuid: str) -> int:
+        """
+        Returns the claims version of a user
+        """
+        with self.lock:
+            if self.is_listening and uuid in self.versions:
+                self.versions.move_to_end(uuid)
+                return self.versions[uuid]
+
+            generation = self.generation
+
+        version = get_claims_version(uuid)
+
+        with self.lock:
+            # a bump published while we looked it up may have come after what we found
+            if self.is_listening and self.generation == generation:
+                self.versions[uuid] = version
+                self.versions.move_to_end(uuid)
+
+                while len(self.versions) > self.size:
+                    self.versions.popitem(last=False)
+
+        return version
+
+    def forget(self, uuid: str):
+        with self.lock:
+            self.versions.pop(uuid, None)
+            self.generation += 1
+
+    def subscribed(self):
+        with self.lock:
+            self.is_listening = True
+
+    def receive(self, data: bytes):
+        self.forget(data.decode('utf-8'))
+
+    def tick(self):
+        # redis is back, after bumps failed
+        if pending_bumps:
+            try:
+                bump_claims_version()
+            except RedisError:
+                pass
+
+    def unsubscribed(self):
+        with self.lock:
+            self.is_listening = False
+            self.versions.clear()
+            self.generation += 1
+
+
+# one per worker, created (and listening) on first use
+claims_versions = None
+claims_versions_lock = Lock()
+
+
+def get_claims_versions() -> ClaimsVersions:
+    """
+    Returns this workers claims versions, or None if CLAIMS_VERSION_CACHE_SIZE is 0
+    """
+    global claims_versions
+
+    size = current_app.config['CLAIMS_VERSION_CACHE_SIZE']
+
+    if not size:
+        return None
+
+    with claims_versions_lock:
+        if claims_versions is None:
+            claims_versions = ClaimsVersions(size)
+            Thread(target=listen, args=(CLAIMS_VERSIONS_CHANNEL, claims_versions), daemon=True).start()
+
+    return claims_versions
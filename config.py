@@ -58,6 +58,98 @@ class BaseConfig(object):
     # allow only these headers to bypass cors
     CORS_HEADERS = 'Content-Type, X-CSRFToken'
 
+    # search results per page, clients can ask for up to SEARCH_MAX_PAGE_SIZE with ?per_page=
+    SEARCH_PAGE_SIZE = 6
+    SEARCH_MAX_PAGE_SIZE = 50
+
+    # the "score" sort ranks specialists by a blend of distance and waits (see SearchScoring in models/user.py):
+    # a point per km to their nearest office, per week of consultation wait
+    # and per week of wait for the procedure searched for (?procedure=), a wait they haven't entered counts as
+    # SEARCH_SCORE_MISSING_WAIT weeks. only the SEARCH_SCORE_CANDIDATES nearest offices are scored
+    SEARCH_SCORE_DISTANCE_WEIGHT = float(environ.get('SEARCH_SCORE_DISTANCE_WEIGHT', 1))
+    SEARCH_SCORE_WAIT_WEIGHT = float(environ.get('SEARCH_SCORE_WAIT_WEIGHT', 1))
+    SEARCH_SCORE_PROCEDURE_WAIT_WEIGHT = float(environ.get('SEARCH_SCORE_PROCEDURE_WAIT_WEIGHT', 1))
+    SEARCH_SCORE_MISSING_WAIT = 52
+    SEARCH_SCORE_CANDIDATES = 500
+
+    # offices don't have time zones of their own, the open_now search filter checks their hours against
+    # the time of day in OFFICE_HOURS_TIMEZONE
+    OFFICE_HOURS_TIMEZONE = environ.get('OFFICE_HOURS_TIMEZONE', 'America/Toronto')
+
+    # every worker keeps the last USER_CACHE_SIZE users it looked up by uuid for USER_CACHE_TTL seconds
+    # (0 turns the cache off), see models/user_cache.py
+    USER_CACHE_SIZE = 1024
+    USER_CACHE_TTL = int(environ.get('USER_CACHE_TTL', 30))
+
+    # logging out revokes the token logged out with (by its jti), password changes and /logout/all
+    # every token of the user (by a watermark), see blacklist.py.
+    # every worker keeps the revocation watermarks of its last TOKEN_WATERMARK_CACHE_SIZE users (0 turns it off)
+    TOKEN_WATERMARK_CACHE_SIZE = 10000
+    # and a Bloom filter of the revoked jtis, sized for REVOKED_TOKEN_FILTER_CAPACITY of them (0 turns it off),
+    # so only the jtis it (probably) holds are checked in redis. about REVOKED_TOKEN_FILTER_ERROR_RATE of the others are
+    REVOKED_TOKEN_FILTER_CAPACITY = 100000
+    REVOKED_TOKEN_FILTER_ERROR_RATE = 0.001
+
+    # every worker keeps the claims versions of its last CLAIMS_VERSION_CACHE_SIZE users (0 turns it off), see claims.py
+    CLAIMS_VERSION_CACHE_SIZE = 10000
+
+    # search result pages are cached in redis for SEARCH_CACHE_TTL seconds (0 turns the cache off).
+    # pages are keyed by the searchers geohash cell (7 characters is ~150 meters), so nearby searchers share them,
+    # and only cached for radii that are a multiple of SEARCH_CACHE_RADIUS_BUCKET meters
+    SEARCH_CACHE_TTL = int(environ.get('SEARCH_CACHE_TTL', 300))
+    SEARCH_CACHE_GEOHASH_PRECISION = 7
+    SEARCH_CACHE_RADIUS_BUCKET = 1000
+
+    # identical searches running at the same time share one computation (see resources/user/utils/single_flight.py).
+    # the worker computing holds a redis lock for at most SEARCH_SINGLE_FLIGHT_LOCK_TTL milliseconds,
+    # the others wait up to SEARCH_SINGLE_FLIGHT_WAIT seconds for it before searching themselves,
+    # checking the cache after SEARCH_SINGLE_FLIGHT_POLL_INTERVAL seconds, then twice as long after every miss
+    # (up to SEARCH_SINGLE_FLIGHT_MAX_POLL_INTERVAL seconds)
+    SEARCH_SINGLE_FLIGHT_LOCK_TTL = 5000
+    SEARCH_SINGLE_FLIGHT_WAIT = 3
+    SEARCH_SINGLE_FLIGHT_POLL_INTERVAL = 0.05
+    SEARCH_SINGLE_FLIGHT_MAX_POLL_INTERVAL = 0.4
+
+    # the map clusters a tile's offices on a MAP_CLUSTER_GRID x MAP_CLUSTER_GRID grid,
+    # so a tile never has more clusters than that, each with up to MAP_CLUSTER_SAMPLE_SIZE uuids.
+    # tiles (clusters and vector tiles) are cached in redis for MAP_TILE_CACHE_TTL seconds (0 turns the cache off)
+    # and by browsers for MAP_TILE_MAX_AGE seconds
+    MAP_CLUSTER_GRID = 8
+    MAP_CLUSTER_SAMPLE_SIZE = 5
+    MAP_TILE_CACHE_TTL = int(environ.get('MAP_TILE_CACHE_TTL', 300))
+    MAP_TILE_MAX_AGE = 60
+
+    # every worker hashes passwords in a pool of PASSWORD_HASH_POOL_SIZE processes (0 hashes in the request thread),
+    # and turns requests away with a 503 when PASSWORD_HASH_QUEUE_SIZE more are waiting,
+    # or a hash hasn't come back from the pool in PASSWORD_HASH_TIMEOUT seconds, see security.py
+    PASSWORD_HASH_POOL_SIZE = int(environ.get('PASSWORD_HASH_POOL_SIZE', 0))
+    PASSWORD_HASH_QUEUE_SIZE = 4
+    PASSWORD_HASH_TIMEOUT = 5
+
+    GOOGLE_MAPS_API_KEY = environ.get('GOOGLE_MAPS_API_KEY')
+
+    # where the distances on search results come from:
+    # 'google' -> driving distances from the Distance Matrix API (billed per element)
+    # 'local' -> great-circle distances computed in process, used by default without an api key
+    DISTANCE_PROVIDER = environ.get('DISTANCE_PROVIDER') or ('google' if GOOGLE_MAPS_API_KEY else 'local')
+
+    # google distances are cached in redis by origin and destination,
+    # rounded to this many decimal places (4 places is ~11 meters)
+    DISTANCE_CACHE_PRECISION = int(environ.get('DISTANCE_CACHE_PRECISION', 4))
+    DISTANCE_CACHE_TTL = int(environ.get('DISTANCE_CACHE_TTL', 86400))
+
+    # point this at tests/stubs/distance_matrix.py to work offline
+    DISTANCE_MATRIX_URL = environ.get('DISTANCE_MATRIX_URL') or \
+        'https://maps.googleapis.com/maps/api/distancematrix/json'
+    # seconds, search comes back without distances rather than waiting any longer
+    DISTANCE_MATRIX_CONNECT_TIMEOUT = 0.5
+    DISTANCE_MATRIX_READ_TIMEOUT = 1.5
+    DISTANCE_MATRIX_RETRIES = 1
+    # stop calling the api for DISTANCE_MATRIX_BREAKER_RESET seconds
+    # after DISTANCE_MATRIX_BREAKER_FAILURES failed requests in a row
+    DISTANCE_MATRIX_BREAKER_FAILURES = 5
+    DISTANCE_MATRIX_BREAKER_RESET = 30
+
 
 class DevelopmentConfig(BaseConfig):
     # algorithm hashing rounds (reduced for testing purposes only!)
@@ -77,8 +169,14 @@ class TestingConfig(BaseConfig):
     # Disable CSRF tokens in the Forms (only valid for testing purposes!)
     WTF_CSRF_ENABLED = False
 
+    # every test starts with a new database, users cached by an earlier test would be stale
+    USER_CACHE_TTL = 0
+
 
 class ProductionConfig(BaseConfig):
     environ["PASSWORD_HASH_ROUNDS"] = "30000"
 
+    # 30000 rounds take long enough to be worth a pool (4 workers with 2 threads each, see uwsgi.ini)
+    PASSWORD_HASH_POOL_SIZE = int(environ.get('PASSWORD_HASH_POOL_SIZE', 2))
+
     TESTING = False
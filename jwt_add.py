@@ -1,17 +1,36 @@
+from blacklist import is_token_revoked
+from claims import are_claims_current, load_claims
 from extensions import jwt
 from flask import jsonify
-from extensions import redis_store
+from flask_jwt_extended import get_jwt_identity
 from models.user import UserModel
 
 def add_jwt():
     # This method will check if a token is blacklisted, and will be called automatically when blacklist is enabled
     @jwt.token_in_blacklist_loader
     def check_if_token_in_blacklist(decrypted_token):
-        jti = decrypted_token['jti']
-        entry = redis_store.get(jti)
-        if entry is None:
-            return False
-        return True # Here we blacklist particular jwt_managers that have been created in the past.
+        # tokens revoked by their jti, or with the rest of the users tokens, see blacklist.py
+        return is_token_revoked(decrypted_token)
+
+
+    # tokens can be created for a UserModel (or its uuid), the token's identity is the uuid either way
+    @jwt.user_identity_loader
+    def user_identity_lookup(user):
+        if isinstance(user, UserModel):
+            return user.uuid
+        return user
+
+
+    # access tokens carry the claims endpoints authorize from, see claims.py
+    @jwt.user_claims_loader
+    def add_claims_to_access_token(user):
+        return load_claims(user.uuid if isinstance(user, UserModel) else user)
+
+
+    # tokens issued before the users claims last changed are turned away, so they get refreshed
+    @jwt.claims_verification_loader
+    def check_if_claims_are_current(user_claims):
+        return are_claims_current(get_jwt_identity(), user_claims)
 
 
     # The following callbacks are used for customizing jwt_manager response/error messages.
@@ -53,6 +72,16 @@ def add_jwt():
         }), 401
 
 
+    # shaped like an expired token, so clients refresh the token the same way
+    @jwt.claims_verification_failed_loader
+    def outdated_claims_callback():
+        return jsonify({
+            'message': 'The token has expired.',
+            'error': 'token_claims_outdated',
+            'status': 427
+        }), 427
+
+
     @jwt.revoked_token_loader
     def revoked_token_callback():
         return jsonify({
@@ -61,5 +90,6 @@ def add_jwt():
             'status': 401
         }), 401
     
-    return check_if_token_in_blacklist, expired_token_callback, invalid_token_callback, \
-           missing_token_callback, token_not_fresh_callback, revoked_token_callback
\ No newline at end of file
+    return check_if_token_in_blacklist, user_identity_lookup, add_claims_to_access_token, \
+           check_if_claims_are_current, expired_token_callback, invalid_token_callback, \
+           missing_token_callback, token_not_fresh_callback, outdated_claims_callback, revoked_token_callback
\ No newline at end of file
@@ -0,0 +1,29 @@
+"""
+Counters shared by every worker.
+
+They are kept in a single redis hash, so they can be read with:
+    redis-cli HGETALL metrics
+"""
+from redis.exceptions import RedisError
+
+from extensions import redis_store
+
+METRICS_KEY = 'metrics'
+
+
+def increment_counters(counters: dict):
+    """
+    Takes in a dict of {counter name: amount} and adds each amount to its counter.
+    Counting is best effort, a redis error is never raised to the caller.
+    """
+    try:
+        pipeline = redis_store.pipeline(transaction=False)
+
+        for name, amount in counters.items():
+            if amount:
+                pipeline.hincrby(METRICS_KEY, name, int(amount))
+
+        pipeline.execute()
+    except RedisError:
+        pass
+
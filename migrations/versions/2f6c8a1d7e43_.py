@@ -0,0 +1,39 @@
+"""copy office hours into searchable_providers for the open_at / open_now filters
+
+Revision ID: 2f6c8a1d7e43
+Revises: 8d2b5f3e6a91
+Create Date: 2026-10-18 18:27:45.602813
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2f6c8a1d7e43'
+down_revision = '8d2b5f3e6a91'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('searchable_providers', sa.Column('start_hour', sa.Time(), nullable=True))
+    op.add_column('searchable_providers', sa.Column('end_hour', sa.Time(), nullable=True))
+
+    op.execute("""
+        UPDATE searchable_providers
+        SET start_hour = addresses.start_hour, end_hour = addresses.end_hour
+        FROM addresses
+        WHERE addresses.id = searchable_providers.address_id
+        """)
+
+    # build the index without locking searchable_providers against refreshes
+    with op.get_context().autocommit_block():
+        op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_searchable_providers_hours '
+                   'ON searchable_providers (start_hour, end_hour)')
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS ix_searchable_providers_hours')
+    op.drop_column('searchable_providers', 'end_hour')
+    op.drop_column('searchable_providers', 'start_hour')
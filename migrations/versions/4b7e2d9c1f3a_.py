@@ -0,0 +1,52 @@
+"""add addresses.geog geography column with a GiST index
+
+Revision ID: 4b7e2d9c1f3a
+Revises: 93efa41f5575
+Create Date: 2026-10-18 09:12:41.508312
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from geoalchemy2 import Geography
+
+
+# revision identifiers, used by Alembic.
+revision = '4b7e2d9c1f3a'
+down_revision = '93efa41f5575'
+branch_labels = None
+depends_on = None
+
+# rows updated per statement while backfilling,
+# small enough that no batch holds its row locks for long
+BACKFILL_BATCH_SIZE = 5000
+
+
+def upgrade():
+    # nullable with no default, so postgres doesn't have to rewrite the table
+    op.add_column('addresses', sa.Column('geog', Geography(geometry_type='POINT', srid=4326), nullable=True))
+
+    # commit every batch on its own instead of updating the whole table in one transaction
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+
+        while True:
+            backfilled = connection.execute(sa.text("""
+                UPDATE addresses
+                SET geog = ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)::geography
+                WHERE id IN (
+                    SELECT id FROM addresses
+                    WHERE geog IS NULL AND latitude IS NOT NULL AND longitude IS NOT NULL
+                    LIMIT :batch_size
+                )
+                """), batch_size=BACKFILL_BATCH_SIZE)
+
+            if backfilled.rowcount == 0:
+                break
+
+        # same name geoalchemy uses when it creates the index itself (db.create_all)
+        op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_addresses_geog ON addresses USING gist (geog)')
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS idx_addresses_geog')
+    op.drop_column('addresses', 'geog')
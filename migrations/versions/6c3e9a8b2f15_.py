@@ -0,0 +1,44 @@
+"""cascade deletes of users and addresses to searchable_providers, and drop the unused search indexes on users and providers
+
+Revision ID: 6c3e9a8b2f15
+Revises: 2f6c8a1d7e43
+Create Date: 2026-10-18 21:04:12.318506
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6c3e9a8b2f15'
+down_revision = '2f6c8a1d7e43'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # rows of users and addresses deleted before now
+    op.execute("""
+        DELETE FROM searchable_providers
+        WHERE NOT EXISTS (SELECT 1 FROM users WHERE users.id = searchable_providers.user_id)
+        OR NOT EXISTS (SELECT 1 FROM addresses WHERE addresses.id = searchable_providers.address_id)
+        """)
+
+    op.create_foreign_key('searchable_providers_user_id_fkey', 'searchable_providers', 'users',
+                          ['user_id'], ['id'], ondelete='CASCADE')
+    op.create_foreign_key('searchable_providers_address_id_fkey', 'searchable_providers', 'addresses',
+                          ['address_id'], ['id'], ondelete='CASCADE')
+
+    # the search reads searchable_providers.name and .search_vector (and their own indexes) now
+    with op.get_context().autocommit_block():
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_users_name_trgm')
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_providers_search_vector')
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_name_trgm ON users USING gin (name gin_trgm_ops)')
+        op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_providers_search_vector ON providers USING gin (search_vector)')
+
+    op.drop_constraint('searchable_providers_address_id_fkey', 'searchable_providers', type_='foreignkey')
+    op.drop_constraint('searchable_providers_user_id_fkey', 'searchable_providers', type_='foreignkey')
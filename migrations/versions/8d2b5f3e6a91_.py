@@ -0,0 +1,33 @@
+"""index procedural_wait_times for procedure searches
+
+Revision ID: 8d2b5f3e6a91
+Revises: f71c4d09a6e5
+Create Date: 2026-10-18 17:42:09.318754
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2b5f3e6a91'
+down_revision = 'f71c4d09a6e5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # build the indexes without locking procedural_wait_times against writes
+    with op.get_context().autocommit_block():
+        op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_procedural_wait_times_user_id '
+                   'ON procedural_wait_times (user_id)')
+        op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_procedural_wait_times_procedure_lower '
+                   'ON procedural_wait_times (lower(procedure))')
+        op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_procedural_wait_times_procedure_trgm '
+                   'ON procedural_wait_times USING gin (lower(procedure) gin_trgm_ops)')
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS ix_procedural_wait_times_procedure_trgm')
+    op.execute('DROP INDEX IF EXISTS ix_procedural_wait_times_procedure_lower')
+    op.execute('DROP INDEX IF EXISTS ix_procedural_wait_times_user_id')
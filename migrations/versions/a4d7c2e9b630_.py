@@ -0,0 +1,35 @@
+"""replace the office hours index on searchable_providers with one per branch of the open_at condition
+
+Revision ID: a4d7c2e9b630
+Revises: 6c3e9a8b2f15
+Create Date: 2026-10-18 21:38:50.127734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4d7c2e9b630'
+down_revision = '6c3e9a8b2f15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the open_at condition ORs daytime and overnight hours, which a single btree can't answer.
+    # built without locking searchable_providers against refreshes
+    with op.get_context().autocommit_block():
+        op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_searchable_providers_daytime_hours '
+                   'ON searchable_providers (start_hour, end_hour) WHERE start_hour <= end_hour')
+        op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_searchable_providers_overnight_hours '
+                   'ON searchable_providers (start_hour, end_hour) WHERE start_hour > end_hour')
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_searchable_providers_hours')
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_searchable_providers_hours '
+                   'ON searchable_providers (start_hour, end_hour)')
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_searchable_providers_overnight_hours')
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_searchable_providers_daytime_hours')
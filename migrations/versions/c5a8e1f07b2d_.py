@@ -0,0 +1,29 @@
+"""enable pg_trgm and add a trigram index on users.name
+
+Revision ID: c5a8e1f07b2d
+Revises: 4b7e2d9c1f3a
+Create Date: 2026-10-18 11:03:27.194520
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5a8e1f07b2d'
+down_revision = '4b7e2d9c1f3a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    # build the index without locking users against writes
+    with op.get_context().autocommit_block():
+        op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_name_trgm ON users USING gin (name gin_trgm_ops)')
+
+
+def downgrade():
+    # the extension is left installed, dropping it would drop anything else built on it
+    op.execute('DROP INDEX IF EXISTS ix_users_name_trgm')
@@ -0,0 +1,59 @@
+"""add providers.search_vector tsvector column with a GIN index
+
+Revision ID: e3f9b6a2d814
+Revises: c5a8e1f07b2d
+Create Date: 2026-10-18 13:46:05.318842
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3f9b6a2d814'
+down_revision = 'c5a8e1f07b2d'
+branch_labels = None
+depends_on = None
+
+# rows updated per statement while backfilling,
+# small enough that no batch holds its row locks for long
+BACKFILL_BATCH_SIZE = 5000
+
+
+def upgrade():
+    op.add_column('providers', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+
+    # commit every batch on its own instead of updating the whole table in one transaction
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+
+        # the same weights as ProviderModel.build_search_vector
+        while True:
+            backfilled = connection.execute(sa.text("""
+                UPDATE providers
+                SET search_vector =
+                    setweight(to_tsvector('english'::regconfig, coalesce(subspecialty_or_special_interests, '')), 'A') ||
+                    setweight(to_tsvector('english'::regconfig, coalesce(services_provided, '')), 'B') ||
+                    setweight(to_tsvector('english'::regconfig, coalesce((
+                        SELECT string_agg(procedure, ' ')
+                        FROM procedural_wait_times
+                        WHERE procedural_wait_times.user_id = providers.user_id
+                    ), '')), 'B') ||
+                    setweight(to_tsvector('english'::regconfig, coalesce(research_interests, '')), 'C')
+                WHERE user_id IN (
+                    SELECT user_id FROM providers
+                    WHERE search_vector IS NULL
+                    LIMIT :batch_size
+                )
+                """), batch_size=BACKFILL_BATCH_SIZE)
+
+            if backfilled.rowcount == 0:
+                break
+
+        op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_providers_search_vector ON providers USING gin (search_vector)')
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS ix_providers_search_vector')
+    op.drop_column('providers', 'search_vector')
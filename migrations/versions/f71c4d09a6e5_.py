@@ -0,0 +1,75 @@
+"""add the searchable_providers table search reads its candidates from
+
+Revision ID: f71c4d09a6e5
+Revises: e3f9b6a2d814
+Create Date: 2026-10-18 16:20:51.740216
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from geoalchemy2 import Geography
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'f71c4d09a6e5'
+down_revision = 'e3f9b6a2d814'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # geoalchemy would add a GiST index of its own, it is created below with the others instead
+    op.create_table('searchable_providers',
+                    sa.Column('address_id', sa.Integer(), nullable=False),
+                    sa.Column('user_id', sa.Integer(), nullable=False),
+                    sa.Column('specialty_id', sa.Integer(), nullable=False),
+                    sa.Column('geog', Geography(geometry_type='POINT', srid=4326, spatial_index=False), nullable=False),
+                    sa.Column('name', sa.String(), nullable=False),
+                    sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True),
+                    sa.Column('language_ids', postgresql.ARRAY(sa.Integer()), nullable=False),
+                    sa.Column('designation_ids', postgresql.ARRAY(sa.Integer()), nullable=False),
+                    sa.Column('is_wheelchair_accessible', sa.Boolean(), nullable=False),
+                    sa.Column('is_accepting_new_patients', sa.Boolean(), nullable=False),
+                    sa.Column('consultation_wait', sa.Float(), nullable=True),
+                    sa.PrimaryKeyConstraint('address_id')
+                    )
+
+    # the same rows as SearchableProviderModel.searchable_rows,
+    # loaded before the indexes are built so they are built once
+    op.execute("""
+        INSERT INTO searchable_providers
+        SELECT
+            addresses.id,
+            users.id,
+            providers.specialty_id,
+            addresses.geog,
+            users.name,
+            providers.search_vector,
+            coalesce((SELECT array_agg(language_id) FROM providers_to_languages
+                      WHERE provider_id = users.id), '{}'::integer[]),
+            coalesce((SELECT array_agg(designation_id) FROM providers_to_designations
+                      WHERE provider_id = users.id), '{}'::integer[]),
+            coalesce(addresses.is_wheelchair_accessible, false),
+            coalesce(addresses.is_accepting_new_patients, false),
+            providers.consultation_wait
+        FROM users
+        JOIN providers ON providers.user_id = users.id
+        JOIN addresses ON addresses.user_id = users.id
+        WHERE users.user_type = 0
+        AND users.is_verified_professional
+        AND providers.specialty_id IS NOT NULL
+        AND addresses.geog IS NOT NULL
+        """)
+
+    op.create_index('ix_searchable_providers_user_id', 'searchable_providers', ['user_id'])
+    op.create_index('ix_searchable_providers_specialty_id', 'searchable_providers', ['specialty_id'])
+    op.execute('CREATE INDEX idx_searchable_providers_geog ON searchable_providers USING gist (geog)')
+    op.execute('CREATE INDEX ix_searchable_providers_name_trgm ON searchable_providers USING gin (name gin_trgm_ops)')
+    op.execute('CREATE INDEX ix_searchable_providers_search_vector ON searchable_providers USING gin (search_vector)')
+    op.execute('CREATE INDEX ix_searchable_providers_language_ids ON searchable_providers USING gin (language_ids)')
+    op.execute('CREATE INDEX ix_searchable_providers_designation_ids ON searchable_providers USING gin (designation_ids)')
+
+
+def downgrade():
+    op.drop_table('searchable_providers')
@@ -1,5 +1,6 @@
 from extensions import db
-from geoalchemy2 import Geometry
+from geoalchemy2 import Geography, Geometry
+from sqlalchemy.orm import validates
 
 
 class AddressModel(db.Model):
@@ -23,6 +24,9 @@ class AddressModel(db.Model):
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
     geo = db.Column(Geometry(geometry_type="POINT")) # this should get SRID = 4326 added to it
+    # the same point as latitude and longitude (kept in sync by sync_geog), as a geography
+    # so that distances are in meters. geoalchemy gives it a GiST index (idx_addresses_geog), which is what search uses
+    geog = db.Column(Geography(geometry_type="POINT", srid=4326))
     phone = db.Column(db.String)
     fax = db.Column(db.String)
     is_wheelchair_accessible = db.Column(db.Boolean)
@@ -52,6 +56,21 @@ class AddressModel(db.Model):
         self.start_hour = start_hour
         self.end_hour = end_hour
 
+    @validates('latitude', 'longitude')
+    def sync_geog(self, key: str, value: float) -> float:
+        """
+        Moves geog to the new point whenever latitude or longitude is set,
+        an address missing either of them has no geog (and doesn't show up in searches)
+        """
+        coordinates = {'latitude': self.latitude, 'longitude': self.longitude, key: value}
+
+        if coordinates['latitude'] is None or coordinates['longitude'] is None:
+            self.geog = None
+        else:
+            self.geog = 'SRID=4326;POINT({} {})'.format(coordinates['longitude'], coordinates['latitude'])
+
+        return value
+
     @classmethod
     def find_by_id(cls, id: int):
         return cls.query.filter_by(id=id).first()
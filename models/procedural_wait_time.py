@@ -1,4 +1,5 @@
 from extensions import db
+from sqlalchemy import func
 
 
 class ProceduralWaitTimeModel(db.Model):
@@ -15,7 +16,7 @@ class ProceduralWaitTimeModel(db.Model):
         db.Integer, nullable=False, unique=True,
         primary_key=True)
 
-    user_id = db.Column(db.Integer, db.ForeignKey('providers.user_id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('providers.user_id'), index=True)
     user = db.relationship(
         "ProviderModel", back_populates="procedural_wait_times")
 
@@ -39,3 +40,12 @@ class ProceduralWaitTimeModel(db.Model):
     def delete_from_db(self):
         db.session.delete(self)
         db.session.commit()
+
+
+# procedure searches match lower(procedure), see UserModel.matches_procedure:
+# a btree index for exact names and a trigram index (pg_trgm) for similar ones
+db.Index('ix_procedural_wait_times_procedure_lower',
+         func.lower(ProceduralWaitTimeModel.procedure))
+db.Index('ix_procedural_wait_times_procedure_trgm',
+         func.lower(ProceduralWaitTimeModel.procedure).label('procedure_lower'),
+         postgresql_using='gin', postgresql_ops={'procedure_lower': 'gin_trgm_ops'})
@@ -0,0 +1,113 @@
+"""
+Lightweight, read-only records for the cards on a page of search results.
+
+A card only needs a handful of columns, so search selects just those into named tuples
+instead of loading whole UserModel objects (password hash, long free text profile fields and all)
+into the session. The full profile is still served by /users/<uuid>/profile.
+"""
+from collections import namedtuple
+
+from extensions import db
+from models.address import AddressModel
+from models.procedural_wait_time import ProceduralWaitTimeModel
+from sqlalchemy import any_, bindparam
+from sqlalchemy.dialects.postgresql import ARRAY
+
+SearchResult = namedtuple('SearchResult', [
+    'id', 'uuid', 'name', 'email', 'profile_picture_link', 'provider'])
+
+# nearest_distance is the distance in meters from the search origin to the nearest address
+SearchResultProvider = namedtuple('SearchResultProvider', [
+    'specialty', 'subspecialty_or_special_interests', 'consultation_wait',
+    'addresses', 'procedural_wait_times', 'languages', 'designations', 'nearest_distance'])
+
+# the nearest address (within the radius and passing the filters) is_nearest, and comes first
+SearchResultAddress = namedtuple('SearchResultAddress', [
+    'id', 'address', 'latitude', 'longitude', 'phone', 'fax',
+    'is_wheelchair_accessible', 'is_accepting_new_patients', 'start_hour', 'end_hour', 'is_nearest'])
+
+ADDRESS_COLUMNS = [field for field in SearchResultAddress._fields if field != 'is_nearest']
+
+SearchResultProceduralWaitTime = namedtuple('SearchResultProceduralWaitTime', ['procedure', 'wait_time'])
+
+# specialties, languages and designations
+SearchResultTag = namedtuple('SearchResultTag', ['id', 'name'])
+
+
+def build_search_results(rows: list) -> list:
+    """
+    Takes in the rows of a page of search results, each with the card columns
+    (user_id, uuid, name, email, profile_picture_link, specialty_id, specialty_name,
+    subspecialty_or_special_interests, consultation_wait, nearest_address_id, nearest_distance)
+    Returns a SearchResult for each row, in the same order.
+
+    The addresses, procedural wait times, languages and designations of the whole page
+    are loaded with one query each.
+    """
+    # import down here to avoid circular imports
+    from models.designation import DesignationModel
+    from models.language import LanguageModel
+    from models.user import (provider_to_designation_association_table,
+                             provider_to_language_association_table)
+
+    user_ids = bindparam('user_ids', [row.user_id for row in rows], type_=ARRAY(db.Integer))
+    nearest_address_ids = {row.nearest_address_id for row in rows}
+
+    addresses = {row.user_id: [] for row in rows}
+    procedural_wait_times = {row.user_id: [] for row in rows}
+    languages = {row.user_id: [] for row in rows}
+    designations = {row.user_id: [] for row in rows}
+
+    if rows:
+        address_rows = db.session.\
+            query(AddressModel.user_id, *[getattr(AddressModel, field) for field in ADDRESS_COLUMNS]).\
+            filter(AddressModel.user_id == any_(user_ids)).\
+            order_by(AddressModel.id)
+
+        for user_id, *address in address_rows:
+            address = SearchResultAddress(*address, is_nearest=address[0] in nearest_address_ids)
+
+            if address.is_nearest:
+                addresses[user_id].insert(0, address)
+            else:
+                addresses[user_id].append(address)
+
+        procedural_wait_time_rows = db.session.\
+            query(ProceduralWaitTimeModel.user_id, ProceduralWaitTimeModel.procedure, ProceduralWaitTimeModel.wait_time).\
+            filter(ProceduralWaitTimeModel.user_id == any_(user_ids)).\
+            order_by(ProceduralWaitTimeModel.id)
+
+        for user_id, procedure, wait_time in procedural_wait_time_rows:
+            procedural_wait_times[user_id].append(SearchResultProceduralWaitTime(procedure, wait_time))
+
+        for model, association_table, tags in ((LanguageModel, provider_to_language_association_table, languages),
+                                               (DesignationModel, provider_to_designation_association_table, designations)):
+            tag_rows = db.session.\
+                query(association_table.c.provider_id, model.id, model.name).\
+                join(model).\
+                filter(association_table.c.provider_id == any_(user_ids)).\
+                order_by(model.name)
+
+            for user_id, tag_id, tag_name in tag_rows:
+                tags[user_id].append(SearchResultTag(tag_id, tag_name))
+
+    return [
+        SearchResult(
+            id=row.user_id,
+            uuid=row.uuid,
+            name=row.name,
+            email=row.email,
+            profile_picture_link=row.profile_picture_link,
+            provider=SearchResultProvider(
+                specialty=SearchResultTag(row.specialty_id, row.specialty_name) if row.specialty_id else None,
+                subspecialty_or_special_interests=row.subspecialty_or_special_interests,
+                consultation_wait=row.consultation_wait,
+                addresses=addresses[row.user_id],
+                procedural_wait_times=procedural_wait_times[row.user_id],
+                languages=languages[row.user_id],
+                designations=designations[row.user_id],
+                nearest_distance=row.nearest_distance,
+            )
+        )
+        for row in rows
+    ]
@@ -0,0 +1,280 @@
+from itertools import chain
+
+from claims import bump_claims_version
+from extensions import db
+from geoalchemy2 import Geography
+from models.address import AddressModel
+from sqlalchemy import event, func, inspect, literal_column, select
+from sqlalchemy.dialects.postgresql import ARRAY, TSVECTOR
+
+# the users columns searches filter on or show on result cards
+SEARCHED_USER_COLUMNS = ('name', 'email', 'profile_picture_link', 'user_type', 'is_verified_professional')
+
+
+class SearchableProviderModel(db.Model):
+    """
+    Everything search filters and sorts on, one row per (provider, address),
+    for only the providers that can show up in searches (public, verified, with a specialty).
+
+    It is a copy of users, providers, addresses and the language and designation association tables,
+    so search can find its candidates without joining any of them.
+    A providers rows are rebuilt by refresh in the same transaction as every change to their profile
+    (see listen_for_searchable_changes), and deleted with their user or address.
+
+    Methods:
+    refresh,
+    refresh_all,
+    mvt_tile
+    """
+    __tablename__ = 'searchable_providers'
+
+    address_id = db.Column(db.Integer, db.ForeignKey('addresses.id', ondelete='CASCADE'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    specialty_id = db.Column(db.Integer, nullable=False, index=True)
+
+    # geoalchemy gives it a GiST index (idx_searchable_providers_geog)
+    geog = db.Column(Geography(geometry_type="POINT", srid=4326), nullable=False)
+
+    name = db.Column(db.String, nullable=False)
+    search_vector = db.Column(TSVECTOR)
+    language_ids = db.Column(ARRAY(db.Integer), nullable=False)
+    designation_ids = db.Column(ARRAY(db.Integer), nullable=False)
+    is_wheelchair_accessible = db.Column(db.Boolean, nullable=False)
+    is_accepting_new_patients = db.Column(db.Boolean, nullable=False)
+    consultation_wait = db.Column(db.Float)
+    start_hour = db.Column(db.Time)
+    end_hour = db.Column(db.Time)
+
+    __table_args__ = (
+        db.Index('ix_searchable_providers_name_trgm', 'name',
+                 postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_searchable_providers_search_vector', 'search_vector', postgresql_using='gin'),
+        db.Index('ix_searchable_providers_language_ids', 'language_ids', postgresql_using='gin'),
+        db.Index('ix_searchable_providers_designation_ids', 'designation_ids', postgresql_using='gin'),
+        # for the open_at / open_now filters, one per branch of the condition in UserModel.filter_search_candidates
+        db.Index('ix_searchable_providers_daytime_hours', 'start_hour', 'end_hour',
+                 postgresql_where=start_hour <= end_hour),
+        db.Index('ix_searchable_providers_overnight_hours', 'start_hour', 'end_hour',
+                 postgresql_where=start_hour > end_hour),
+    )
+
+    @staticmethod
+    def searchable_rows():
+        """
+        Returns a query for the rows of every searchable provider, built from the normalized tables
+        """
+        # import down here to avoid circular imports
+        from models.user import (ProviderModel, UserModel,
+                                 provider_to_designation_association_table,
+                                 provider_to_language_association_table)
+
+        no_ids = literal_column("'{}'::integer[]")
+
+        language_ids = select([func.array_agg(provider_to_language_association_table.c.language_id)]).\
+            where(provider_to_language_association_table.c.provider_id == UserModel.id).\
+            as_scalar()
+
+        designation_ids = select([func.array_agg(provider_to_designation_association_table.c.designation_id)]).\
+            where(provider_to_designation_association_table.c.provider_id == UserModel.id).\
+            as_scalar()
+
+        return db.session.\
+            query(AddressModel.id,
+                  UserModel.id,
+                  ProviderModel.specialty_id,
+                  AddressModel.geog,
+                  UserModel.name,
+                  ProviderModel.search_vector,
+                  func.coalesce(language_ids, no_ids),
+                  func.coalesce(designation_ids, no_ids),
+                  func.coalesce(AddressModel.is_wheelchair_accessible, False),
+                  func.coalesce(AddressModel.is_accepting_new_patients, False),
+                  ProviderModel.consultation_wait,
+                  AddressModel.start_hour,
+                  AddressModel.end_hour).\
+            select_from(UserModel).\
+            join(ProviderModel, ProviderModel.user_id == UserModel.id).\
+            join(AddressModel, AddressModel.user_id == UserModel.id).\
+            filter(
+                UserModel.user_type == 0,
+                UserModel.is_verified_professional == True,
+                ProviderModel.specialty_id.isnot(None),
+                AddressModel.geog.isnot(None)
+            )
+
+    @classmethod
+    def insert_rows(cls, rows) -> set:
+        """
+        Returns the specialty ids of the rows inserted
+        """
+        table = cls.__table__
+
+        inserted = db.session.execute(table.insert().from_select(
+            ['address_id', 'user_id', 'specialty_id', 'geog', 'name', 'search_vector', 'language_ids',
+             'designation_ids', 'is_wheelchair_accessible', 'is_accepting_new_patients', 'consultation_wait',
+             'start_hour', 'end_hour'],
+            rows.statement).returning(table.c.specialty_id))
+
+        return {row.specialty_id for row in inserted}
+
+    @classmethod
+    def delete_rows(cls, criterion=None) -> set:
+        """
+        Deletes the rows matching criterion (every row without one)
+        Returns the specialty ids of the rows deleted
+        """
+        table = cls.__table__
+        statement = table.delete()
+
+        if criterion is not None:
+            statement = statement.where(criterion)
+
+        deleted = db.session.execute(statement.returning(table.c.specialty_id))
+
+        return {row.specialty_id for row in deleted}
+
+    @classmethod
+    def refresh(cls, *user_ids) -> set:
+        """
+        Rebuilds the rows of the providers with user_ids, in the current transaction (it doesn't commit).
+        Commits that change a provider do this already, see listen_for_searchable_changes.
+        Providers who aren't searchable (anymore) are left without rows.
+        Returns the specialty ids of the rows deleted and inserted, ie, the specialties whose searches changed
+        """
+        # import down here to avoid circular imports
+        from models.user import UserModel
+
+        # two refreshes of the same provider at once would both insert their rows,
+        # so they take turns (the locks are released when the transaction ends),
+        # always locking in the same order so two refreshes can't wait on each other
+        for user_id in sorted(user_ids):
+            db.session.execute(select([func.pg_advisory_xact_lock(user_id)]))
+
+        deleted = cls.delete_rows(cls.user_id.in_(user_ids))
+        inserted = cls.insert_rows(cls.searchable_rows().filter(UserModel.id.in_(user_ids)))
+
+        return deleted | inserted
+
+    @classmethod
+    def refresh_all(cls):
+        """
+        Rebuilds every row, eg, after the tables it copies were changed by hand in the database
+        (changes made through the models are refreshed as they are committed).
+        Every users claims version is bumped too, in case the hand made changes were to claimed columns.
+        """
+        # import down here to avoid circular imports
+        from models.user import UserModel
+
+        specialty_ids = cls.delete_rows() | cls.insert_rows(cls.searchable_rows())
+
+        db.session.info.setdefault('searched_specialty_ids', set()).update(specialty_ids)
+        db.session.commit()
+
+        bump_claims_version(*[uuid for uuid, in db.session.query(UserModel.uuid)])
+
+    @classmethod
+    def mvt_tile(cls, bounds: tuple, extent: int = 4096, buffer: int = 64) -> bytes:
+        """
+        Takes in the (west, south, east, north) of a map tile in web mercator meters
+        Returns a Mapbox Vector Tile (ST_AsMVT) with a "providers" layer of every searchable office
+        on the tile, each with the providers uuid, specialty_id and the offices flags.
+        extent is the tiles width in tile coordinates, and buffer how far past its edges offices are kept.
+        """
+        # import down here to avoid circular imports
+        from models.user import UserModel
+
+        envelope = func.ST_MakeEnvelope(*bounds, 3857)
+
+        # the && (bounding boxes overlap) is answered by the GiST index on searchable_providers.geog
+        offices = db.session.\
+            query(func.ST_AsMVTGeom(func.ST_Transform(func.geometry(cls.geog), 3857), envelope,
+                                    extent, buffer, True).label('geom'),
+                  UserModel.uuid,
+                  cls.specialty_id,
+                  cls.is_wheelchair_accessible,
+                  cls.is_accepting_new_patients).\
+            select_from(cls).\
+            join(UserModel, UserModel.id == cls.user_id).\
+            filter(cls.geog.op('&&', return_type=db.Boolean)(func.geography(func.ST_Transform(envelope, 4326)))).\
+            subquery('offices')
+
+        tile = db.session.\
+            query(func.ST_AsMVT(literal_column('offices'), 'providers', extent, 'geom')).\
+            select_from(offices).\
+            scalar()
+
+        # postgres hands back a memoryview of the bytea, and no rows make an empty tile
+        return bytes(tile or b'')
+
+
+def listen_for_searchable_changes():
+    """
+    Notes the providers whose users, providers, addresses or procedural_wait_times rows are flushed,
+    and refreshes their searchable_providers rows right before the transaction is committed,
+    so the change and its rows are committed together (and never one without the other).
+    Once committed, the cached searches of every specialty they had or have now are dropped.
+    """
+    # import down here to avoid circular imports
+    from models.procedural_wait_time import ProceduralWaitTimeModel
+    from models.user import ProviderModel, UserModel
+
+    def changed_user_id(instance):
+        if isinstance(instance, UserModel):
+            state = inspect(instance)
+
+            if any(state.attrs[column].history.has_changes() for column in SEARCHED_USER_COLUMNS):
+                return instance.id
+        elif isinstance(instance, (ProviderModel, AddressModel, ProceduralWaitTimeModel)):
+            return instance.user_id
+
+        return None
+
+    @event.listens_for(db.session, 'before_flush')
+    def note_searched_specialties(session, flush_context, instances):
+        # the rows deleted with their user or address in this flush are gone by the time refresh
+        # runs, so the specialties of the rows changed providers have now are noted first
+        user_ids = {changed_user_id(instance) for instance in chain(session.new, session.dirty, session.deleted)}
+        user_ids -= session.info.setdefault('noted_user_ids', set())
+        user_ids.discard(None)
+
+        if user_ids:
+            session.info['noted_user_ids'].update(user_ids)
+
+            rows = session.execute(
+                select([SearchableProviderModel.specialty_id]).
+                where(SearchableProviderModel.user_id.in_(user_ids)).
+                distinct())
+
+            session.info.setdefault('searched_specialty_ids', set()).update(row.specialty_id for row in rows)
+
+    @event.listens_for(db.session, 'after_flush')
+    def note_searchable_changes(session, flush_context):
+        # the new, dirty and deleted instances (and their history) are still those of the flush here
+        user_ids = {changed_user_id(instance) for instance in chain(session.new, session.dirty, session.deleted)}
+        user_ids.discard(None)
+
+        if user_ids:
+            session.info.setdefault('searchable_user_ids', set()).update(user_ids)
+
+    @event.listens_for(db.session, 'before_commit')
+    def refresh_searchable_changes(session):
+        # the commit flushes what's left after this, so flush it first and refresh every change
+        session.flush()
+
+        user_ids = session.info.pop('searchable_user_ids', None)
+        session.info.pop('noted_user_ids', None)
+
+        if user_ids:
+            session.info.setdefault('searched_specialty_ids', set()).update(SearchableProviderModel.refresh(*user_ids))
+
+    @event.listens_for(db.session, 'after_commit')
+    def invalidate_searched_specialties(session):
+        # import down here to avoid circular imports
+        from resources.user.utils.search_cache import invalidate_search_cache
+
+        invalidate_search_cache(*session.info.pop('searched_specialty_ids', ()))
+
+    @event.listens_for(db.session, 'after_rollback')
+    def forget_searchable_changes(session):
+        for key in ('searchable_user_ids', 'noted_user_ids', 'searched_specialty_ids'):
+            session.info.pop(key, None)
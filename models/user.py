@@ -1,10 +1,32 @@
-from datetime import datetime
+from collections import namedtuple
+from datetime import datetime, time
 
+from claims import listen_for_claim_changes
 from extensions import db
 from geoalchemy2 import Geometry
 from models.address import AddressModel
 from models.procedural_wait_time import ProceduralWaitTimeModel
-from sqlalchemy import asc, func, text
+from models.searchable_provider import listen_for_searchable_changes
+from models.user_cache import listen_for_user_changes
+from sqlalchemy import (Time, and_, bindparam, cast, func, literal,
+                        literal_column, null, or_, select, true, tuple_)
+from sqlalchemy.dialects.postgresql import ARRAY, TSVECTOR, array_agg
+
+# A page of search results,
+# next_after is where the next page starts (see UserModel.get_users_within_radius)
+SearchPage = namedtuple('SearchPage', ['items', 'total', 'next_after'])
+
+# How the "score" sort blends distance and waits, lower scores first:
+# distance_weight * km to the nearest office
+# + wait_weight * consultation wait
+# + procedure_wait_weight * wait for the procedure searched for (if any)
+# where a wait the provider hasn't entered counts as missing_wait.
+# Only providers with an office among the candidates nearest offices are scored.
+SearchScoring = namedtuple('SearchScoring', [
+    'distance_weight', 'wait_weight', 'procedure_wait_weight', 'missing_wait', 'candidates'])
+
+# the text search configuration profiles are indexed and searched with
+SEARCH_TEXT_CONFIG = literal_column("'english'::regconfig")
 
 
 class UserModel(db.Model):
@@ -18,6 +40,8 @@ class UserModel(db.Model):
     find_by_id,
     find_by_uuid,
     get_users_within_radius,
+    get_search_facets,
+    get_search_clusters,
     """
     __tablename__ = 'users'
 
@@ -116,9 +140,13 @@ class UserModel(db.Model):
     @classmethod
     def find_by_uuid(cls, uuid: str) -> object:
         """
-        Returns a user object for a given user uuid (external)
+        Returns a user object for a given user uuid (external).
+        Users are memoized for the request and cached by the worker, see models/user_cache.py
         """
-        return cls.query.filter_by(uuid=uuid).first()
+        # import down here to avoid circular imports
+        from models.user_cache import find_user_by_uuid
+
+        return find_user_by_uuid(cls, uuid)
 
     @classmethod
     def find_by_list_of_emails(cls, emails: list) -> list:
@@ -152,8 +180,219 @@ class UserModel(db.Model):
         return matching_admins
 
 
+    @staticmethod
+    def search_candidates(columns: list, specialty_id: int, radius: int, u_geo: str):
+        """
+        Returns a query for columns of the searchable_providers rows (one per provider and address)
+        of a specialty with an address within radius (in meters) of u_geo
+        """
+        # import down here to avoid circular imports
+        from models.searchable_provider import SearchableProviderModel
+
+        # geography distances are in meters, and ST_DWithin
+        # is answered by the GiST index on searchable_providers.geog
+        return db.session.\
+            query(*columns).\
+            select_from(SearchableProviderModel).\
+            filter(
+                SearchableProviderModel.specialty_id == specialty_id,
+                func.ST_DWithin(SearchableProviderModel.geog, func.ST_GeogFromText(u_geo), radius)
+            )
+
+    @staticmethod
+    def filter_search_candidates(
+            query,
+            name: str = None,
+            name_match: str = 'contains',
+            text_query: str = None,
+            language_ids: list = None,
+            designation_ids: list = None,
+            is_wheelchair_accessible: bool = None,
+            is_accepting_new_patients: bool = None,
+            procedure: str = None,
+            procedure_match: str = 'exact',
+            max_procedure_wait: float = None,
+            open_at: time = None,
+            open_now: bool = False,
+            office_timezone: str = None):
+        """
+        Returns query (from search_candidates) narrowed down by the search filters,
+        see get_users_within_radius
+        """
+        # import down here to avoid circular imports
+        from models.searchable_provider import SearchableProviderModel
+
+        if name and name_match == "similar":
+            # true when some word in the name is at least pg_trgm.word_similarity_threshold (0.6)
+            # similar to name, eg "jon smyth" finds "Dr. John Smith"
+            # (the % is doubled for psycopg2, postgres gets %>)
+            query = query.filter(
+                SearchableProviderModel.name.op('%%>', return_type=db.Boolean)(name))
+        elif name:
+            # ilike for case insensitive matching on psql,
+            # with any % and _ the user typed matched literally instead of as wildcards
+            # (backslash is postgres' default LIKE escape)
+            escaped_name = name.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            query = query.filter(
+                SearchableProviderModel.name.ilike('%{}%'.format(escaped_name)))
+
+        if text_query:
+            # plain text in, so nothing the user types can be a tsquery syntax error
+            query = query.filter(SearchableProviderModel.search_vector.op('@@', return_type=db.Boolean)(
+                func.plainto_tsquery(SEARCH_TEXT_CONFIG, text_query)))
+
+        # && (overlap) is answered by the GIN indexes on the id arrays
+        if language_ids:
+            query = query.filter(SearchableProviderModel.language_ids.overlap(
+                bindparam('language_ids', language_ids, type_=ARRAY(db.Integer))))
+
+        if designation_ids:
+            query = query.filter(SearchableProviderModel.designation_ids.overlap(
+                bindparam('designation_ids', designation_ids, type_=ARRAY(db.Integer))))
+
+        # the office within the radius has to be wheelchair accessible / accepting new patients
+        if is_wheelchair_accessible:
+            query = query.filter(SearchableProviderModel.is_wheelchair_accessible == True)
+
+        if is_accepting_new_patients:
+            query = query.filter(SearchableProviderModel.is_accepting_new_patients == True)
+
+        if open_now:
+            # the time of day it is now where the offices are, according to the database clock
+            open_at = cast(func.timezone(office_timezone, func.now()), Time)
+
+        if open_at is not None:
+            start_hour = SearchableProviderModel.start_hour
+            end_hour = SearchableProviderModel.end_hour
+
+            # offices without hours don't show up, we can't tell if they're open.
+            # hours that start and end at the same time are around the clock,
+            # and hours that end before they start run overnight (eg 20:00 - 02:00).
+            # each branch is answered by the partial index on searchable_providers with its condition
+            query = query.filter(or_(
+                and_(start_hour <= end_hour, or_(start_hour == end_hour,
+                                                 and_(start_hour <= open_at, end_hour > open_at))),
+                and_(start_hour > end_hour, or_(start_hour <= open_at, end_hour > open_at))
+            ))
+
+        # only the candidates' own wait times are joined (by the index on procedural_wait_times.user_id),
+        # or the matching procedures (by the indexes on lower(procedure)) when that's fewer rows
+        if procedure:
+            matches_procedure = UserModel.matches_procedure(procedure, procedure_match)
+
+            if max_procedure_wait is not None:
+                matches_procedure = matches_procedure & (ProceduralWaitTimeModel.wait_time <= max_procedure_wait)
+
+            query = query.join(ProceduralWaitTimeModel,
+                               (ProceduralWaitTimeModel.user_id == SearchableProviderModel.user_id) & matches_procedure)
+
+        return query
+
+    @staticmethod
+    def matches_procedure(procedure: str, procedure_match: str = 'exact'):
+        """
+        Returns the condition for the procedural_wait_times rows of procedure, ignoring case.
+        procedure_match is either "exact" (the whole name) or "similar" (a word in the name is
+        spelled similarly to it, eg "colonoscopy" finds "Colonoscopy with biopsy").
+        Both are answered by the indexes on lower(procedure).
+        """
+        procedure_name = func.lower(ProceduralWaitTimeModel.procedure)
+
+        if procedure_match == "similar":
+            # the % is doubled for psycopg2, postgres gets %>
+            return procedure_name.op('%%>', return_type=db.Boolean)(procedure.lower())
+
+        return procedure_name == procedure.lower()
+
+    @staticmethod
+    def sort_search_candidates(specialty_id: int, radius: int, u_geo: str, filters: dict, sort: str, with_total: bool):
+        """
+        Returns a query for the (user_id, sort_key, total) of every provider matching the search,
+        see get_users_within_radius
+        """
+        # import down here to avoid circular imports
+        from models.searchable_provider import SearchableProviderModel
+
+        name = filters['name']
+        text_query = filters['text_query']
+        procedure = filters.get('procedure')
+
+        # every sort key is aggregated over the rows of a provider (one per address within the radius)
+        # users.id breaks ties so that pages never overlap
+        if sort == "wait":
+            # providers without a wait go last, and still need a value to compare against in cursors
+            sort_key = func.coalesce(func.min(SearchableProviderModel.consultation_wait), float('inf'))
+        elif sort == "name" and name:
+            # pg_trgm's word similarity distance from name to the providers name,
+            # 0 for an exact match up to 1 for nothing in common
+            sort_key = func.min(SearchableProviderModel.name.op('<->>', return_type=db.Float)(name))
+        elif sort == "procedure_wait" and procedure:
+            # the shortest wait for the procedure, its wait times are joined in by filter_search_candidates
+            sort_key = func.coalesce(func.min(ProceduralWaitTimeModel.wait_time), float('inf'))
+        elif sort == "relevance" and text_query:
+            # negated so the best match comes first in the ascending order pages are in
+            sort_key = -func.max(func.ts_rank_cd(SearchableProviderModel.search_vector,
+                                                 func.plainto_tsquery(SEARCH_TEXT_CONFIG, text_query)))
+        else:
+            # distance to the nearest address
+            sort_key = func.min(func.ST_Distance(SearchableProviderModel.geog, func.ST_GeogFromText(u_geo)))
+
+        columns = [SearchableProviderModel.user_id.label('user_id'), sort_key.label('sort_key')]
+
+        if with_total:
+            # the window function returns the total number of matches on every row,
+            # so we don't need a second COUNT query to paginate
+            columns.append(func.count().over().label('total'))
+
+        return UserModel.filter_search_candidates(
+            UserModel.search_candidates(columns, specialty_id, radius, u_geo), **filters).\
+            group_by(SearchableProviderModel.user_id)
+
+    @staticmethod
+    def score_search_candidates(specialty_id: int, radius: int, u_geo: str, filters: dict,
+                                procedure: str, procedure_match: str, scoring: SearchScoring, with_total: bool):
+        """
+        Returns a query for the (user_id, sort_key, total) of the providers matching the search
+        with an office among the scoring.candidates nearest offices, scored by scoring
+        """
+        # import down here to avoid circular imports
+        from models.searchable_provider import SearchableProviderModel
+
+        origin = func.ST_GeogFromText(u_geo)
+
+        # the nearest offices, straight from the GiST index on searchable_providers.geog (<-> is a KNN search),
+        # so only the top candidates are ever scored
+        nearest = UserModel.filter_search_candidates(
+            UserModel.search_candidates([SearchableProviderModel.user_id,
+                                         SearchableProviderModel.consultation_wait,
+                                         func.ST_Distance(SearchableProviderModel.geog, origin).label('distance')],
+                                        specialty_id, radius, u_geo), **filters).\
+            order_by(SearchableProviderModel.geog.op('<->')(origin)).\
+            limit(scoring.candidates).\
+            subquery('nearest')
+
+        score = scoring.distance_weight * func.min(nearest.c.distance) / 1000 + \
+            scoring.wait_weight * func.coalesce(func.min(nearest.c.consultation_wait), scoring.missing_wait)
+
+        if procedure:
+            procedure_wait = select([func.min(ProceduralWaitTimeModel.wait_time)]).\
+                where(ProceduralWaitTimeModel.user_id == nearest.c.user_id).\
+                where(UserModel.matches_procedure(procedure, procedure_match)).\
+                as_scalar()
+
+            score = score + scoring.procedure_wait_weight * func.coalesce(procedure_wait, scoring.missing_wait)
+
+        columns = [nearest.c.user_id.label('user_id'), score.label('sort_key')]
+
+        if with_total:
+            columns.append(func.count().over().label('total'))
+
+        return db.session.\
+            query(*columns).\
+            group_by(nearest.c.user_id)
+
+    @staticmethod
     def get_users_within_radius(
-            self,
             searcher_id: int,
             specialty_id: int,
             radius: int,
@@ -164,121 +403,307 @@ class UserModel(db.Model):
             language_ids: list = None,
             designation_ids: list = None,
             is_wheelchair_accessible: bool = None,
-            is_accepting_new_patients: bool = None) -> list:
+            is_accepting_new_patients: bool = None,
+            name_match: str = 'contains',
+            text_query: str = None,
+            procedure: str = None,
+            procedure_match: str = 'exact',
+            max_procedure_wait: float = None,
+            open_at: time = None,
+            open_now: bool = False,
+            office_timezone: str = None,
+            scoring: SearchScoring = None,
+            per_page: int = 6,
+            after: tuple = None,
+            with_total: bool = True) -> SearchPage:
         """
-        Return all users of a certain specialty within a given radius (in meters) of this city.
-        Sorting by the distance of a sphere is less accurate than a spheroid, but faster
-        order by distance from lat long, before paginate       
+        Return all users of a certain specialty within a given radius (in meters) of u_geo, one page at a time.
+
+        Filtering, sorting, the page and the total number of matches are all computed
+        by one bind-parameterized query, and candidates are found in searchable_providers alone
+        (see SearchableProviderModel). Id lists are bound as arrays, so every search
+        has the same shape (and postgres can reuse its plan) no matter how many
+        providers are nearby or how many filters were picked.
+        sort is either "dist" (distance to the nearest address), "wait" (consultation wait),
+        "name" (closest name match first, needs a name),
+        "relevance" (best text_query match first, needs a text_query),
+        "procedure_wait" (shortest wait for procedure first, needs a procedure)
+        or "score" (distance and waits blended by scoring, see SearchScoring,
+        with the wait for procedure if one is given).
+
+        procedure (matched by procedure_match, see matches_procedure) only finds providers who do it,
+        with a wait of at most max_procedure_wait if given. The "score" sort doesn't filter on it,
+        a provider without the procedure is scored with scoring.missing_wait instead.
+
+        name_match is either "contains" (the name contains the text, ignoring case)
+        or "similar" (a word in the name is spelled similarly to the text, so typos still match).
+        Both are answered by the trigram index on searchable_providers.name.
+
+        text_query matches the words in the providers profile (see ProviderModel.build_search_vector),
+        using the GIN index on searchable_providers.search_vector.
+
+        is_wheelchair_accessible and is_accepting_new_patients need an office within the radius
+        that is wheelchair accessible / accepting new patients.
+        open_at (a time of day) needs an office within the radius that is open then,
+        and open_now one that is open right now in office_timezone (eg 'America/Toronto').
+
+        Pages are either numbered (page) or, when after is given, start right after the
+        (sort value, user id) of the last result of the previous page. The sort value is computed per search,
+        so every match is still found and sorted for any page, but after drops the earlier matches before
+        the card columns and nearest address are looked up, where an offset would look them up for every
+        skipped row too. The SearchPage returned has
+        the after for the next page in next_after (None on the last page), and
+        its items are SearchResult records (see models/search_result.py), not UserModels.
+        with_total=False skips counting every match, total is None then.
         """
-        # import down here to avoid circular imports?
-        from models.language import LanguageModel
-        from models.designation import DesignationModel
-
+        # import down here to avoid circular imports
+        from models.search_result import build_search_results
+        from models.searchable_provider import SearchableProviderModel
+        from models.specialty import SpecialtyModel
 
-        # query to get addresses within distance (in meters)
-        # and return only one result per user
-        # addresses_query = db.session.\
-        #     query(AddressModel).\
-        #     filter(func.ST_Distance_Sphere(AddressModel.geo, u_geo) < radius).\
-        #     distinct(AddressModel.user_id).\
-        #     subquery()
-
-        address_qualified_users = db.session.execute("""SELECT DISTINCT addresses.user_id 
-                                                     FROM addresses WHERE ST_DWithin(addresses.geo, '{}', {});""".\
-                                                        format(u_geo, radius))
-
-        # these should be strings for raw sql query
-        user_ids_matching = [str(row[0]) for row in address_qualified_users]
-            
-
-        # # im currently suspecting that its these joins that are messing this up massively
-        # # cause the same person shouldnt be showing up twice for having two addresses
-        # # based on the distinct on user_id above
-        # # UNLESS its the joins that are royally messing things up
-        # matching_users = db.session.\
-        #     query(UserModel).\
-        #     join(ProviderModel).\
-        #     join(AddressModel).\
-        #     filter(
-        #         # regular search
-        #         ProviderModel.specialty_id == specialty_id,
-        #         UserModel.user_type == 0,
-        #         UserModel.is_verified_professional == True,
-        #         UserModel.id.in_(user_ids_matching)
-        #     )
-
-        
-        if sort == "dist":
-            matching_user_ids = db.session.execute("""SELECT DISTINCT ON (users.id) users.id AS users_id
-                                        FROM users
-                                        JOIN addresses ON users.id = addresses.user_id
-                                        LEFT OUTER JOIN providers ON users.id = providers.user_id
-                                        WHERE 
-                                        providers.specialty_id = {}
-                                            AND users.user_type = 0
-                                            AND users.id IN ({})
-                                        GROUP BY users.id, providers.user_id, addresses.id
-                                        ORDER BY users.id, ST_Distance(addresses.geo, '{}');""".\
-                                            format(specialty_id, ', '.join(user_ids_matching), u_geo))
-        elif sort == "wait":
-            matching_user_ids = db.session.execute("""SELECT users.id 
-                                          FROM users 
-                                          JOIN providers ON users.id = providers.user_id 
-                                          WHERE providers.specialty_id = {} 
-	                                      AND users.user_type = 0
-                                          AND users.id IN ({}) 
-                                          GROUP BY users.id, providers.user_id
-                                          ORDER BY providers.consultation_wait;
-                                          """.format(specialty_id, ', '.join(user_ids_matching)))
-
-
-        # ints for orm query,
-        # str for sort
-        int_user_ids = []
-        str_user_ids = []
-
-        for count, row in enumerate(matching_user_ids):
-            int_user_ids.append(row[0])
-            str_user_ids.append("WHEN users.id = {} THEN {}".format(str(row[0]), str(count + 1)))
-            # another possible way is
-            # ORDER BY  id=1 DESC, id=3 DESC, id=2 DESC, id=4 DESC
-            # str_user_ids.append("users.id = {} DESC,".format(str(row[0])))
-
-        if str_user_ids:
-            matching_users = db.session.query(UserModel).\
-                                        join(ProviderModel).\
-                                        filter(UserModel.id.in_(int_user_ids)).\
-                                        order_by(text(""" CASE {} ELSE 0 END""".format(' '.join(str_user_ids))))
+        filters = dict(
+            name=name,
+            name_match=name_match,
+            text_query=text_query,
+            language_ids=language_ids,
+            designation_ids=designation_ids,
+            is_wheelchair_accessible=is_wheelchair_accessible,
+            is_accepting_new_patients=is_accepting_new_patients,
+            open_at=open_at,
+            open_now=open_now,
+            office_timezone=office_timezone)
+
+        if sort == "score" and scoring:
+            matching_users = UserModel.score_search_candidates(
+                specialty_id, radius, u_geo, filters, procedure, procedure_match, scoring, with_total)
+        else:
+            filters.update(procedure=procedure, procedure_match=procedure_match, max_procedure_wait=max_procedure_wait)
+            matching_users = UserModel.sort_search_candidates(
+                specialty_id, radius, u_geo, filters, sort, with_total)
+
+        # matches are counted before we skip ahead to the page,
+        # so the total is the same on every page
+        matches = matching_users.subquery('matches')
+
+        # every match's nearest address that passes the filters, in a KNN (<->) scan of the GiST index
+        # on searchable_providers.geog per row of the page, so only the page's providers are looked at
+        origin = func.ST_GeogFromText(u_geo)
+        nearest_address = UserModel.filter_search_candidates(
+            UserModel.search_candidates([SearchableProviderModel.address_id,
+                                         func.ST_Distance(SearchableProviderModel.geog, origin).label('distance')],
+                                        specialty_id, radius, u_geo), **filters).\
+            filter(SearchableProviderModel.user_id == matches.c.user_id).\
+            order_by(SearchableProviderModel.geog.op('<->')(origin)).\
+            limit(1).\
+            subquery().\
+            lateral('nearest_address')
+
+        # only the columns a result card shows, see models/search_result.py
+        page_columns = [
+            matches.c.user_id,
+            UserModel.uuid,
+            UserModel.name,
+            UserModel.email,
+            UserModel.profile_picture_link,
+            ProviderModel.specialty_id,
+            SpecialtyModel.name.label('specialty_name'),
+            ProviderModel.subspecialty_or_special_interests,
+            ProviderModel.consultation_wait,
+            nearest_address.c.address_id.label('nearest_address_id'),
+            nearest_address.c.distance.label('nearest_distance'),
+            matches.c.sort_key,
+        ]
+
+        if with_total:
+            page_columns.append(matches.c.total)
+
+        page_query = db.session.\
+            query(*page_columns).\
+            select_from(matches).\
+            join(UserModel, matches.c.user_id == UserModel.id).\
+            join(ProviderModel, ProviderModel.user_id == UserModel.id).\
+            outerjoin(SpecialtyModel, SpecialtyModel.id == ProviderModel.specialty_id).\
+            join(nearest_address, true()).\
+            order_by(matches.c.sort_key, matches.c.user_id)
+
+        if after is not None:
+            page_query = page_query.filter(
+                tuple_(matches.c.sort_key, matches.c.user_id) > tuple_(*after))
+        else:
+            page = max(page, 1)
+            page_query = page_query.offset((page - 1) * per_page)
+
+        # one extra row tells us if there is a next page without counting
+        rows = page_query.limit(per_page + 1).all()
+
+        next_after = None
+        if len(rows) > per_page:
+            rows = rows[:per_page]
+            next_after = (rows[-1].sort_key, rows[-1].user_id)
+
+        if not with_total:
+            total = None
+        elif rows:
+            total = rows[0].total
+        elif after is not None or page > 1:
+            # we asked for a page past the end, so there's no row to read the total from
+            total = matching_users.count()
         else:
-            matching_users = db.session.query(UserModel).\
-                                        join(ProviderModel).\
-                                        filter(UserModel.id.in_(int_user_ids))
-        
-        if name:
-            # ilike for case insensitive matching on psql
-            matching_users = matching_users.filter(
-                UserModel.name.ilike('%{}%'.format(name)))
+            total = 0
 
-        if language_ids:
-            matching_users = matching_users.filter(
-                ProviderModel.languages.any(LanguageModel.id.in_(language_ids)))
+        return SearchPage(items=build_search_results(rows), total=total, next_after=next_after)
 
-        if designation_ids:
-            matching_users = matching_users.filter(
-                ProviderModel.designations.any(DesignationModel.id.in_(designation_ids)))
+    @staticmethod
+    def get_search_facets(
+            specialty_id: int,
+            radius: int,
+            u_geo: str,
+            name: str = None,
+            name_match: str = 'contains',
+            text_query: str = None,
+            procedure: str = None,
+            procedure_match: str = 'exact',
+            max_procedure_wait: float = None,
+            open_at: time = None,
+            open_now: bool = False,
+            office_timezone: str = None) -> dict:
+        """
+        Counts how many of the providers get_users_within_radius finds for a specialty, radius and the other
+        filters (name, text_query, procedure and office hours, see get_users_within_radius)
+        speak each language, have each designation, have a wheelchair accessible office
+        and have an office accepting new patients, so the filters that wouldn't match anyone can be greyed out.
+        The counts ignore the language, designation and office filters themselves,
+        and only offices within the radius (and open at open_at or now, with those filters) count.
+        Every count comes from one query over searchable_providers.
+
+        Returns
+        {
+            "languages": [{"id": 1, "count": 12}, ...],
+            "designations": [{"id": 3, "count": 2}, ...],
+            "is_wheelchair_accessible": 9,
+            "is_accepting_new_patients": 4,
+        }
+        """
+        # import down here to avoid circular imports
+        from models.searchable_provider import SearchableProviderModel
+
+        candidates = UserModel.filter_search_candidates(
+            UserModel.search_candidates([SearchableProviderModel.user_id,
+                                         SearchableProviderModel.language_ids,
+                                         SearchableProviderModel.designation_ids,
+                                         SearchableProviderModel.is_wheelchair_accessible,
+                                         SearchableProviderModel.is_accepting_new_patients],
+                                        specialty_id, radius, u_geo),
+            name=name,
+            name_match=name_match,
+            text_query=text_query,
+            procedure=procedure,
+            procedure_match=procedure_match,
+            max_procedure_wait=max_procedure_wait,
+            open_at=open_at,
+            open_now=open_now,
+            office_timezone=office_timezone).cte('candidates')
+
+        no_id = cast(null(), db.Integer)
+
+        def count_tags(facet, tag_ids):
+            # one row per (provider, tag) a candidate row has
+            tags = db.session.\
+                query(candidates.c.user_id.label('user_id'), func.unnest(tag_ids).label('id')).\
+                subquery()
+
+            return db.session.\
+                query(literal(facet).label('facet'), tags.c.id.label('id'),
+                      func.count(tags.c.user_id.distinct()).label('count')).\
+                group_by(tags.c.id)
+
+        def count_offices(facet, flag):
+            return db.session.\
+                query(literal(facet).label('facet'), no_id.label('id'),
+                      func.count(candidates.c.user_id.distinct()).label('count')).\
+                filter(flag == True)
+
+        rows = count_tags('languages', candidates.c.language_ids).\
+            union_all(
+                count_tags('designations', candidates.c.designation_ids),
+                count_offices('is_wheelchair_accessible', candidates.c.is_wheelchair_accessible),
+                count_offices('is_accepting_new_patients', candidates.c.is_accepting_new_patients)).\
+            all()
+
+        facets = {"languages": [], "designations": [], "is_wheelchair_accessible": 0, "is_accepting_new_patients": 0}
+
+        for facet, tag_id, count in rows:
+            if tag_id is None:
+                facets[facet] = count
+            else:
+                facets[facet].append({"id": tag_id, "count": count})
 
-        if is_wheelchair_accessible:
-            matching_users = matching_users.filter(ProviderModel.addresses.any(
-                AddressModel.is_wheelchair_accessible == True))
+        for facet in ("languages", "designations"):
+            facets[facet].sort(key=lambda tag: tag["id"])
 
-        if is_accepting_new_patients:
-            matching_users = matching_users.filter(ProviderModel.addresses.any(
-                AddressModel.is_accepting_new_patients == True))
+        return facets
+
+    @staticmethod
+    def get_search_clusters(
+            specialty_id: int,
+            bounds: tuple,
+            grid: tuple,
+            sample_size: int,
+            **filters) -> list:
+        """
+        Clusters the offices of the providers of a specialty (that pass the search filters,
+        see filter_search_candidates) inside bounds (west, south, east, north in degrees)
+        on a grid of (west, south, cell size) in web mercator meters, so every cluster is
+        the offices in one square cell on the map.
+        The clusters are made by one query over searchable_providers, and there are never
+        more of them than there are cells.
+
+        Returns
+        [
+            {"count": 12, "latitude": 43.47, "longitude": -80.54, "sample": [uuid, ...]},
+            ...
+        ]
+        where count is how many providers have an office in the cell, latitude and longitude
+        are the centroid of those offices, and sample is up to sample_size of the providers uuids
+        """
+        # import down here to avoid circular imports
+        from models.searchable_provider import SearchableProviderModel
+
+        # the && (bounding boxes overlap) is answered by the GiST index on searchable_providers.geog
+        envelope = func.geography(func.ST_MakeEnvelope(*bounds, 4326))
+        location = func.ST_Transform(func.geometry(SearchableProviderModel.geog), 3857)
+
+        # every office snaps to the center of the cell it is in
+        grid_west, grid_south, cell_size = grid
+        cell = func.ST_SnapToGrid(location, grid_west + cell_size / 2, grid_south + cell_size / 2, cell_size, cell_size)
+        centroid = func.ST_Transform(func.ST_Centroid(func.ST_Collect(location)), 4326)
+
+        query = db.session.\
+            query(func.count(SearchableProviderModel.user_id.distinct()).label('count'),
+                  func.ST_Y(centroid).label('latitude'),
+                  func.ST_X(centroid).label('longitude'),
+                  array_agg(UserModel.uuid.distinct())[1:sample_size].label('sample')).\
+            select_from(SearchableProviderModel).\
+            join(UserModel, UserModel.id == SearchableProviderModel.user_id).\
+            filter(
+                SearchableProviderModel.specialty_id == specialty_id,
+                SearchableProviderModel.geog.op('&&', return_type=db.Boolean)(envelope)
+            )
+
+        rows = UserModel.filter_search_candidates(query, **filters).\
+            group_by(cell).\
+            order_by(func.count(SearchableProviderModel.user_id.distinct()).desc()).\
+            all()
+
+        return [{"count": row.count, "latitude": row.latitude, "longitude": row.longitude, "sample": row.sample}
+                for row in rows]
 
-        matching_users = matching_users.paginate(page, 6, False)
 
-        return matching_users
+# saved and deleted users are dropped from the find_by_uuid caches
+listen_for_user_changes(UserModel)
 
+# and access tokens with their old claims are turned away
+listen_for_claim_changes(UserModel)
 
 # An association table (many-to-many) for
 # mapping care providers to the designations they have.
@@ -331,6 +756,9 @@ class ProviderModel(db.Model):
     referral_instructions = db.Column(db.String)
     # Love, TN
 
+    # the profile text search matches against, rebuilt by update (see build_search_vector)
+    search_vector = db.Column(TSVECTOR)
+
     # addresses is one to many
     # ie,
     # < ProviderModel 1 >.addresses --> [< AddressModel 1 >, < AddressModel 2 >] - (Serialize) ->
@@ -382,11 +810,13 @@ class ProviderModel(db.Model):
     #   },
     #  ...
     # ]
+    #
+    # these are plain lists (not lazy='dynamic' queries), so they are only loaded once
     designations = db.relationship('DesignationModel', secondary=provider_to_designation_association_table,
-                                   backref=db.backref('providers', lazy='dynamic'), lazy='dynamic')
+                                   backref=db.backref('providers', lazy='dynamic'))
 
     languages = db.relationship('LanguageModel', secondary=provider_to_language_association_table,
-                                backref=db.backref('providers', lazy='dynamic'), lazy='dynamic')
+                                backref=db.backref('providers', lazy='dynamic'))
 
     # backpopulates the provider column on ProviderToAdminAssociation,
     # Is backpopulated by the provider column on ProviderToAdminAssociation
@@ -442,7 +872,7 @@ class ProviderModel(db.Model):
             existing_languages = self.languages
 
             # delete all existing languages because we are uploading a new list
-            for language in existing_languages:
+            for language in list(existing_languages):
                 # row will be deleted from the association table automatically
                 self.languages.remove(language)
 
@@ -460,7 +890,7 @@ class ProviderModel(db.Model):
             existing_designations = self.designations
 
             # delete all existing designations because we are uploading a new list
-            for designation in existing_designations:
+            for designation in list(existing_designations):
                 # row will be deleted from the association table automatically
                 self.designations.remove(designation)
 
@@ -553,8 +983,36 @@ class ProviderModel(db.Model):
 
                 self.procedural_wait_times = []
 
+        self.search_vector = self.build_search_vector()
+
         return self
 
+    def build_search_vector(self):
+        """
+        Returns a sql expression for the weighted tsvector of this providers profile:
+        A: subspecialty_or_special_interests
+        B: services_provided and the procedures in procedural_wait_times
+        C: research_interests
+
+        services_not_provided is left out, a search for a service shouldn't find the providers who don't offer it.
+        """
+        procedures = ' '.join(procedural_wait_time.procedure or ''
+                              for procedural_wait_time in self.procedural_wait_times)
+
+        weighted_text = (
+            (self.subspecialty_or_special_interests, 'A'),
+            (self.services_provided, 'B'),
+            (procedures, 'B'),
+            (self.research_interests, 'C'),
+        )
+
+        search_vector = None
+        for text, weight in weighted_text:
+            vector = func.setweight(func.to_tsvector(SEARCH_TEXT_CONFIG, text or ''), weight)
+            search_vector = vector if search_vector is None else search_vector.op('||')(vector)
+
+        return search_vector
+
     def save_to_db(self):
         db.session.add(self)
         db.session.commit()
@@ -655,3 +1113,7 @@ class ProviderToAdminAssociation(db.Model):
         ).first()
 
         return association
+
+
+# changed providers' searchable_providers rows are rebuilt before the change is committed
+listen_for_searchable_changes()
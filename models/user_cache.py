@@ -0,0 +1,239 @@
+"""
+Caches for UserModel.find_by_uuid, which nearly every request starts with (for the user in its token).
+
+Within a request (app context), the user found for a uuid is memoized in flask.g,
+so asking again returns the same object without a query.
+
+Across requests, every worker keeps the column values of the users it found lately
+in a small LRU cache, for up to USER_CACHE_TTL seconds. A cached user is merged into the session
+without a query (relationships like provider still load on first use).
+The session takes the cached values for the committed ones, so an update setting a column back to its value
+in the database (but not in the cache) would be skipped. Cached users are only used in requests that
+don't write (GET, HEAD and OPTIONS), every other request finds its users in the database.
+
+Saving or deleting a user drops it from this workers cache right away, and from every workers cache
+once it's committed, through a redis pub/sub channel (see blacklist.listen).
+While a worker isn't listening (eg, redis restarted) it doesn't use its cache.
+"""
+from collections import OrderedDict
+from functools import partial
+from threading import Lock, Thread
+from time import monotonic
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from metrics import increment_counters
+from redis.exceptions import RedisError
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import make_transient_to_detached, object_session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from blacklist import listen
+from extensions import db, redis_store
+
+USER_CHANGES_CHANNEL = 'user_changes'
+
+# the requests cached users are used in
+READ_ONLY_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class UserCache:
+
+    def __init__(self, size: int, ttl: float):
+        """
+        size: how many users are kept at most, the least recently used go first
+        ttl: seconds a user is kept for
+        """
+        self.size = size
+        self.ttl = ttl
+        self.snapshots = OrderedDict()
+        self.lock = Lock()
+        self.is_listening = False
+        # bumped by every invalidation, so a user read from the database before one isn't cached after it
+        self.version = 0
+
+    def get(self, model, uuid: str):
+        """
+        Takes in the user model class and a uuid
+        Returns the cached user merged into the session, or None if it isn't cached (anymore)
+        """
+        with self.lock:
+            if not self.is_listening:
+                return None
+
+            cached = self.snapshots.get(uuid)
+
+            if cached is None:
+                return None
+
+            expires_at, snapshot = cached
+
+            if expires_at < monotonic():
+                del self.snapshots[uuid]
+                return None
+
+            self.snapshots.move_to_end(uuid)
+
+        # build a clean, detached copy of the row, and let the session adopt it as is (load=False)
+        user = model.__mapper__.class_manager.new_instance()
+
+        for key, value in snapshot.items():
+            set_committed_value(user, key, value)
+
+        make_transient_to_detached(user)
+
+        return db.session.merge(user, load=False)
+
+    def set(self, user, version: int):
+        """
+        Caches user, read from the database when the cache was at version
+        """
+        snapshot = {column.key: getattr(user, column.key) for column in inspect(user).mapper.column_attrs}
+
+        with self.lock:
+            if not self.is_listening or self.version != version:
+                return
+
+            self.snapshots[user.uuid] = (monotonic() + self.ttl, snapshot)
+            self.snapshots.move_to_end(user.uuid)
+
+            while len(self.snapshots) > self.size:
+                self.snapshots.popitem(last=False)
+
+    def invalidate(self, uuid: str):
+        with self.lock:
+            self.snapshots.pop(uuid, None)
+            self.version += 1
+
+    def subscribed(self):
+        with self.lock:
+            self.is_listening = True
+
+    def receive(self, data: bytes):
+        self.invalidate(data.decode('utf-8'))
+
+    def tick(self):
+        pass
+
+    def unsubscribed(self):
+        with self.lock:
+            self.is_listening = False
+            self.snapshots.clear()
+            self.version += 1
+
+
+# one per worker, created (and listening) on first use
+user_cache = None
+user_cache_lock = Lock()
+
+
+def get_user_cache() -> UserCache:
+    """
+    Returns this workers user cache, configured from the app config, or None if USER_CACHE_TTL is 0
+    """
+    global user_cache
+
+    config = current_app.config
+
+    if not config['USER_CACHE_TTL']:
+        return None
+
+    with user_cache_lock:
+        if user_cache is None:
+            user_cache = UserCache(size=config['USER_CACHE_SIZE'], ttl=config['USER_CACHE_TTL'])
+            Thread(target=listen, args=(USER_CHANGES_CHANNEL, user_cache), daemon=True).start()
+
+    return user_cache
+
+
+def is_read_only_request() -> bool:
+    return has_request_context() and request.method in READ_ONLY_METHODS
+
+
+def request_users() -> dict:
+    """
+    Returns the users found so far in this request (app context), by uuid
+    """
+    if 'users_by_uuid' not in g:
+        g.users_by_uuid = {}
+
+    return g.users_by_uuid
+
+
+def find_user_by_uuid(model, uuid: str):
+    """
+    Takes in the user model class and a uuid
+    Returns the user (or None), from this request, this workers cache (in read only requests) or the database
+    """
+    users = request_users()
+
+    if uuid in users:
+        return users[uuid]
+
+    cache = get_user_cache() if is_read_only_request() else None
+    user = None
+
+    if cache:
+        version = cache.version
+        user = cache.get(model, uuid)
+
+    if user is None:
+        user = model.query.filter_by(uuid=uuid).first()
+
+        if user is not None and cache:
+            cache.set(user, version)
+
+    if user is not None:
+        users[uuid] = user
+
+    return user
+
+
+def forget_user(uuid: str, from_request: bool = False):
+    """
+    Drops a user from this workers cache, and from this request with from_request
+    """
+    if user_cache is not None:
+        user_cache.invalidate(uuid)
+
+    if from_request and has_app_context():
+        request_users().pop(uuid, None)
+
+
+def publish_user_changes(uuids):
+    """
+    Drops the users from every workers cache
+    """
+    try:
+        pipeline = redis_store.pipeline(transaction=False)
+
+        for uuid in uuids:
+            pipeline.publish(USER_CHANGES_CHANNEL, uuid)
+
+        pipeline.execute()
+    except RedisError:
+        # the other workers' copies expire with their ttl
+        increment_counters({'user_cache_invalidation_failures': 1})
+
+
+def listen_for_user_changes(model):
+    """
+    Forgets users as their rows are updated or deleted, and again (in every worker) once the change
+    is committed, so a copy read by another thread in between isn't kept either.
+    An updated user stays memoized in the request, that's the object that was changed.
+    """
+    def forget_changed_user(mapper, connection, target, from_request=False):
+        forget_user(target.uuid, from_request)
+        object_session(target).info.setdefault('changed_user_uuids', set()).add(target.uuid)
+
+    event.listen(model, 'after_update', forget_changed_user)
+    event.listen(model, 'after_delete', partial(forget_changed_user, from_request=True))
+
+    @event.listens_for(db.session, 'after_commit')
+    def forget_committed_users(session):
+        uuids = session.info.pop('changed_user_uuids', ())
+
+        for uuid in uuids:
+            forget_user(uuid)
+
+        if uuids and current_app.config['USER_CACHE_TTL']:
+            publish_user_changes(uuids)
@@ -2,4 +2,6 @@ GENERIC_ERROR_HAS_OCCURRED = "An error has occurred. Please try again later."
 
 REGISTER_ERROR_EMAIL_ALREADY_IN_USE = "That email is already in use on Icarus."
 
-PROFILE_UPDATED_SUCCESSFULLY = "Profile updated successfully!"
\ No newline at end of file
+PROFILE_UPDATED_SUCCESSFULLY = "Profile updated successfully!"
+
+PASSWORD_HASHING_BUSY = "We're busy signing people in. Please try again in a moment."
\ No newline at end of file
@@ -1,6 +1,6 @@
 from datetime import datetime, timedelta
 
-from blacklist import revoke_token
+from blacklist import revoke_token, revoke_user_tokens
 from flask import after_this_request, request
 from flask_jwt_extended import (create_access_token, create_refresh_token,
                                 fresh_jwt_required, get_jwt_identity,
@@ -12,8 +12,8 @@ from flask_wtf.csrf import generate_csrf
 from marshmallow import ValidationError
 from models.user import UserModel
 from schemas.user.user_auth import UserLoginSchema
-from security import check_encrypted_password
-from resources.strings import GENERIC_ERROR_HAS_OCCURRED
+from security import PasswordHashingBusy, check_encrypted_password
+from resources.strings import GENERIC_ERROR_HAS_OCCURRED, PASSWORD_HASHING_BUSY
 
 user_login_schema = UserLoginSchema()
 
@@ -36,12 +36,17 @@ class UserLogin(Resource):
         if not user:
             return {"message": "There is no account associated with that email"}, 401
 
+        try:
+            is_password_correct = check_encrypted_password(data['password'], user.password)
+        except PasswordHashingBusy:
+            return {"message": PASSWORD_HASHING_BUSY}, 503, {"Retry-After": "1"}
+
         # Compare the encrypted password in the database to the data passed in from the user input
         # If passwords match, return an access token and a refresh token to the user
-        if check_encrypted_password(data['password'], user.password):
+        if is_password_correct:
 
-            access_token = create_access_token(identity=user.uuid, fresh=True)
-            refresh_token = create_refresh_token(identity=user.uuid)
+            access_token = create_access_token(identity=user, fresh=True)
+            refresh_token = create_refresh_token(identity=user)
 
             @after_this_request
             def set_response_cookies(response):
@@ -66,6 +71,7 @@ class UserLogout(Resource):
     """
     POST
     Logs a user out by taking their current JWT token and adding it to the blacklist. JWT is required.
+    Only this session is logged out, UserLogoutEverywhere logs out the others too.
     """
     # This definitely needs to change if we are doing a caching system of JWT Token Refresh, which is probably the
     # more secure and production-ready way of doing things. More research required.
@@ -85,22 +91,41 @@ class UserLogout(Resource):
         return {"message": GENERIC_ERROR_HAS_OCCURRED}, 400
 
 
+class UserLogoutEverywhere(Resource):
+    """
+    POST
+    Logs a user out of every device by revoking every token they have, see blacklist.py. JWT is required.
+    """
+    @fresh_jwt_required
+    def post(self):
+        revoke_user_tokens(get_jwt_identity())
+
+        @after_this_request
+        def set_response_cookies(response):
+            unset_jwt_cookies(response)
+            return response
+
+        return {"message": "Successfully logged out everywhere."}, 200
+
+
 class TokenRefresh(Resource):
     """
     POST
     Generates & issues a new fresh access token to a logged in user without an email and password, 
-    all that is required is the a refresh token
+    all that is required is the a refresh token.
+    The new access token carries the users current claims (see claims.py)
 
     Requires a fresh JWT Token
     """
     @jwt_refresh_token_required
     def post(self):
         # Get the identity of the current user by their JWT, grant them a new access fresh access token.
-        current_user = get_jwt_identity()
+        # straight from the database, the new token's claims must be current
+        current_user = UserModel.query.filter_by(uuid=get_jwt_identity()).first()
         if current_user:
             access_token = create_access_token(
                 identity=current_user, fresh=True)
-            refresh_token = create_refresh_token(identity=current_user.uuid)
+            refresh_token = create_refresh_token(identity=current_user)
 
             @after_this_request
             def set_response_cookies(response):
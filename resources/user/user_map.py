@@ -0,0 +1,164 @@
+from json import dumps, loads
+
+from flask import Response, current_app, request
+from flask_jwt_extended import fresh_jwt_required, get_jwt_claims
+from flask_restful import Resource
+from metrics import increment_counters
+from models.searchable_provider import SearchableProviderModel
+from models.user import UserModel
+from resources.user.utils.tiles import (TileCache, is_valid_tile,
+                                        tile_bounds, tile_mercator_bounds)
+
+
+def parse_map_filters(args) -> dict:
+    """
+    Takes in the query string arguments of a map request
+    Returns the search filters they pick (see UserModel.filter_search_candidates),
+    normalized so that the same filters always come out the same.
+    Raises a ValueError if an id list isn't numbers.
+    """
+    filters = {}
+
+    for ids in ('language_ids', 'designation_ids'):
+        if args.get(ids):
+            filters[ids] = sorted({int(tag_id) for tag_id in args[ids].split(',')})
+
+    for flag in ('is_wheelchair_accessible', 'is_accepting_new_patients'):
+        if args.get(flag) == "true":
+            filters[flag] = True
+
+    # names, text and procedures are matched ignoring case anyway
+    if args.get('name'):
+        filters['name'] = args['name'].lower()
+        filters['name_match'] = "similar" if args.get('name_match') == "similar" else "contains"
+
+    if args.get('q'):
+        filters['text_query'] = args['q'].lower()
+
+    if args.get('procedure', '').strip():
+        filters['procedure'] = args['procedure'].strip().lower()
+        filters['procedure_match'] = "similar" if args.get('procedure_match') == "similar" else "exact"
+
+    return filters
+
+
+class UserSearchClusters(Resource):
+    """
+    GET
+    Takes in a specialty and a map tile (z/x/y), and the same filters as search
+    (language_ids, designation_ids, is_wheelchair_accessible, is_accepting_new_patients,
+    name, name_match, q, procedure, procedure_match) as query string arguments
+    Returns the specialists on the tile in clusters, see UserModel.get_search_clusters
+
+    A tile has at most MAP_CLUSTER_GRID x MAP_CLUSTER_GRID clusters however many specialists match,
+    and is cached per tile (in redis and by the browser).
+    """
+
+    @fresh_jwt_required
+    def get(self, specialty_id: int, z: int, x: int, y: int):
+
+        # authorized from the token's claims, see claims.py
+        if not get_jwt_claims()["is_verified_professional"]:
+            return {"message": "To protect our users privacy, you must first verify that you are a doctor to use the Icarus Medical Network. Please verify that you are a doctor by contacting support@icarusmed.com."}, 401
+
+        if not is_valid_tile(z, x, y):
+            return {"message": "Invalid map tile."}, 400
+
+        try:
+            filters = parse_map_filters(request.args)
+        except ValueError:
+            return {"message": "Invalid search parameters."}, 400
+
+        config = current_app.config
+        headers = {"Cache-Control": "private, max-age={}".format(config['MAP_TILE_MAX_AGE'])}
+
+        cache_key = None
+
+        if config['MAP_TILE_CACHE_TTL']:
+            tile_cache = TileCache('clusters:{}'.format(specialty_id), ttl=config['MAP_TILE_CACHE_TTL'])
+            generation = tile_cache.generation(specialty_id)
+
+            if generation is not None:
+                cache_key = tile_cache.key(generation, z, x, y, filters)
+
+        if cache_key:
+            cached = tile_cache.get(cache_key)
+
+            if cached is not None:
+                increment_counters({"map_tile_cache_hits": 1})
+                return loads(cached.decode('utf-8')), 200, headers
+
+            increment_counters({"map_tile_cache_misses": 1})
+
+        # the grid starts at the tiles corner, so cells never straddle two tiles
+        west, south, east, _ = tile_mercator_bounds(z, x, y)
+
+        clusters = UserModel.get_search_clusters(specialty_id=specialty_id,
+                                                 bounds=tile_bounds(z, x, y),
+                                                 grid=(west, south, (east - west) / config['MAP_CLUSTER_GRID']),
+                                                 sample_size=config['MAP_CLUSTER_SAMPLE_SIZE'],
+                                                 **filters)
+
+        tile = {"clusters": clusters, "zoom": z}
+
+        if cache_key:
+            tile_cache.set(cache_key, dumps(tile))
+
+        return tile, 200, headers
+
+
+class ProviderTiles(Resource):
+    """
+    GET
+    Takes in a map tile (z/x/y)
+    Returns a Mapbox Vector Tile of every searchable office on it, see SearchableProviderModel.mvt_tile
+
+    Tiles are cached in redis, and their ETag is the search generation of all specialties (see search_cache.py),
+    which only changes when a profile does. A browser asking again with the tile's current ETag
+    gets a 304 without the tile being looked up, let alone built.
+    """
+
+    @fresh_jwt_required
+    def get(self, z: int, x: int, y: int):
+
+        # authorized from the token's claims, see claims.py
+        if not get_jwt_claims()["is_verified_professional"]:
+            return {"message": "To protect our users privacy, you must first verify that you are a doctor to use the Icarus Medical Network. Please verify that you are a doctor by contacting support@icarusmed.com."}, 401
+
+        if not is_valid_tile(z, x, y):
+            return {"message": "Invalid map tile."}, 400
+
+        config = current_app.config
+        tile_cache = TileCache('providers_mvt', ttl=config['MAP_TILE_CACHE_TTL'])
+        generation = tile_cache.generation()
+
+        if generation is None:
+            # without redis we can't tell if the tile changed, so it's built and not cached by anyone
+            return self.tile_response(SearchableProviderModel.mvt_tile(tile_mercator_bounds(z, x, y)),
+                                      {"Cache-Control": "no-cache"})
+
+        etag = str(generation)
+        headers = {"Cache-Control": "private, max-age={}".format(config['MAP_TILE_MAX_AGE'])}
+
+        if etag in request.if_none_match:
+            increment_counters({"map_tile_not_modified": 1})
+            return Response(status=304, headers=dict(headers, ETag='"{}"'.format(etag)))
+
+        cache_key = tile_cache.key(generation, z, x, y) if config['MAP_TILE_CACHE_TTL'] else None
+        tile = tile_cache.get(cache_key) if cache_key else None
+
+        if tile is not None:
+            increment_counters({"map_tile_cache_hits": 1})
+        else:
+            increment_counters({"map_tile_cache_misses": 1})
+            tile = SearchableProviderModel.mvt_tile(tile_mercator_bounds(z, x, y))
+
+            if cache_key:
+                tile_cache.set(cache_key, tile)
+
+        return self.tile_response(tile, dict(headers, ETag='"{}"'.format(etag)))
+
+    @staticmethod
+    def tile_response(tile: bytes, headers: dict) -> Response:
+        # flask_restful passes responses through as they are, so the tile goes out as binary, not json
+        return Response(tile, status=200, mimetype='application/vnd.mapbox-vector-tile', headers=headers)
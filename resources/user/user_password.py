@@ -3,8 +3,10 @@ from threading import Thread
 from time import time
 
 from flask import after_this_request, request
-from flask_jwt_extended import (create_access_token, fresh_jwt_required,
-                                get_jwt_identity, decode_token)
+from flask_jwt_extended import (create_access_token, create_refresh_token,
+                                fresh_jwt_required, get_jwt_identity,
+                                decode_token, set_access_cookies,
+                                set_refresh_cookies)
 from flask_restful import Resource
 from marshmallow import ValidationError
 from models.user import UserModel
@@ -12,9 +14,10 @@ from resources.user.utils.send_users_emails import send_password_reset_email
 from schemas.user.user_password import (UserForgotPasswordRequestSchema,
                                         UserForgotPasswordResetSchema,
                                         UserSettingsPasswordResetSchema)
-from security import check_encrypted_password, encrypt_password
-from blacklist import revoke_token
-from resources.strings import GENERIC_ERROR_HAS_OCCURRED
+from security import (PasswordHashingBusy, check_encrypted_password,
+                      encrypt_password)
+from blacklist import revoke_token, revoke_user_tokens
+from resources.strings import GENERIC_ERROR_HAS_OCCURRED, PASSWORD_HASHING_BUSY
 
 user_forgot_password_request_schema = UserForgotPasswordRequestSchema()
 user_reset_password_schema = UserSettingsPasswordResetSchema()
@@ -32,13 +35,30 @@ class UserPasswordResetSettings(Resource):
 
         # Compare the encrypted password in the database to the data passed in from the user input
         # If passwords match, return an access token and a refresh token to the user
-        if check_encrypted_password(data['old_password'], user.password):
-            password = encrypt_password(data['new_password'])
+        try:
+            is_password_correct = check_encrypted_password(data['old_password'], user.password)
+            password = encrypt_password(data['new_password']) if is_password_correct else None
+        except PasswordHashingBusy:
+            return {"message": PASSWORD_HASHING_BUSY}, 503, {"Retry-After": "1"}
+
+        if is_password_correct:
             user.password = password
             try:
                 user.save_to_db()
             except:
                 return {"message": GENERIC_ERROR_HAS_OCCURRED}, 400
+
+            # log them out everywhere else, this session gets new tokens (issued after the revocation)
+            revoke_user_tokens(user.uuid)
+
+            access_token = create_access_token(identity=user, fresh=True)
+            refresh_token = create_refresh_token(identity=user)
+
+            @after_this_request
+            def set_response_cookies(response):
+                set_access_cookies(response, access_token)
+                set_refresh_cookies(response, refresh_token)
+                return response
         else:
             return {"message": "The old password you supplied does not match our records. Please try again."}, 400
 
@@ -74,18 +94,26 @@ class UserForgotPasswordUpdate(Resource):
         if expiry < now:
             return {"message": "This link has expired. Please request a new password reset"}, 400
 
+        # hashed before the reset token is used up, so they can try it again if we're busy
+        try:
+            password = encrypt_password(data['password'])
+        except PasswordHashingBusy:
+            return {"message": PASSWORD_HASHING_BUSY}, 503, {"Retry-After": "1"}
+
         revoke_token(decoded_token['jti'])
 
         user = UserModel.find_by_uuid(decoded_token['identity'])
 
         if user:
-            password = encrypt_password(data['password'])
             user.password = password
             try:
                 user.save_to_db()
             except:
                 return {"message": GENERIC_ERROR_HAS_OCCURRED}, 500
 
+            # whoever had their old password is logged out
+            revoke_user_tokens(user.uuid)
+
             return {"message": "Password reset successful!"}, 200
         else:
             return {"message": "This is not a valid request."}, 400
@@ -9,7 +9,8 @@ import boto3
 from blacklist import revoke_token
 from flask import after_this_request, jsonify, request
 from flask_jwt_extended import (decode_token, fresh_jwt_required,
-                                get_jwt_identity, unset_jwt_cookies)
+                                get_jwt_claims, get_jwt_identity,
+                                unset_jwt_cookies)
 from flask_restful import Resource
 from marshmallow import ValidationError
 from models.address import AddressModel
@@ -152,23 +153,22 @@ class UserProfile(Resource):
 
         user = UserModel.find_by_uuid(user_uuid)
 
-        requestor = UserModel.find_by_uuid(get_jwt_identity())
+        # the requestor is authorized from their token's claims, see claims.py
+        requestor = get_jwt_claims()
 
         # is the uuid they've passed in match their profile uuid?
-        if user.uuid != requestor.uuid:
+        if user.uuid != get_jwt_identity():
             # if it hasnt, their jwt identity must match one of the
             # administrator jwts for the passed in user_uuid
 
             # first, check if the requestor is actually an admin user type
-            if requestor.user_type != 3:
+            if requestor["user_type"] != 3:
                 return {"message": "You must have an administrator account type to edit someone elses profile"}, 401
 
-            admin = requestor
-
             provider_to_admin = ProviderToAdminAssociation()
 
             can_they_edit = provider_to_admin.findRelationshipBasedOnAdminAndProvider(
-                provider_id=user.id, admin_id=admin.id)
+                provider_id=user.id, admin_id=requestor["id"])
 
             if not can_they_edit:
                 return {"message": "You do not have permission to edit this profile."}, 401
@@ -213,23 +213,22 @@ class UserProfilePicture(Resource):
 
         user = UserModel.find_by_uuid(user_uuid)
 
-        requestor = UserModel.find_by_uuid(get_jwt_identity())
+        # the requestor is authorized from their token's claims, see claims.py
+        requestor = get_jwt_claims()
 
         # is the uuid they've passed in match their profile uuid?
-        if user.uuid != requestor.uuid:
+        if user.uuid != get_jwt_identity():
             # if it hasnt, their jwt identity must match one of the
             # administrator jwts for the passed in user_uuid
 
             # first, check if the requestor is actually an admin user type
-            if requestor.user_type != 3:
+            if requestor["user_type"] != 3:
                 return {"message": "You must have an administrator account type to edit someone elses profile"}, 401
 
-            admin = requestor
-
             provider_to_admin = ProviderToAdminAssociation()
 
             can_they_edit = provider_to_admin.findRelationshipBasedOnAdminAndProvider(
-                provider_id=user.id, admin_id=admin.id)
+                provider_id=user.id, admin_id=requestor["id"])
 
             if not can_they_edit:
                 return {"message": "You do not have permission to edit this profile."}, 401
@@ -12,10 +12,11 @@ from flask_restful import Resource
 from marshmallow import ValidationError
 from models.user import UserModel
 from schemas.user.user_register import UserRegisterSchema
-from security import encrypt_password
+from security import PasswordHashingBusy, encrypt_password
 from resources.user.utils.send_users_emails import send_confirmation_email
 from resources.user.utils.generate_verification_code import generate_verification_code
-from resources.strings import GENERIC_ERROR_HAS_OCCURRED, REGISTER_ERROR_EMAIL_ALREADY_IN_USE
+from resources.strings import (GENERIC_ERROR_HAS_OCCURRED, PASSWORD_HASHING_BUSY,
+                               REGISTER_ERROR_EMAIL_ALREADY_IN_USE)
 
 user_register_schema = UserRegisterSchema()
 
@@ -39,7 +40,12 @@ class UserRegister(Resource):
 
         name = request_data['name']
         email = request_data['email']
-        password = encrypt_password(request_data['password'])
+
+        try:
+            password = encrypt_password(request_data['password'])
+        except PasswordHashingBusy:
+            return {"message": PASSWORD_HASHING_BUSY}, 503, {"Retry-After": "1"}
+
         uuid = str(uuid4())
 
         user = UserModel(name=name, email=email, password=password, uuid=uuid)
@@ -57,8 +63,8 @@ class UserRegister(Resource):
         except:
             return {"message": GENERIC_ERROR_HAS_OCCURRED}, 400
 
-        access_token = create_access_token(identity=user.uuid, fresh=True)
-        refresh_token = create_refresh_token(identity=user.uuid)
+        access_token = create_access_token(identity=user, fresh=True)
+        refresh_token = create_refresh_token(identity=user)
 
         @after_this_request
         def set_response_cookies(response):
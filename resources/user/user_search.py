@@ -1,18 +1,29 @@
-from os import environ
+from copy import deepcopy
+from datetime import datetime
+from hashlib import sha1
 from json import dumps
+from math import isfinite
+from time import monotonic
 
-from flask import request, jsonify
-from flask_jwt_extended import fresh_jwt_required, get_jwt_identity
+from flask import current_app, request, jsonify
+from flask_jwt_extended import (fresh_jwt_required, get_jwt_claims,
+                                get_jwt_identity)
 from flask_restful import Resource
-from models.user import UserModel
+from models.user import SearchScoring, UserModel
 from models.language import LanguageModel
 from models.specialty import SpecialtyModel
-from requests import codes, get
-
-from schemas.user.user_profile import UserModelSchema
+from metrics import increment_counters
+from resources.user.utils.distance_providers import (LocalDistanceProvider,
+                                                     format_distance,
+                                                     get_distance_provider,
+                                                     haversine_distances)
+from resources.user.utils.search_cache import get_search_cache
+from resources.user.utils.single_flight import get_search_single_flight
+from resources.user.utils.search_cursor import decode_cursor, encode_cursor
+from schemas.user.user_search import SearchResultSchema
 from schemas.specialty import SpecialtySchema
 
-user_model_schema = UserModelSchema()
+search_result_schema = SearchResultSchema()
 specialty_model_schema = SpecialtySchema()
 
 class UserSearch(Resource):
@@ -20,25 +31,53 @@ class UserSearch(Resource):
     GET
     Takes in identifying params (specialty id, radius, insur ids, sort, lat_long)
     Returns list of specialists matching those parameters
+
+    The name filter matches names containing it, or with ?name_match=similar names spelled like it,
+    and the "name" sort puts the closest name matches first.
+    ?q= finds specialists whose profile (interests, services, procedures, research) mentions the words,
+    and the "relevance" sort puts the best matches first.
+    ?procedure= only finds specialists who do the procedure (?procedure_match=similar also finds it spelled differently),
+    with a wait of at most ?max_procedure_wait= if given, and the "procedure_wait" sort puts the shortest waits first.
+    The "score" sort blends distance and waits, including the wait for ?procedure= if given,
+    weighted by the SEARCH_SCORE_ settings in the config.
+    ?open_at=HH:MM only finds specialists with an office (within the radius) open at that time of day,
+    and ?open_now=true one open right now.
+    ?facets=true also returns how many specialists match each language, designation and office filter.
+
+    Pages are numbered, or start after the "next" cursor returned with the previous page (?cursor=).
+    Pages are cached for a few minutes, see resources/user/utils/search_cache.py,
+    and identical searches running at the same time share one search, see resources/user/utils/single_flight.py.
     """
 
     @fresh_jwt_required
     def get(self, specialty_id: int, radius: int, page: int, sort_by: str):
 
-        # instantiate the current user to be of the UserModel class
-        user = UserModel.find_by_uuid(get_jwt_identity())
+        # authorized from the token's claims, the user is only loaded if we need their address
+        claims = get_jwt_claims()
 
-        if not user.is_verified_professional:
+        if not claims["is_verified_professional"]:
             return {"message": "To protect our users privacy, you must first verify that you are a doctor to use the Icarus Medical Network. Please verify that you are a doctor by contacting support@icarusmed.com."}, 401
 
         # set all these to false by default so they dont trigger filters in the query
         # if they dont exist in the query string args (below)
         geo = False
         name = False
+        name_match = "contains"
+        text_query = None
+        procedure = None
+        procedure_match = "exact"
+        max_procedure_wait = None
+        open_at = None
+        open_now = False
         language_ids = False
         designation_ids = False
         is_wheelchair_accessible = False
         is_accepting_new_patients = False
+        per_page = current_app.config['SEARCH_PAGE_SIZE']
+        cursor_origin = None
+        after = None
+        with_total = True
+        with_facets = False
 
         # get query string arguments from the request
         args = request.args
@@ -48,19 +87,57 @@ class UserSearch(Resource):
             # we arent sure if these are coming in
             # so we need to check
 
-            if ('lat' in args) and ('lon' in args):
-                lat = args['lat']
-                lon = args['lon']
-                geo = 'POINT({} {})'.format(lon, lat)
-            
+            # these end up as bound parameters in the search query,
+            # so make sure they are numbers before they get there
+            try:
+                if ('lat' in args) and ('lon' in args):
+                    lat = float(args['lat'])
+                    lon = float(args['lon'])
+
+                    # float() takes nan and inf too, neither (nor a point off the globe) is valid WKT to postgis
+                    if not (isfinite(lat) and isfinite(lon) and -90 <= lat <= 90 and -180 <= lon <= 180):
+                        raise ValueError('lat and lon must be a point on the globe')
+
+                    geo = 'POINT({} {})'.format(lon, lat)
+
+                if 'language_ids' in args:
+                    language_ids = [int(language_id) for language_id in args['language_ids'].split(',')]
+
+                if 'designation_ids' in args:
+                    designation_ids = [int(designation_id) for designation_id in args['designation_ids'].split(',')]
+
+                if args.get('max_procedure_wait'):
+                    max_procedure_wait = float(args['max_procedure_wait'])
+
+                if args.get('open_at'):
+                    open_at = datetime.strptime(args['open_at'], '%H:%M').time()
+
+                if 'per_page' in args:
+                    per_page = min(max(int(args['per_page']), 1), current_app.config['SEARCH_MAX_PAGE_SIZE'])
+
+                # the "next" token from the last page, the page starts right after its last result
+                if args.get('cursor'):
+                    cursor_origin, after = decode_cursor(args['cursor'], sort=sort_by)
+            except ValueError:
+                return {"message": "Invalid search parameters."}, 400
+
             if 'name' in args:
                 name = args['name']
-            
-            if 'language_ids' in args:
-                language_ids = args['language_ids'].split(',')
-            
-            if 'designation_ids' in args:
-                designation_ids = args['designation_ids'].split(',')
+
+            # "similar" also finds names with typos in them
+            if args.get('name_match') == "similar":
+                name_match = "similar"
+
+            # words to find in the specialists profiles, eg ?q=sports injuries
+            if args.get('q'):
+                text_query = args['q']
+
+            # a procedure the specialists do, eg ?procedure=colonoscopy
+            if args.get('procedure', '').strip():
+                procedure = args['procedure'].strip()
+
+            if args.get('procedure_match') == "similar":
+                procedure_match = "similar"
 
             # args are coming in as strings, 
             # we need to make sure these values become boolean for query
@@ -70,77 +147,235 @@ class UserSearch(Resource):
             if 'is_accepting_new_patients' in args:
                 is_accepting_new_patients = args['is_accepting_new_patients'] == "true"
 
-        query = user.get_users_within_radius(
-                                             searcher_id=user.id,
-                                             specialty_id=specialty_id,
-                                             radius=radius,
-                                             page=page,
-                                             sort=sort_by,
-                                             u_geo=geo,
-                                             name=name,
-                                             language_ids=language_ids,
-                                             designation_ids=designation_ids,
-                                             is_wheelchair_accessible = is_wheelchair_accessible,
-                                             is_accepting_new_patients = is_accepting_new_patients,
-                                             )
-        
-        specialists = query.items
-        num_specialists = query.total
-
-        # initialize empty array to house all the specialist objects
-        specialists_array = []
-
-        # initialize empty array to house all coordinates for the distance calculations
-        distance_array = []
-
-        # for each specialist, serialize their information using marshmallow
-        # cant send the data in as is because marshmallow cant handle pagination
-        # so instead do one usermodel serialization at a time and itll work
-        # append the dictionary to the specialists_array
-        # results in an array of multiple dictionaries
-        for specialist in specialists:
+            if 'open_now' in args:
+                open_now = args['open_now'] == "true"
+
+            # clients that don't show the number of results can skip counting them
+            if 'total' in args:
+                with_total = args['total'] != "false"
 
-            specialist_dict = user_model_schema.dump(specialist)
+            # how many specialists match each language, designation and office filter
+            if 'facets' in args:
+                with_facets = args['facets'] == "true"
 
-            # append to the lists of specialists
-            specialists_array.append(specialist_dict)
+        # search from the searchers first office if they havent selected an address
+        if not geo:
+            # instantiate the current user to be of the UserModel class
+            user = UserModel.find_by_uuid(get_jwt_identity())
 
+            if not (user.provider and user.provider.addresses):
+                return {"message": "Please select an address to search from."}, 400
 
-            for address_row in specialist.provider.addresses:
-                # create an array of distances
-                distance_array.append('{},{}'.format(
-                    address_row.latitude, address_row.longitude))
+            lat = user.provider.addresses[0].latitude
+            lon = user.provider.addresses[0].longitude
+            geo = 'POINT({} {})'.format(lon, lat)
 
-        destinations = '|'.join(distance_array)
+        # the next page is searched from wherever the last one was (maybe by a neighbour, if it was cached),
+        # the sort values in the cursor are only comparable from there.
+        # the distances shown are still from the searchers own origin
+        search_origin = cursor_origin or (lat, lon)
+        search_geo = 'POINT({} {})'.format(search_origin[1], search_origin[0])
 
-        # # GMAPS BILLING
-        # #   num origins * num destinations = num elements.
-        # #   billed per num elements
-        # #   we get billed for 6 calls here
+        config = current_app.config
+        scoring = SearchScoring(distance_weight=config['SEARCH_SCORE_DISTANCE_WEIGHT'],
+                                wait_weight=config['SEARCH_SCORE_WAIT_WEIGHT'],
+                                procedure_wait_weight=config['SEARCH_SCORE_PROCEDURE_WAIT_WEIGHT'],
+                                missing_wait=config['SEARCH_SCORE_MISSING_WAIT'],
+                                candidates=config['SEARCH_SCORE_CANDIDATES'])
 
-        # # Distance Matrix calculation
-        if geo:
-            maps_lat = lat
-            maps_lon = lon
+        search_cache = get_search_cache()
+
+        # the search runs from the exact origin with the exact radius, the cache only keys pages by the origins
+        # geohash cell, so everyone searching from the same neighbourhood gets the same (cached) pages.
+        # radii that aren't a whole bucket are rare, their pages aren't cached (a bigger radius finds too much)
+        if search_cache and search_cache.quantize_radius(radius) != radius:
+            search_cache = None
+
+        # a cursors page can only be shared by the searchers who got the same cursor, ie, from the same origin
+        if search_cache and not cursor_origin:
+            cell = search_cache.quantize_origin(lat, lon)
         else:
-            maps_lat = user.provider.addresses[0].latitude
-            maps_lon = user.provider.addresses[0].longitude
+            cell = search_geo
+
+        # everything that decides what is on the page
+        parameters = {
+            "cell": cell,
+            "radius": radius,
+            "page": page,
+            "sort": sort_by,
+            # names and text are matched ignoring case anyway
+            "name": name.lower() if name else None,
+            "name_match": name_match,
+            "q": text_query.lower() if text_query else None,
+            # procedures are matched ignoring case too
+            "procedure": procedure.lower() if procedure else None,
+            "procedure_match": procedure_match,
+            "max_procedure_wait": max_procedure_wait,
+            "open_at": open_at.strftime('%H:%M') if open_at else None,
+            # who's open changes by the minute
+            "open_now": datetime.utcnow().strftime('%Y-%m-%dT%H:%M') if open_now else None,
+            "language_ids": sorted(language_ids) if language_ids else None,
+            "designation_ids": sorted(designation_ids) if designation_ids else None,
+            "is_wheelchair_accessible": is_wheelchair_accessible,
+            "is_accepting_new_patients": is_accepting_new_patients,
+            "per_page": per_page,
+            "after": after,
+            "with_total": with_total,
+            "with_facets": with_facets,
+        }
+
+        def respond() -> dict:
+            cache_key = None
+            page_dict = None
+
+            if search_cache:
+                lookup_start = monotonic()
+                cache_key, page_dict = search_cache.lookup(specialty_id, parameters)
 
-        r = get('https://maps.googleapis.com/maps/api/distancematrix/json?units=metric&origins={},{}&destinations={}&key='.format(maps_lat, maps_lon, destinations, environ.get("GOOGLE_MAPS_API_KEY")))
+                if page_dict is not None:
+                    lookup_ms = (monotonic() - lookup_start) * 1000
+                    increment_counters({"search_cache_hits": 1,
+                                        "search_cache_ms_saved": max(page_dict.pop("ms") - lookup_ms, 0)})
+                else:
+                    increment_counters({"search_cache_misses": 1})
 
-        # # destination matrix to specialists
+            if page_dict is not None:
+                return self.add_distances(page_dict, origin=(lat, lon), is_measured=False)
 
-        # # append the travel distances to the specialists_array if we get a good response from gmaps api
-        if r.status_code == codes['ok']:
-            json_response = r.json()
+            search_start = monotonic()
+            page_dict = self.search(claims["id"], specialty_id, radius, page, sort_by, search_origin, dict(
+                u_geo=search_geo,
+                name=name,
+                language_ids=language_ids,
+                designation_ids=designation_ids,
+                is_wheelchair_accessible = is_wheelchair_accessible,
+                is_accepting_new_patients = is_accepting_new_patients,
+                name_match=name_match,
+                text_query=text_query,
+                procedure=procedure,
+                procedure_match=procedure_match,
+                max_procedure_wait=max_procedure_wait,
+                open_at=open_at,
+                open_now=open_now,
+                office_timezone=config['OFFICE_HOURS_TIMEZONE'],
+                scoring=scoring,
+                per_page=per_page,
+                after=after,
+                with_total=with_total,
+            ))
 
-            address_loop_count = 0
-            for specialist_index in range(len(specialists_array)):
-                for specialist_address_index in range((len(specialists_array[specialist_index]['provider']['addresses']))):
-                    specialists_array[specialist_index]['provider']['addresses'][specialist_address_index]['distance'] = json_response['rows'][0]['elements'][address_loop_count]['distance']['text']
-                    address_loop_count += 1
+            if with_facets:
+                # counted over the same providers as the page
+                facet_filters = dict(
+                    name=name,
+                    name_match=name_match,
+                    text_query=text_query,
+                    open_at=open_at,
+                    open_now=open_now,
+                    office_timezone=config['OFFICE_HOURS_TIMEZONE'],
+                )
+
+                # the score sort ranks by the procedures wait instead of filtering on it
+                if sort_by != "score":
+                    facet_filters.update(procedure=procedure,
+                                         procedure_match=procedure_match,
+                                         max_procedure_wait=max_procedure_wait)
+
+                page_dict["facets"] = UserModel.get_search_facets(specialty_id=specialty_id,
+                                                                  radius=radius,
+                                                                  u_geo=search_geo,
+                                                                  **facet_filters)
+            search_ms = (monotonic() - search_start) * 1000
+
+            # the distances depend on the searchers exact origin, so they aren't cached with the page
+            cacheable_page_dict = deepcopy(page_dict)
+            self.add_distances(page_dict, origin=(lat, lon), is_measured=search_origin == (lat, lon))
+
+            # cached after the distances are looked up (and cached themselves),
+            # so searches waiting on this one in other workers find both
+            if cache_key:
+                search_cache.store(cache_key, dict(cacheable_page_dict, ms=search_ms))
+
+            return page_dict
+
+        def load() -> dict:
+            # the page another worker searched for, if its in the cache yet
+            cached_page_dict = search_cache.lookup(specialty_id, parameters)[1]
+
+            if cached_page_dict is None:
+                return None
+
+            cached_page_dict.pop("ms")
+            return self.add_distances(cached_page_dict, origin=(lat, lon), is_measured=False)
+
+        # identical searches (down to the distance cache's rounding of the origin) that arrive together
+        # are only run once, the others wait for its response
+        precision = current_app.config['DISTANCE_CACHE_PRECISION']
+        flight_key = "search:{}:{}".format(specialty_id, sha1(dumps(dict(
+            parameters, origin=[round(lat, precision), round(lon, precision)]), sort_keys=True).encode("utf-8")).hexdigest())
+
+        return get_search_single_flight().run(flight_key, respond, load if search_cache else None), 200
+
+    @staticmethod
+    def add_distances(page_dict: dict, origin: tuple, is_measured: bool) -> dict:
+        """
+        Adds the distance from origin to the nearest address of every specialist on the page
+        (where we could get one)
+        is_measured: whether the page was just searched from origin, the search measured each nearest_distance then.
+        A cached page was searched from a neighbours origin, so its nearest_distances are measured again here.
+        Returns the page.
+        """
+        providers = [specialist_dict['provider'] for specialist_dict in page_dict["specialists"]]
+
+        # the search puts each specialists nearest address first
+        nearest_addresses = [provider_dict['addresses'][0] for provider_dict in providers]
+        destinations = [(address_dict['latitude'], address_dict['longitude']) for address_dict in nearest_addresses]
+
+        if not is_measured and destinations:
+            for provider_dict, meters in zip(providers, haversine_distances(origin, destinations).tolist()):
+                provider_dict['nearest_distance'] = meters
+
+        # google or local, depending on DISTANCE_PROVIDER in the config
+        distance_provider = get_distance_provider()
+
+        if isinstance(distance_provider, LocalDistanceProvider):
+            # as the crow flies, which is what nearest_distance is already
+            distances = [format_distance(provider_dict['nearest_distance']) for provider_dict in providers]
+        else:
+            distances = distance_provider.get_distances(origin=origin, destinations=destinations)
+
+        # they come back in the same order as the destinations went in
+        if distances:
+            for address_dict, distance in zip(nearest_addresses, distances):
+                if distance is not None:
+                    address_dict['distance'] = distance
+
+        return page_dict
+
+    @staticmethod
+    def search(searcher_id: int, specialty_id: int, radius: int, page: int, sort_by: str, origin: tuple,
+               filters: dict) -> dict:
+        """
+        Runs the search (from origin, which filters['u_geo'] is the point of) and returns the page of results
+        without distances, ie, everything that can be cached
+        """
+        query = UserModel.get_users_within_radius(
+                                                  searcher_id=searcher_id,
+                                                  specialty_id=specialty_id,
+                                                  radius=radius,
+                                                  page=page,
+                                                  sort=sort_by,
+                                                  **filters
+                                                  )
+
+        # for each specialist, serialize their search result card using marshmallow
+        # results in an array of multiple dictionaries
+        specialists_array = [search_result_schema.dump(specialist) for specialist in query.items]
 
         # Grab the specialty information to return.
         specialty = SpecialtyModel.find_by_id(specialty_id)
 
-        return {"specialists": specialists_array, "numSpecialists": num_specialists, "specialty": specialty_model_schema.dump(specialty)}, 200
+        # where the next page starts, for ?cursor=
+        next_cursor = encode_cursor(sort_by, origin, query.next_after) if query.next_after else None
+
+        return {"specialists": specialists_array, "numSpecialists": query.total, "next": next_cursor, "specialty": specialty_model_schema.dump(specialty)}
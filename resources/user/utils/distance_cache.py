@@ -0,0 +1,54 @@
+"""
+A cache of origin -> destination distances shared by every worker through redis.
+
+Searchers page through results and repeat searches from the same office, so most pairs
+have already been looked up. Coordinates are rounded before they become keys,
+so points a few meters apart share an entry.
+"""
+from redis.exceptions import RedisError
+
+from extensions import redis_store
+
+
+class DistanceCache:
+
+    def __init__(self, precision: int, ttl: int):
+        """
+        precision: decimal places coordinates are rounded to (4 places is ~11 meters)
+        ttl: seconds an entry lives for
+        """
+        self.precision = precision
+        self.ttl = ttl
+
+    def key(self, origin: tuple, destination: tuple) -> str:
+        """
+        Returns the redis key for a (latitude, longitude) origin and destination
+        """
+        return 'distance:{}'.format(':'.join(
+            '{:.{}f}'.format(coordinate, self.precision) for coordinate in origin + destination))
+
+    def get_many(self, origin: tuple, destinations: list) -> list:
+        """
+        Returns the cached distance for every destination, or None where there isn't one.
+        If redis can't be reached, everything is a miss.
+        """
+        try:
+            cached = redis_store.mget([self.key(origin, destination) for destination in destinations])
+        except RedisError:
+            return [None] * len(destinations)
+
+        return [distance.decode('utf-8') if distance is not None else None for distance in cached]
+
+    def set_many(self, origin: tuple, distances: dict):
+        """
+        Takes in an origin and a dict of {destination: distance} and caches each distance
+        """
+        try:
+            pipeline = redis_store.pipeline(transaction=False)
+
+            for destination, distance in distances.items():
+                pipeline.set(self.key(origin, destination), distance, self.ttl)
+
+            pipeline.execute()
+        except RedisError:
+            pass
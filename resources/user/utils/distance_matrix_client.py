@@ -0,0 +1,161 @@
+"""
+The HTTP client search uses to talk to the Distance Matrix API.
+
+One client (and its keep-alive connection pool) is shared by every thread in a worker.
+Every request has strict connect and read timeouts and a bounded number of retries,
+and a circuit breaker stops calling upstream for a while once it keeps failing,
+so a slow google makes searches come back without distances instead of stalling every worker.
+"""
+from threading import Lock
+from time import monotonic
+
+from flask import current_app
+from metrics import increment_counters
+from requests import Session, codes
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+from urllib3.util.retry import Retry
+
+
+class CircuitBreaker:
+    """
+    closed: requests go through.
+    open: after failure_threshold failures in a row, requests are skipped for reset_timeout seconds.
+    half open: once reset_timeout has passed, one request is let through to test the water.
+               If it succeeds the breaker closes, if it fails it opens again.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return self.CLOSED
+
+        if monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+
+        return self.OPEN
+
+    def allow_request(self) -> bool:
+        """
+        Returns whether a request should be made right now
+        """
+        with self.lock:
+            state = self.state
+
+            if state == self.HALF_OPEN:
+                # let this one request through, everyone else waits for its result
+                self.opened_at = monotonic()
+                return True
+
+            return state == self.CLOSED
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+
+            if self.failures >= self.failure_threshold:
+                self.opened_at = monotonic()
+
+
+class DistanceMatrixClient:
+
+    def __init__(self,
+                 url: str,
+                 api_key: str,
+                 connect_timeout: float,
+                 read_timeout: float,
+                 retries: int,
+                 breaker: CircuitBreaker):
+        self.url = url
+        self.api_key = api_key
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = breaker
+
+        # retry connection errors, read timeouts and 5xxs a bounded number of times
+        retry = Retry(total=retries, backoff_factor=0.1, status_forcelist=(500, 502, 503, 504),
+                      raise_on_status=False)
+
+        self.session = Session()
+        self.session.mount(url, HTTPAdapter(max_retries=retry))
+
+    def get_distances(self, origin: tuple, destinations: list) -> list:
+        """
+        Takes in an origin (latitude, longitude) and a list of destinations [(latitude, longitude), ...]
+        Makes one Distance Matrix request for all of them.
+        Returns a list of distance strings (None where google couldn't route),
+        or None if the request failed or the circuit breaker is open.
+        """
+        if not self.breaker.allow_request():
+            increment_counters({'distance_matrix_skipped': 1})
+            return None
+
+        try:
+            # # GMAPS BILLING
+            # #   num origins * num destinations = num elements.
+            # #   billed per num elements
+            r = self.session.get(self.url, timeout=self.timeout, params={
+                'units': 'metric',
+                'origins': '{},{}'.format(*origin),
+                'destinations': '|'.join('{},{}'.format(*destination) for destination in destinations),
+                'key': self.api_key,
+            })
+
+            if r.status_code != codes['ok']:
+                raise RequestException('Distance Matrix returned {}'.format(r.status_code))
+
+            json_response = r.json()
+        except (RequestException, ValueError):
+            self.breaker.record_failure()
+            increment_counters({'distance_matrix_failures': 1})
+            return None
+
+        self.breaker.record_success()
+
+        if json_response.get('status') != 'OK':
+            return None
+
+        return [element['distance']['text'] if element.get('status') == 'OK' else None
+                for element in json_response['rows'][0]['elements']]
+
+
+# one per worker, created on first use
+distance_matrix_client = None
+distance_matrix_client_lock = Lock()
+
+
+def get_distance_matrix_client() -> DistanceMatrixClient:
+    """
+    Returns this workers DistanceMatrixClient, configured from the app config
+    """
+    global distance_matrix_client
+
+    with distance_matrix_client_lock:
+        if distance_matrix_client is None:
+            config = current_app.config
+
+            distance_matrix_client = DistanceMatrixClient(
+                url=config['DISTANCE_MATRIX_URL'],
+                api_key=config['GOOGLE_MAPS_API_KEY'],
+                connect_timeout=config['DISTANCE_MATRIX_CONNECT_TIMEOUT'],
+                read_timeout=config['DISTANCE_MATRIX_READ_TIMEOUT'],
+                retries=config['DISTANCE_MATRIX_RETRIES'],
+                breaker=CircuitBreaker(failure_threshold=config['DISTANCE_MATRIX_BREAKER_FAILURES'],
+                                       reset_timeout=config['DISTANCE_MATRIX_BREAKER_RESET'])
+            )
+
+    return distance_matrix_client
@@ -0,0 +1,146 @@
+"""
+Distance providers fill in how far away each address in a page of search results is from the searcher.
+
+google: driving distances from the Google Distance Matrix API (billed per origin/destination element),
+        cached in redis so each pair is only paid for once
+local: great-circle distances computed in process, with no network calls
+
+Which one is used is set by DISTANCE_PROVIDER in config.py.
+"""
+from time import time
+
+import numpy as np
+from flask import current_app
+from metrics import increment_counters
+from resources.user.utils.distance_cache import DistanceCache
+from resources.user.utils.distance_matrix_client import (DistanceMatrixClient,
+                                                         get_distance_matrix_client)
+
+# mean earth radius (IUGG), in meters
+EARTH_RADIUS = 6371008.8
+
+
+def haversine_distances(origin: tuple, destinations: list) -> np.ndarray:
+    """
+    Takes in an origin (latitude, longitude) and a list of destinations [(latitude, longitude), ...]
+    Returns the great-circle distance in meters from the origin to every destination,
+    computed for the whole list at once.
+    """
+    origin_lat, origin_lon = np.radians(origin)
+    destination_coordinates = np.radians(np.asarray(destinations, dtype=float).reshape(-1, 2))
+    destination_lats = destination_coordinates[:, 0]
+    destination_lons = destination_coordinates[:, 1]
+
+    a = np.sin((destination_lats - origin_lat) / 2) ** 2 + \
+        np.cos(origin_lat) * np.cos(destination_lats) * np.sin((destination_lons - origin_lon) / 2) ** 2
+
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def format_distance(meters: float) -> str:
+    """
+    Formats a distance in meters the same way the Distance Matrix API formats its distance text,
+    ie, '850 m' or '12.3 km'
+    """
+    if meters < 1000:
+        return '{} m'.format(int(round(meters)))
+
+    return '{} km'.format(round(meters / 1000, 1))
+
+
+class LocalDistanceProvider:
+    """
+    Great-circle (as the crow flies) distances, computed without leaving the process.
+    """
+
+    def get_distances(self, origin: tuple, destinations: list) -> list:
+        """
+        Takes in an origin (latitude, longitude) and a list of destinations [(latitude, longitude), ...]
+        Returns a list of distance strings, one per destination
+        """
+        if not destinations:
+            return []
+
+        return [format_distance(meters) for meters in haversine_distances(origin, destinations)]
+
+
+class GoogleDistanceProvider:
+    """
+    Driving distances from the Google Distance Matrix API.
+    With a DistanceCache, only destinations that aren't cached yet are sent to google.
+    """
+
+    def __init__(self, client: DistanceMatrixClient, cache: DistanceCache = None):
+        self.client = client
+        self.cache = cache
+
+    def get_distances(self, origin: tuple, destinations: list) -> list:
+        """
+        Takes in an origin (latitude, longitude) and a list of destinations [(latitude, longitude), ...]
+        Returns a list of distance strings, one per destination.
+        Destinations google couldn't route to are None, and so is the whole list if the request fails
+        (or the client's circuit breaker is open).
+        """
+        if not destinations:
+            return []
+
+        if self.cache:
+            distances = self.cache.get_many(origin, destinations)
+            keys = [self.cache.key(origin, destination) for destination in destinations]
+        else:
+            distances = [None] * len(destinations)
+            keys = destinations
+
+        # every uncached destination once (by cache key, so nearby duplicates only cost one element)
+        missing = {}
+        for key, destination, distance in zip(keys, destinations, distances):
+            if distance is None:
+                missing.setdefault(key, destination)
+
+        counters = {'distance_cache_hits': len(destinations) - distances.count(None),
+                    'distance_cache_misses': len(missing)}
+
+        if missing:
+            started = time()
+            fetched = self.get_distances_from_google(origin, list(missing.values()))
+            counters['distance_matrix_requests'] = 1
+            counters['distance_matrix_elements'] = len(missing)
+            counters['distance_matrix_ms'] = (time() - started) * 1000
+
+            if fetched is None:
+                increment_counters(counters)
+                return None
+
+            fetched = dict(zip(missing, fetched))
+
+            if self.cache:
+                self.cache.set_many(origin, {destination: fetched[key]
+                                             for key, destination in missing.items()
+                                             if fetched[key] is not None})
+
+            distances = [fetched[key] if distance is None else distance
+                         for key, distance in zip(keys, distances)]
+
+        increment_counters(counters)
+
+        return distances
+
+    def get_distances_from_google(self, origin: tuple, destinations: list) -> list:
+        """
+        Makes one Distance Matrix request for a list of destinations
+        Returns a list of distance strings (or None), or None if the request fails
+        """
+        return self.client.get_distances(origin, destinations)
+
+
+def get_distance_provider():
+    """
+    Returns the distance provider set by DISTANCE_PROVIDER in the app config
+    """
+    if current_app.config['DISTANCE_PROVIDER'] == 'google':
+        cache = DistanceCache(precision=current_app.config['DISTANCE_CACHE_PRECISION'],
+                              ttl=current_app.config['DISTANCE_CACHE_TTL'])
+
+        return GoogleDistanceProvider(client=get_distance_matrix_client(), cache=cache)
+
+    return LocalDistanceProvider()
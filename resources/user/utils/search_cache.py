@@ -0,0 +1,156 @@
+"""
+A cache of search result pages shared by every worker through redis.
+
+Referring clinics run the same few searches all day, so a page is kept for a few minutes
+keyed by everything that decides what is on it. Searches run from the searchers exact origin,
+but pages are keyed by the origins geohash cell (and only cached for radii that are a whole bucket),
+so searchers in the same neighbourhood share pages. Distances are not cached with the page,
+they are still worked out from the searchers exact origin on every request.
+
+Every specialty has a generation number that is part of its keys. Committing a change to a providers
+search rows bumps the generation of their specialty (see listen_for_searchable_changes), which orphans every cached page of it at once
+(the orphans expire with their ttl). Anything cached across specialties (eg, map tiles)
+uses ALL_SPECIALTIES_GENERATION_KEY, which is bumped along with any of them.
+"""
+from hashlib import sha1
+from json import dumps, loads
+from math import ceil
+
+from flask import current_app
+from metrics import increment_counters
+from redis.exceptions import RedisError
+
+from extensions import redis_store
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash(latitude: float, longitude: float, precision: int) -> str:
+    """
+    Returns the geohash of the cell (latitude, longitude) is in, precision characters long
+    (7 characters is a cell of ~150 x 150 meters)
+    """
+    latitude_range = [-90.0, 90.0]
+    longitude_range = [-180.0, 180.0]
+
+    cell = []
+    bits = 0
+    bit_count = 0
+    is_longitude_bit = True
+
+    while len(cell) < precision:
+        coordinate, coordinate_range = (longitude, longitude_range) if is_longitude_bit else (latitude, latitude_range)
+        middle = (coordinate_range[0] + coordinate_range[1]) / 2
+
+        bits <<= 1
+        if coordinate >= middle:
+            bits |= 1
+            coordinate_range[0] = middle
+        else:
+            coordinate_range[1] = middle
+
+        is_longitude_bit = not is_longitude_bit
+        bit_count += 1
+
+        if bit_count == 5:
+            cell.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+
+    return ''.join(cell)
+
+
+ALL_SPECIALTIES_GENERATION_KEY = 'search_generation:all'
+
+
+def generation_key(specialty_id: int) -> str:
+    return 'search_generation:{}'.format(specialty_id)
+
+
+class SearchCache:
+
+    def __init__(self, ttl: int, geohash_precision: int, radius_bucket: int):
+        """
+        ttl: seconds a page lives for
+        geohash_precision: length of the geohash cell pages are keyed by
+        radius_bucket: only pages of radii that are a multiple of it (in meters) are cached
+        """
+        self.ttl = ttl
+        self.geohash_precision = geohash_precision
+        self.radius_bucket = radius_bucket
+
+    def quantize_origin(self, latitude: float, longitude: float) -> str:
+        """
+        Returns the geohash cell of the origin
+        """
+        return geohash(latitude, longitude, self.geohash_precision)
+
+    def quantize_radius(self, radius: int) -> int:
+        return int(ceil(radius / self.radius_bucket) * self.radius_bucket)
+
+    def lookup(self, specialty_id: int, parameters: dict) -> tuple:
+        """
+        Takes in the specialty and the (normalized) parameters of a search
+        Returns the key the page is cached under and the cached page, or None for a miss.
+        The key is None if redis can't be reached, the page shouldn't be cached then.
+        """
+        try:
+            generation = int(redis_store.get(generation_key(specialty_id)) or 0)
+
+            key = 'search:{}:{}:{}'.format(specialty_id, generation, sha1(
+                dumps(parameters, sort_keys=True).encode('utf-8')).hexdigest())
+
+            cached = redis_store.get(key)
+        except RedisError:
+            return None, None
+
+        if cached is None:
+            return key, None
+
+        return key, loads(cached.decode('utf-8'))
+
+    def store(self, key: str, page: dict):
+        try:
+            redis_store.set(key, dumps(page), self.ttl)
+        except RedisError:
+            pass
+
+
+def invalidate_search_cache(*specialty_ids):
+    """
+    Takes in the specialties of providers whose profiles just changed,
+    and drops every cached search page for them.
+    Call it after the change is committed, so a page built in between is never cached under the new generation
+    (commits that change searchable_providers rows call it already).
+    """
+    specialty_ids = {specialty_id for specialty_id in specialty_ids if specialty_id is not None}
+
+    if not specialty_ids:
+        return
+
+    try:
+        pipeline = redis_store.pipeline(transaction=False)
+
+        for specialty_id in specialty_ids:
+            pipeline.incr(generation_key(specialty_id))
+
+        pipeline.incr(ALL_SPECIALTIES_GENERATION_KEY)
+
+        pipeline.execute()
+    except RedisError:
+        # stale pages run out with their ttl
+        increment_counters({'search_cache_invalidation_failures': 1})
+
+
+def get_search_cache() -> SearchCache:
+    """
+    Returns the search cache configured in the app config, or None if SEARCH_CACHE_TTL is 0
+    """
+    config = current_app.config
+
+    if not config['SEARCH_CACHE_TTL']:
+        return None
+
+    return SearchCache(ttl=config['SEARCH_CACHE_TTL'],
+                       geohash_precision=config['SEARCH_CACHE_GEOHASH_PRECISION'],
+                       radius_bucket=config['SEARCH_CACHE_RADIUS_BUCKET'])
@@ -0,0 +1,36 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from json import dumps, loads
+from math import isfinite
+
+
+def encode_cursor(sort: str, origin: tuple, after: tuple) -> str:
+    """
+    Takes in the sort of a search, the (latitude, longitude) it was searched from
+    and the (sort value, user id) its last result was at
+    Returns an opaque token the client sends back (as ?cursor=) for the next page
+    """
+    return urlsafe_b64encode(dumps([sort, *origin, *after]).encode('utf-8')).decode('utf-8')
+
+
+def decode_cursor(cursor: str, sort: str) -> tuple:
+    """
+    Takes in a token from encode_cursor and the sort of the current search
+    Returns the (latitude, longitude) the next page is searched from and the (sort value, user id) it starts after.
+    Sort values (eg, distances) are only comparable from the origin they were worked out from,
+    which is not the searchers own if they got the last page from the cache.
+    Raises a ValueError if the token is garbled or was made for a different sort.
+    """
+    try:
+        cursor_sort, latitude, longitude, sort_value, user_id = loads(urlsafe_b64decode(cursor.encode('utf-8')))
+    except (BinasciiError, UnicodeDecodeError, TypeError, ValueError):
+        raise ValueError('Invalid cursor.')
+
+    if cursor_sort != sort or not isinstance(sort_value, (int, float)) or not isinstance(user_id, int):
+        raise ValueError('Invalid cursor.')
+
+    if not (isinstance(latitude, (int, float)) and isinstance(longitude, (int, float))
+            and isfinite(latitude) and isfinite(longitude) and -90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError('Invalid cursor.')
+
+    return (latitude, longitude), (sort_value, user_id)
@@ -0,0 +1,161 @@
+"""
+Makes identical requests that arrive at the same time share one computation.
+
+Inside a worker, the first thread to ask for a key (the leader) computes it,
+and every other thread asking for the same key waits for its result.
+Across workers, the leaders race for a short lived redis lock (SET NX PX). The one that gets it computes,
+the others poll load (eg, a cache lookup) until the winner's result shows up there,
+waiting twice as long after every miss (up to max_poll_interval), so a slow search isn't polled for hundreds of times.
+
+Nobody waits longer than wait_timeout. A follower whose leader failed, timed out or
+released its lock without a result computes the result itself.
+"""
+from threading import Event, Lock
+from time import monotonic, sleep
+from uuid import uuid4
+
+from flask import current_app
+from metrics import increment_counters
+from redis.exceptions import RedisError, WatchError
+
+from extensions import redis_store
+
+
+class Flight:
+    """
+    One computation in progress in this worker
+    """
+
+    def __init__(self):
+        self.done = Event()
+        self.succeeded = False
+        self.result = None
+
+
+class SingleFlight:
+
+    def __init__(self, lock_ttl: int, wait_timeout: float, poll_interval: float, max_poll_interval: float):
+        """
+        lock_ttl: milliseconds the redis lock is held for at most, in case its holder dies
+        wait_timeout: seconds a follower waits for the leader before computing the result itself
+        poll_interval: seconds before the first load call while another worker computes
+        max_poll_interval: seconds between load calls at most, the interval doubles up to it
+        """
+        self.lock_ttl = lock_ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.flights = {}
+        self.lock = Lock()
+
+    def run(self, key: str, compute, load=None):
+        """
+        Takes in a key identifying the computation, compute (a function that returns the result)
+        and optionally load (a function that returns the result another worker computed, or None)
+        Returns the result. Without load, calls are only shared within this worker.
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            is_leader = flight is None
+
+            if is_leader:
+                flight = self.flights[key] = Flight()
+
+        if not is_leader:
+            if flight.done.wait(self.wait_timeout) and flight.succeeded:
+                increment_counters({'single_flight_shared': 1})
+                return flight.result
+
+            increment_counters({'single_flight_fallbacks': 1})
+            return compute()
+
+        try:
+            flight.result = self.run_across_workers(key, compute, load)
+            flight.succeeded = True
+
+            return flight.result
+        finally:
+            with self.lock:
+                del self.flights[key]
+
+            flight.done.set()
+
+    def run_across_workers(self, key: str, compute, load):
+        if load is None:
+            return compute()
+
+        lock_key = 'single_flight:{}'.format(key)
+        token = uuid4().hex
+
+        try:
+            is_leader = redis_store.set(lock_key, token, px=self.lock_ttl, nx=True)
+        except RedisError:
+            return compute()
+
+        if is_leader:
+            try:
+                return compute()
+            finally:
+                self.release(lock_key, token)
+
+        # another worker is computing it, wait for its result to show up
+        deadline = monotonic() + self.wait_timeout
+        poll_interval = self.poll_interval
+
+        while monotonic() < deadline:
+            sleep(min(poll_interval, max(deadline - monotonic(), 0)))
+            poll_interval = min(poll_interval * 2, self.max_poll_interval)
+
+            result = load()
+            if result is not None:
+                increment_counters({'single_flight_shared': 1})
+                return result
+
+            try:
+                if not redis_store.exists(lock_key):
+                    # the other worker finished without a result
+                    break
+            except RedisError:
+                break
+
+        increment_counters({'single_flight_fallbacks': 1})
+        return compute()
+
+    def release(self, lock_key: str, token: str):
+        """
+        Deletes the lock, unless it expired and another worker holds it by now
+        """
+        try:
+            with redis_store.pipeline() as pipeline:
+                pipeline.watch(lock_key)
+
+                if pipeline.get(lock_key) == token.encode('utf-8'):
+                    pipeline.multi()
+                    pipeline.delete(lock_key)
+                    pipeline.execute()
+        except (RedisError, WatchError):
+            # the lock expires on its own
+            pass
+
+
+# one per worker, created on first use, so every thread in the worker shares its flights
+search_single_flight = None
+search_single_flight_lock = Lock()
+
+
+def get_search_single_flight() -> SingleFlight:
+    """
+    Returns this workers SingleFlight for searches, configured from the app config
+    """
+    global search_single_flight
+
+    with search_single_flight_lock:
+        if search_single_flight is None:
+            config = current_app.config
+
+            search_single_flight = SingleFlight(lock_ttl=config['SEARCH_SINGLE_FLIGHT_LOCK_TTL'],
+                                                wait_timeout=config['SEARCH_SINGLE_FLIGHT_WAIT'],
+                                                poll_interval=config['SEARCH_SINGLE_FLIGHT_POLL_INTERVAL'],
+                                                max_poll_interval=config['SEARCH_SINGLE_FLIGHT_MAX_POLL_INTERVAL'])
+
+    return search_single_flight
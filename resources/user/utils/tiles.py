@@ -0,0 +1,98 @@
+"""
+Map tiles, in the z/x/y scheme web maps request them in (a.k.a. slippy map tiles).
+
+At zoom z the world (in web mercator, EPSG:3857) is split into 2^z x 2^z square tiles,
+x counting east from the antimeridian and y counting south from the top.
+
+Anything worked out per tile (clusters, vector tiles) is cached in redis per tile,
+under the search generation of its specialty (or of all of them, see search_cache.py),
+so a profile change drops the tiles it's on along with its search pages.
+"""
+from hashlib import sha1
+from json import dumps
+from math import atan, degrees, exp, pi
+
+from redis.exceptions import RedisError
+
+from extensions import redis_store
+from resources.user.utils.search_cache import (ALL_SPECIALTIES_GENERATION_KEY,
+                                               generation_key)
+
+# half the width of the web mercator world, in meters
+MERCATOR_EXTENT = 20037508.342789244
+
+MAX_ZOOM = 22
+
+
+def is_valid_tile(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def tile_mercator_bounds(z: int, x: int, y: int) -> tuple:
+    """
+    Returns the (west, south, east, north) of a tile in web mercator meters
+    """
+    size = 2 * MERCATOR_EXTENT / 2 ** z
+
+    west = -MERCATOR_EXTENT + x * size
+    north = MERCATOR_EXTENT - y * size
+
+    return west, north - size, west + size, north
+
+
+def tile_bounds(z: int, x: int, y: int) -> tuple:
+    """
+    Returns the (west, south, east, north) of a tile in degrees of longitude and latitude
+    """
+    return tuple(mercator_to_degrees(meters, is_latitude=index % 2 == 1)
+                 for index, meters in enumerate(tile_mercator_bounds(z, x, y)))
+
+
+def mercator_to_degrees(meters: float, is_latitude: bool) -> float:
+    if is_latitude:
+        return degrees(2 * atan(exp(meters / MERCATOR_EXTENT * pi)) - pi / 2)
+
+    return meters / MERCATOR_EXTENT * 180
+
+
+class TileCache:
+
+    def __init__(self, layer: str, ttl: int):
+        """
+        layer: what the tiles are of, tiles of different layers are cached apart
+        ttl: seconds a tile lives for
+        """
+        self.layer = layer
+        self.ttl = ttl
+
+    @staticmethod
+    def generation(specialty_id: int = None) -> int:
+        """
+        Returns the search generation of a specialty, or of all of them without one,
+        or None if redis can't be reached
+        """
+        try:
+            return int(redis_store.get(
+                generation_key(specialty_id) if specialty_id is not None else ALL_SPECIALTIES_GENERATION_KEY) or 0)
+        except RedisError:
+            return None
+
+    def key(self, generation: int, z: int, x: int, y: int, parameters: dict = None) -> str:
+        """
+        Takes in a generation (see generation) and tile, and the (normalized) parameters of the search drawn on it
+        Returns the key the tile is cached under
+        """
+        return 'tile:{}:{}:{}/{}/{}:{}'.format(self.layer, generation, z, x, y, sha1(
+            dumps(parameters or {}, sort_keys=True).encode('utf-8')).hexdigest())
+
+    def get(self, key: str) -> bytes:
+        try:
+            return redis_store.get(key)
+        except RedisError:
+            return None
+
+    def set(self, key: str, tile: bytes):
+        try:
+            redis_store.set(key, tile, self.ttl)
+        except RedisError:
+            pass
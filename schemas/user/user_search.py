@@ -0,0 +1,49 @@
+from marshmallow import Schema, fields
+from schemas.address import AddressModelSchema
+from schemas.procedural_wait_time import ProceduralWaitTimeModelSchema
+from schemas.designation import DesignationSchema
+from schemas.language import LangaugeSchema
+from schemas.specialty import SpecialtySchema
+
+
+class SearchResultAddressSchema(AddressModelSchema):
+    """
+    Schema for SearchResultAddress
+
+    An address on a search result card, is_nearest marks the one nearest to the search origin
+    """
+    is_nearest = fields.Boolean()
+
+
+class SearchResultProviderSchema(Schema):
+    """
+    Schema for SearchResultProvider
+
+    Used to serialize the provider fields shown on a search result card:
+    specialty, subspecialty_or_special_interests, consultation_wait,
+    addresses, procedural_wait_times, languages, designations, nearest_distance (in meters)
+    """
+    addresses = fields.Nested(SearchResultAddressSchema, many=True)
+    procedural_wait_times = fields.Nested(ProceduralWaitTimeModelSchema, many=True)
+
+    designations = fields.Nested(DesignationSchema, many=True)
+    languages = fields.Nested(LangaugeSchema, many=True)
+
+    specialty = fields.Nested(SpecialtySchema)
+    subspecialty_or_special_interests = fields.Str()
+    consultation_wait = fields.Float(allow_none=True)
+    nearest_distance = fields.Float()
+
+
+class SearchResultSchema(Schema):
+    """
+    Schema for SearchResult (see models/search_result.py)
+
+    Used to serialize a search result card. The full profile is
+    serialized with UserModelSchema on /users/<uuid>/profile.
+    """
+    name = fields.Str()
+    email = fields.Str()
+    uuid = fields.Str()
+    profile_picture_link = fields.Str()
+    provider = fields.Nested(SearchResultProviderSchema)
@@ -1,17 +1,154 @@
-from os import environ
+"""
+Password hashing (pbkdf2_sha256, PASSWORD_HASH_ROUNDS rounds).
+
+Hashing is CPU bound on purpose, so with PASSWORD_HASH_POOL_SIZE set, every worker hashes in a pool
+of that many processes instead of its request threads, and a burst of logins can't take the threads
+(and the GIL) from every other request. At most PASSWORD_HASH_QUEUE_SIZE hashes wait for the pool,
+past that PasswordHashingBusy is raised, and the request should be retried in a moment (a 503).
+It's raised too if a new pool breaks as well, after a broken one (eg, a process killed for its memory) was replaced,
+and if a hash takes more than PASSWORD_HASH_TIMEOUT seconds (a stuck hash keeps its place until it's done).
+"""
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from os import environ, path
+from sys import exec_prefix, executable
+from threading import BoundedSemaphore, Lock
+
+from flask import current_app
 from passlib.context import CryptContext
 
 password_hash_rounds = int(environ["PASSWORD_HASH_ROUNDS"])
 
-pwd_context = CryptContext(
-        schemes=["pbkdf2_sha256"],
-        default="pbkdf2_sha256",
-        pbkdf2_sha256__default_rounds=password_hash_rounds
-)
+
+def build_context(rounds: int) -> CryptContext:
+    return CryptContext(
+            schemes=["pbkdf2_sha256"],
+            default="pbkdf2_sha256",
+            pbkdf2_sha256__default_rounds=rounds
+    )
+
+
+pwd_context = build_context(password_hash_rounds)
+
+
+class PasswordHashingBusy(Exception):
+    """
+    Raised when PASSWORD_HASH_QUEUE_SIZE hashes are already waiting for the pool, the pool keeps breaking,
+    or a hash times out
+    """
+
 
 def encrypt_password(password):
-    return pwd_context.encrypt(password)
+    return hash_in_pool(encrypt_password_inline, password)
 
 
 def check_encrypted_password(password, hashed):
+    return hash_in_pool(check_encrypted_password_inline, password, hashed)
+
+
+def encrypt_password_inline(password):
+    return pwd_context.encrypt(password)
+
+
+def check_encrypted_password_inline(password, hashed):
     return pwd_context.verify(password, hashed)
+
+
+def use_rounds(rounds: int):
+    """
+    Runs in every pool process as it starts, so it hashes with the same rounds as the worker that started it
+    """
+    global pwd_context
+    pwd_context = build_context(rounds)
+
+
+# one per worker, created on first use (after uwsgi forks the workers)
+pool = None
+pool_slots = None
+pool_lock = Lock()
+
+
+def get_pool() -> tuple:
+    """
+    Returns this workers pool and the semaphore of its slots (the pool's processes and its queue),
+    starting a new pool if there's none
+    """
+    global pool, pool_slots
+
+    config = current_app.config
+
+    with pool_lock:
+        if pool is None:
+            # spawned, not forked: a fork would copy this workers threads' locks (and its db connections).
+            # under uwsgi, executable is uwsgi itself, so the pool is started with the python next to it
+            context = get_context('spawn')
+
+            if not path.basename(executable).startswith('python'):
+                context.set_executable(path.join(exec_prefix, 'bin', 'python'))
+
+            pool = ProcessPoolExecutor(max_workers=config['PASSWORD_HASH_POOL_SIZE'], mp_context=context,
+                                       initializer=use_rounds, initargs=(password_hash_rounds,))
+
+        # kept across pools, hashes waiting when a pool is replaced still hold their slots
+        if pool_slots is None:
+            pool_slots = BoundedSemaphore(config['PASSWORD_HASH_POOL_SIZE'] + config['PASSWORD_HASH_QUEUE_SIZE'])
+
+        return pool, pool_slots
+
+
+def discard_pool(broken_pool: ProcessPoolExecutor):
+    """
+    Forgets a broken pool, so the next hash starts a new one (unless another thread did already)
+    """
+    global pool
+
+    with pool_lock:
+        if pool is broken_pool:
+            pool = None
+
+
+def hash_in_pool(function, *args):
+    """
+    Returns function(*args), run in this workers pool, or right here without one (PASSWORD_HASH_POOL_SIZE 0)
+    Raises PasswordHashingBusy when the pool and its queue are full, a new pool breaks too,
+    or the hash isn't done in PASSWORD_HASH_TIMEOUT seconds.
+    """
+    config = current_app.config
+
+    if not config['PASSWORD_HASH_POOL_SIZE']:
+        return function(*args)
+
+    current_pool, slots = get_pool()
+
+    if not slots.acquire(blocking=False):
+        raise PasswordHashingBusy()
+
+    timeout = config['PASSWORD_HASH_TIMEOUT']
+    is_slot_released_now = True
+
+    try:
+        try:
+            future = current_pool.submit(function, *args)
+            return future.result(timeout)
+        except BrokenProcessPool:
+            # a pool process died (eg, killed for using too much memory), so try once more in a new pool
+            discard_pool(current_pool)
+            current_pool, _ = get_pool()
+
+        try:
+            future = current_pool.submit(function, *args)
+            return future.result(timeout)
+        except BrokenProcessPool:
+            discard_pool(current_pool)
+            raise PasswordHashingBusy()
+    except FutureTimeoutError:
+        # a hash still waiting is dropped, one in progress keeps its process (and slot) until it's done,
+        # so a stuck pool turns hashes away at once instead of after a timeout each
+        is_slot_released_now = False
+        future.cancel()
+        future.add_done_callback(lambda _: slots.release())
+        raise PasswordHashingBusy()
+    finally:
+        if is_slot_released_now:
+            slots.release()
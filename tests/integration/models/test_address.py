@@ -38,3 +38,19 @@ class AddressModelTest(BaseTest):
 
             self.assertIsNotNone(AddressModel.find_by_id(
                 1), "Did not find a address with id '1' after save_to_db")
+
+    def test_geog_follows_coordinates(self):
+        with self.app_context():
+            address = AddressModel(address="200 University Ave W, Waterloo, ON N2L 3G1",
+                                   latitude=43.4717512, longitude=-80.5459129, geo=None)
+
+            self.assertEqual(address.geog, 'SRID=4326;POINT(-80.5459129 43.4717512)')
+
+            address.latitude = 43.4643
+            self.assertEqual(address.geog, 'SRID=4326;POINT(-80.5459129 43.4643)')
+
+            # never POINT(None None)
+            address.longitude = None
+            self.assertIsNone(address.geog)
+
+            self.assertIsNone(AddressModel(address="Unknown", latitude=None, longitude=None, geo=None).geog)
@@ -1,3 +1,5 @@
+from claims import load_claims
+from extensions import db
 from models.user import UserModel
 from uuid import uuid4
 from tests.base_test import BaseTest
@@ -20,4 +22,15 @@ class UserModelTest(BaseTest):
 
             self.assertIsNotNone(UserModel.find_by_email(email), "Did not find a user with email 'test@icarusmed.com' after save_to_db")
             self.assertIsNotNone(UserModel.find_by_id(1), "Did not find a user with id '1' after save_to_db")
-            self.assertIsNotNone(UserModel.find_by_uuid(uuid), "Did not find a user with uuid {} after save_to_db".format(uuid))
\ No newline at end of file
+            self.assertIsNotNone(UserModel.find_by_uuid(uuid), "Did not find a user with uuid {} after save_to_db".format(uuid))
+
+    def test_load_claims(self):
+        with self.app_context():
+            user = UserModel(name='Testing Tester', email='test@icarusmed.com', password='123', uuid=str(uuid4()))
+            user.save_to_db()
+
+            # changed behind the back of the user already in the session
+            db.session.execute(UserModel.__table__.update().values(is_verified_professional=True))
+
+            self.assertTrue(load_claims(user.uuid)['is_verified_professional'])
+            self.assertEqual(load_claims('no-such-uuid'), {})
@@ -0,0 +1,508 @@
+from datetime import time
+from uuid import uuid4
+
+from extensions import db, redis_store
+from models.address import AddressModel
+from models.designation import DesignationModel
+from models.language import LanguageModel
+from models.procedural_wait_time import ProceduralWaitTimeModel
+from models.searchable_provider import SearchableProviderModel
+from models.specialty import SpecialtyModel
+from models.user import ProviderModel, SearchScoring, UserModel
+from resources.user.utils.search_cache import generation_key
+from resources.user.utils.tiles import tile_bounds, tile_mercator_bounds
+from schemas.user.user_search import SearchResultSchema
+from sqlalchemy import event
+from tests.base_test import BaseTest
+
+search_result_schema = SearchResultSchema()
+
+
+def count_queries(function) -> int:
+    """
+    Calls function and returns how many sql statements it ran
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        function()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    return len(statements)
+
+
+def create_provider(name, specialty_id, coordinates, consultation_wait=None,
+                    user_type=0, is_verified_professional=True):
+    """
+    Saves a searchable provider with an address at each (latitude, longitude) in coordinates
+    """
+    user = UserModel(name=name,
+                     email='{}@icarusmed.com'.format(uuid4()),
+                     password='123',
+                     uuid=str(uuid4()),
+                     user_type=user_type,
+                     is_verified_professional=is_verified_professional)
+    user.provider = ProviderModel(user.id,
+                                  specialty_id=specialty_id,
+                                  consultation_wait=consultation_wait)
+
+    for latitude, longitude in coordinates:
+        user.provider.addresses.append(AddressModel(address='{}, {}'.format(latitude, longitude),
+                                                    latitude=latitude,
+                                                    longitude=longitude,
+                                                    geo='POINT({} {})'.format(longitude, latitude)))
+
+    user.save_to_db()
+
+    return user
+
+
+class UserSearchTest(BaseTest):
+    def setUp(self):
+        super().setUp()
+
+        with self.app_context():
+            SpecialtyModel(name='Cardiology').save_to_db()
+            SpecialtyModel(name='Dermatology').save_to_db()
+
+    def test_get_users_within_radius_sorted_by_distance(self):
+        with self.app_context():
+            # kitchener is within 50km of waterloo, toronto and montreal are not
+            far = create_provider('Far', 1, [(43.4516, -80.4925)], consultation_wait=1)
+            near = create_provider('Near', 1, [(43.6532, -79.3832), (43.4717, -80.5459)], consultation_wait=5)
+            create_provider('Other Specialty', 2, [(43.4717, -80.5459)])
+            create_provider('Unverified', 1, [(43.4717, -80.5459)], is_verified_professional=False)
+            create_provider('Out of Range', 1, [(45.5017, -73.5673)])
+
+            searcher = UserModel.find_by_uuid(near.uuid)
+
+            results = searcher.get_users_within_radius(
+                searcher_id=searcher.id, specialty_id=1, radius=50000, page=1, sort='dist',
+                u_geo='POINT(-80.5449 43.4723)')
+
+            self.assertEqual([user.name for user in results.items], ['Near', 'Far'])
+            self.assertEqual(results.total, 2)
+
+            results = searcher.get_users_within_radius(
+                searcher_id=searcher.id, specialty_id=1, radius=50000, page=1, sort='wait',
+                u_geo='POINT(-80.5449 43.4723)')
+
+            self.assertEqual([user.uuid for user in results.items], [far.uuid, near.uuid])
+
+    def test_get_users_within_radius_pages(self):
+        with self.app_context():
+            for count in range(8):
+                create_provider('Provider {}'.format(count), 1, [(43.4717 + count / 1000, -80.5459)])
+
+            searcher = UserModel.find_by_id(1)
+
+            first_page = searcher.get_users_within_radius(
+                searcher_id=searcher.id, specialty_id=1, radius=50000, page=1, sort='dist',
+                u_geo='POINT(-80.5459 43.4717)')
+            second_page = searcher.get_users_within_radius(
+                searcher_id=searcher.id, specialty_id=1, radius=50000, page=2, sort='dist',
+                u_geo='POINT(-80.5459 43.4717)')
+            past_the_end = searcher.get_users_within_radius(
+                searcher_id=searcher.id, specialty_id=1, radius=50000, page=3, sort='dist',
+                u_geo='POINT(-80.5459 43.4717)')
+
+            self.assertEqual(len(first_page.items), 6)
+            self.assertEqual(len(second_page.items), 2)
+            self.assertEqual(first_page.total, 8)
+            self.assertEqual(second_page.total, 8)
+            self.assertEqual(past_the_end.items, [])
+            self.assertEqual(past_the_end.total, 8)
+            self.assertFalse({user.id for user in first_page.items} & {user.id for user in second_page.items})
+
+    def test_get_users_within_radius_after_cursor(self):
+        with self.app_context():
+            for count in range(5):
+                create_provider('Provider {}'.format(count), 1, [(43.4717, -80.5459)],
+                                consultation_wait=count % 2 or None)
+
+            searcher = UserModel.find_by_id(1)
+
+            seen = []
+            after = None
+            while True:
+                results = searcher.get_users_within_radius(
+                    searcher_id=searcher.id, specialty_id=1, radius=50000, page=1, sort='wait',
+                    u_geo='POINT(-80.5459 43.4717)', per_page=2, after=after, with_total=False)
+
+                self.assertIsNone(results.total)
+                seen.extend(user.name for user in results.items)
+
+                if results.next_after is None:
+                    break
+                after = results.next_after
+
+            # waits of 1 first, then the providers without a wait
+            self.assertEqual(seen, ['Provider 1', 'Provider 3', 'Provider 0', 'Provider 2', 'Provider 4'])
+
+    def test_get_users_within_radius_name(self):
+        with self.app_context():
+            create_provider('Dr. John Smith', 1, [(43.4717, -80.5459)])
+            create_provider('Dr. Jane Smithers', 1, [(43.4717, -80.5459)])
+            create_provider('Dr. 100% Jones', 1, [(43.4717, -80.5459)])
+
+            searcher = UserModel.find_by_id(1)
+
+            def search(name, name_match='contains', sort='dist'):
+                results = searcher.get_users_within_radius(
+                    searcher_id=searcher.id, specialty_id=1, radius=50000, page=1, sort=sort,
+                    u_geo='POINT(-80.5459 43.4717)', name=name, name_match=name_match)
+                return [user.name for user in results.items]
+
+            self.assertEqual(sorted(search('smith')), ['Dr. Jane Smithers', 'Dr. John Smith'])
+            # % is matched literally, not as a wildcard
+            self.assertEqual(search('0%'), ['Dr. 100% Jones'])
+            self.assertEqual(search('r%j'), [])
+            # a typo only matches similar names, closest first
+            self.assertEqual(search('jon smith'), [])
+            similar = search('jon smith', name_match='similar', sort='name')
+            self.assertEqual(similar[0], 'Dr. John Smith')
+            self.assertNotIn('Dr. 100% Jones', similar)
+
+    def test_get_users_within_radius_text_query(self):
+        with self.app_context():
+            knees = create_provider('Knees', 1, [(43.4717, -80.5459)])
+            knees.provider.update({'services_provided': 'Treatment of knee injuries',
+                                   'procedural_wait_times': [{'procedure': 'Knee replacement', 'wait_time': 3}]})
+            knees.save_to_db()
+
+            sports = create_provider('Sports', 1, [(43.4717, -80.5459)])
+            sports.provider.update({'subspecialty_or_special_interests': 'Sports injuries of the knee'})
+            sports.save_to_db()
+
+            hands = create_provider('Hands', 1, [(43.4717, -80.5459)])
+            hands.provider.update({'subspecialty_or_special_interests': 'Hand surgery',
+                                   'services_not_provided': 'Knee injuries'})
+            hands.save_to_db()
+
+            create_provider('No Profile', 1, [(43.4717, -80.5459)])
+
+            searcher = UserModel.find_by_id(1)
+
+            def search(text_query, sort='relevance'):
+                results = searcher.get_users_within_radius(
+                    searcher_id=searcher.id, specialty_id=1, radius=50000, page=1, sort=sort,
+                    u_geo='POINT(-80.5459 43.4717)', text_query=text_query)
+                return [user.name for user in results.items]
+
+            # the special interest outweighs the services provided
+            self.assertEqual(search('knee injury'), ['Sports', 'Knees'])
+            self.assertEqual(search('replacements'), ['Knees'])
+            self.assertEqual(search('hand'), ['Hands'])
+
+    def test_get_users_within_radius_procedure(self):
+        with self.app_context():
+            for name, procedures in (('Slow', [('Colonoscopy', 8)]),
+                                     ('Fast', [('Colonoscopy with biopsy', 2), ('Gastroscopy', 1)]),
+                                     ('Exact', [('colonoscopy', 4)]),
+                                     ('None', [('Gastroscopy', 1)])):
+                user = create_provider(name, 1, [(43.4717, -80.5459)])
+                user.provider.procedural_wait_times = [ProceduralWaitTimeModel(procedure=procedure, wait_time=wait_time)
+                                                       for procedure, wait_time in procedures]
+                user.save_to_db()
+
+            searcher = UserModel.find_by_id(1)
+
+            def search(procedure, procedure_match='exact', max_procedure_wait=None):
+                results = searcher.get_users_within_radius(
+                    searcher_id=searcher.id, specialty_id=1, radius=25000, page=1, sort='procedure_wait',
+                    u_geo='POINT(-80.5459 43.4717)', procedure=procedure, procedure_match=procedure_match,
+                    max_procedure_wait=max_procedure_wait)
+                return [user.name for user in results.items]
+
+            self.assertEqual(search('COLONOSCOPY'), ['Exact', 'Slow'])
+            self.assertEqual(search('colonoscopy', 'similar'), ['Fast', 'Exact', 'Slow'])
+            self.assertEqual(search('colonoscopy', 'similar', max_procedure_wait=4), ['Fast', 'Exact'])
+
+    def test_get_users_within_radius_open_at(self):
+        with self.app_context():
+            for name, start_hour, end_hour in (('Days', time(9), time(17)),
+                                               ('Nights', time(20), time(2)),
+                                               ('Around the Clock', time(0), time(0)),
+                                               ('No Hours', None, None)):
+                user = create_provider(name, 1, [(43.4717, -80.5459)])
+                user.provider.addresses[0].start_hour = start_hour
+                user.provider.addresses[0].end_hour = end_hour
+                user.save_to_db()
+
+            searcher = UserModel.find_by_id(1)
+
+            def search(**filters):
+                results = searcher.get_users_within_radius(
+                    searcher_id=searcher.id, specialty_id=1, radius=50000, page=1, sort='dist',
+                    u_geo='POINT(-80.5459 43.4717)', **filters)
+                return {user.name for user in results.items}
+
+            self.assertEqual(search(open_at=time(12)), {'Days', 'Around the Clock'})
+            self.assertEqual(search(open_at=time(17)), {'Around the Clock'})
+            self.assertEqual(search(open_at=time(1, 30)), {'Nights', 'Around the Clock'})
+            self.assertEqual(search(open_at=time(21)), {'Nights', 'Around the Clock'})
+            self.assertIn('Around the Clock', search(open_now=True, office_timezone='America/Toronto'))
+
+    def test_open_at_uses_hours_indexes(self):
+        with self.app_context():
+            query = UserModel.filter_search_candidates(db.session.query(SearchableProviderModel.user_id),
+                                                       open_at=time(12))
+            statement = query.statement.compile(dialect=db.engine.dialect)
+
+            # the table is nearly empty, so a sequential scan would win otherwise
+            connection = db.session.connection()
+            connection.execute('SET LOCAL enable_seqscan = off')
+            plan = '\n'.join(row[0] for row in connection.execute('EXPLAIN ' + str(statement), statement.params))
+
+            # both branches of the condition are answered by their index
+            self.assertIn('ix_searchable_providers_daytime_hours', plan)
+            self.assertIn('ix_searchable_providers_overnight_hours', plan)
+
+    def test_get_users_within_radius_score(self):
+        with self.app_context():
+            # kitchener is ~5km from waterloo
+            create_provider('Waterloo', 1, [(43.4717, -80.5459)], consultation_wait=20)
+            create_provider('Kitchener', 1, [(43.4516, -80.4925)], consultation_wait=1)
+
+            waterloo = UserModel.find_by_id(1)
+            waterloo.provider.procedural_wait_times = [ProceduralWaitTimeModel(procedure='Knee replacement', wait_time=2)]
+            waterloo.save_to_db()
+
+            def search(procedure=None, candidates=500):
+                results = waterloo.get_users_within_radius(
+                    searcher_id=waterloo.id, specialty_id=1, radius=50000, page=1, sort='score',
+                    u_geo='POINT(-80.5459 43.4717)', procedure=procedure,
+                    scoring=SearchScoring(distance_weight=1, wait_weight=1, procedure_wait_weight=1,
+                                          missing_wait=52, candidates=candidates))
+                return [user.name for user in results.items]
+
+            # 5km + 1 week beats 0km + 20 weeks
+            self.assertEqual(search(), ['Kitchener', 'Waterloo'])
+            # but kitchener hasn't entered a wait for the procedure
+            self.assertEqual(search('knee REPLACEMENT'), ['Waterloo', 'Kitchener'])
+            # only the nearest offices are scored
+            self.assertEqual(search(candidates=1), ['Waterloo'])
+
+    def test_searchable_provider_refresh(self):
+        with self.app_context():
+            user = create_provider('Provider', 1, [(43.4717, -80.5459), (43.4516, -80.4925)])
+
+            def searchable_rows():
+                return SearchableProviderModel.query.filter_by(user_id=user.id).order_by(
+                    SearchableProviderModel.address_id).all()
+
+            # one row per address
+            self.assertEqual([row.specialty_id for row in searchable_rows()], [1, 1])
+
+            user.provider.update({'specialty': {'id': 2}, 'consultation_wait': 4})
+            user.save_to_db()
+
+            self.assertEqual([(row.specialty_id, row.consultation_wait) for row in searchable_rows()], [(2, 4), (2, 4)])
+
+            # deleted offices take their rows with them
+            del user.provider.addresses[1]
+            user.save_to_db()
+
+            self.assertEqual([row.address_id for row in searchable_rows()], [user.provider.addresses[0].id])
+
+            user.is_verified_professional = False
+            user.save_to_db()
+
+            self.assertEqual(searchable_rows(), [])
+
+    def test_committed_changes_invalidate_search_cache(self):
+        with self.app_context():
+            user = create_provider('Provider', 1, [(43.4717, -80.5459)])
+
+            def generations():
+                return [int(redis_store.get(generation_key(specialty_id)) or 0) for specialty_id in (1, 2)]
+
+            before = generations()
+
+            # cached in searches of the specialty they had and the one they have now
+            user.provider.update({'specialty': {'id': 2}})
+            user.save_to_db()
+
+            self.assertEqual(generations(), [before[0] + 1, before[1] + 1])
+
+            # their last office is deleted with its row, before refresh could see it
+            del user.provider.addresses[0]
+            user.save_to_db()
+
+            self.assertEqual(generations(), [before[0] + 1, before[1] + 2])
+
+            # nothing searches show
+            user.is_confirmed = True
+            user.save_to_db()
+
+            self.assertEqual(generations(), [before[0] + 1, before[1] + 2])
+
+    def test_get_search_facets(self):
+        with self.app_context():
+            LanguageModel(name='English').save_to_db()
+            LanguageModel(name='French').save_to_db()
+            DesignationModel(name='MD').save_to_db()
+
+            bilingual = create_provider('Bilingual', 1, [(43.4717, -80.5459)])
+            bilingual.provider.languages = LanguageModel.query.all()
+            bilingual.provider.designations = DesignationModel.query.all()
+            bilingual.provider.addresses[0].is_wheelchair_accessible = True
+            bilingual.provider.addresses[0].start_hour = time(9)
+            bilingual.provider.addresses[0].end_hour = time(17)
+            bilingual.save_to_db()
+
+            english = create_provider('English', 1, [(43.4717, -80.5459)])
+            english.provider.languages = [LanguageModel.find_by_id(1)]
+            english.provider.addresses[0].is_accepting_new_patients = True
+            english.provider.procedural_wait_times = [ProceduralWaitTimeModel(procedure='Knee replacement', wait_time=3)]
+            english.save_to_db()
+
+            # out of range and another specialty don't count
+            far = create_provider('Far', 1, [(45.5017, -73.5673)])
+            far.provider.languages = [LanguageModel.find_by_id(2)]
+            far.save_to_db()
+            create_provider('Other Specialty', 2, [(43.4717, -80.5459)])
+
+            facets = english.get_search_facets(specialty_id=1, radius=50000, u_geo='POINT(-80.5459 43.4717)')
+
+            self.assertEqual(facets, {
+                'languages': [{'id': 1, 'count': 2}, {'id': 2, 'count': 1}],
+                'designations': [{'id': 1, 'count': 1}],
+                'is_wheelchair_accessible': 1,
+                'is_accepting_new_patients': 1,
+            })
+
+            facets = english.get_search_facets(specialty_id=1, radius=50000, u_geo='POINT(-80.5459 43.4717)',
+                                               name='english')
+
+            self.assertEqual(facets['languages'], [{'id': 1, 'count': 1}])
+            self.assertEqual(facets['is_wheelchair_accessible'], 0)
+
+            # the same filters as the page they come with
+            facets = english.get_search_facets(specialty_id=1, radius=50000, u_geo='POINT(-80.5459 43.4717)',
+                                               procedure='knee replacement')
+
+            self.assertEqual(facets['languages'], [{'id': 1, 'count': 1}])
+            self.assertEqual(facets['is_accepting_new_patients'], 1)
+
+            facets = english.get_search_facets(specialty_id=1, radius=50000, u_geo='POINT(-80.5459 43.4717)',
+                                               open_at=time(12))
+
+            self.assertEqual(facets['languages'], [{'id': 1, 'count': 1}, {'id': 2, 'count': 1}])
+            self.assertEqual(facets['is_accepting_new_patients'], 0)
+
+    def test_get_users_within_radius_nearest_address(self):
+        with self.app_context():
+            # toronto (first) is out of range, kitchener is nearer than the waterloo office that isn't accessible
+            user = create_provider('Provider', 1, [(43.6532, -79.3832), (43.4717, -80.5459), (43.4516, -80.4925)])
+            user.provider.addresses[1].is_wheelchair_accessible = False
+            user.provider.addresses[2].is_wheelchair_accessible = True
+            user.save_to_db()
+
+            def nearest_address(**filters):
+                results = user.get_users_within_radius(
+                    searcher_id=user.id, specialty_id=1, radius=50000, page=1, sort='dist',
+                    u_geo='POINT(-80.5459 43.4717)', **filters)
+                addresses = results.items[0].provider.addresses
+
+                self.assertEqual([address.is_nearest for address in addresses], [True, False, False])
+                return addresses[0].address, round(results.items[0].provider.nearest_distance / 1000)
+
+            self.assertEqual(nearest_address(), ('43.4717, -80.5459', 0))
+            self.assertEqual(nearest_address(is_wheelchair_accessible=True), ('43.4516, -80.4925', 5))
+
+    def test_get_search_clusters(self):
+        with self.app_context():
+            waterloo = create_provider('Waterloo', 1, [(43.4717, -80.5459), (43.4723, -80.5449)])
+            create_provider('Waterloo Too', 1, [(43.4720, -80.5450)])
+            create_provider('Baden', 1, [(43.4036, -80.6697)])
+            # on the next tile east
+            create_provider('Kitchener', 1, [(43.4516, -80.4925)])
+            create_provider('Other Specialty', 2, [(43.4717, -80.5459)])
+
+            # the tile waterloo is on at zoom 10, in 8 x 8 cells
+            west, south, east, _ = tile_mercator_bounds(10, 282, 374)
+
+            def clusters(**filters):
+                return waterloo.get_search_clusters(specialty_id=1,
+                                                    bounds=tile_bounds(10, 282, 374),
+                                                    grid=(west, south, (east - west) / 8),
+                                                    sample_size=1,
+                                                    **filters)
+
+            waterloo_cluster, baden_cluster = clusters()
+
+            self.assertEqual(waterloo_cluster['count'], 2)
+            self.assertEqual(len(waterloo_cluster['sample']), 1)
+            self.assertAlmostEqual(waterloo_cluster['latitude'], 43.472, places=2)
+            self.assertAlmostEqual(waterloo_cluster['longitude'], -80.545, places=2)
+            self.assertEqual(baden_cluster['count'], 1)
+
+            self.assertEqual([cluster['count'] for cluster in clusters(name='too')], [1])
+
+    def test_get_users_within_radius_result_card(self):
+        with self.app_context():
+            LanguageModel(name='English').save_to_db()
+
+            user = create_provider('Provider', 1, [(43.4717, -80.5459)], consultation_wait=3)
+            user.provider.languages = LanguageModel.query.all()
+            user.provider.procedural_wait_times = [ProceduralWaitTimeModel(procedure='Colonoscopy', wait_time=4)]
+            user.save_to_db()
+
+            results = user.get_users_within_radius(
+                searcher_id=user.id, specialty_id=1, radius=50000, page=1, sort='dist',
+                u_geo='POINT(-80.5459 43.4717)')
+
+            card = search_result_schema.dump(results.items[0])
+
+            self.assertEqual(card['uuid'], user.uuid)
+            self.assertEqual(card['provider']['specialty'], {'id': 1, 'name': 'Cardiology'})
+            self.assertEqual(card['provider']['consultation_wait'], 3)
+            self.assertEqual(card['provider']['languages'], [{'id': 1, 'name': 'English'}])
+            self.assertEqual(card['provider']['procedural_wait_times'], [{'procedure': 'Colonoscopy', 'wait_time': 4}])
+            self.assertEqual(card['provider']['addresses'][0]['address'], '43.4717, -80.5459')
+            self.assertTrue(card['provider']['addresses'][0]['is_nearest'])
+            self.assertAlmostEqual(card['provider']['nearest_distance'], 0)
+            self.assertNotIn('password', card)
+            self.assertNotIn('education_and_qualifications', card['provider'])
+
+    def test_get_users_within_radius_query_count(self):
+        with self.app_context():
+            LanguageModel(name='English').save_to_db()
+            LanguageModel(name='French').save_to_db()
+            DesignationModel(name='MD').save_to_db()
+
+            def create_full_provider(count):
+                user = create_provider('Provider {}'.format(count), 1, [(43.4717, -80.5459), (43.4516, -80.4925)])
+                user.provider.languages = LanguageModel.query.all()
+                user.provider.designations = DesignationModel.query.all()
+                user.provider.procedural_wait_times = [ProceduralWaitTimeModel(procedure='Colonoscopy', wait_time=4)]
+                user.save_to_db()
+
+            def search_and_serialize():
+                # a fresh session, so nothing is already loaded
+                db.session.remove()
+
+                results = searcher.get_users_within_radius(
+                    searcher_id=searcher.id, specialty_id=1, radius=50000, page=1, sort='dist',
+                    u_geo='POINT(-80.5459 43.4717)')
+
+                for specialist in results.items:
+                    search_result_schema.dump(specialist)
+
+            create_full_provider(0)
+            searcher = UserModel.find_by_id(1)
+            one_result = count_queries(search_and_serialize)
+
+            for count in range(1, 6):
+                create_full_provider(count)
+            six_results = count_queries(search_and_serialize)
+
+            # the page, then addresses, procedural wait times, languages and designations
+            self.assertEqual(one_result, 5)
+            self.assertEqual(six_results, 5)
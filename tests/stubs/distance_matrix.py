@@ -0,0 +1,116 @@
+"""
+A local stand-in for the Google Distance Matrix API, for working on search latency and failure handling offline.
+
+It answers GET requests on any path with the same JSON google returns,
+using great-circle distances, after an optional delay and with an optional share of errors.
+
+Run it with:
+    python -m tests.stubs.distance_matrix --port 8099 --delay 0.2 --error-rate 0.1
+and point the app at it:
+    DISTANCE_PROVIDER=google DISTANCE_MATRIX_URL=http://127.0.0.1:8099/ python run.py
+"""
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps
+from random import random
+from threading import Thread
+from time import sleep
+from urllib.parse import parse_qs, urlparse
+
+from resources.user.utils.distance_providers import (format_distance,
+                                                     haversine_distances)
+
+
+def parse_coordinates(value: str) -> tuple:
+    latitude, longitude = value.split(',')
+    return float(latitude), float(longitude)
+
+
+def distance_matrix_response(origins: str, destinations: str) -> dict:
+    """
+    Builds a Distance Matrix style response for a 'lat,lon' origin and '|' separated 'lat,lon' destinations
+    """
+    origin = parse_coordinates(origins)
+    destination_list = [parse_coordinates(destination) for destination in destinations.split('|')]
+
+    elements = [{
+        'distance': {'text': format_distance(meters), 'value': int(round(meters))},
+        # ~50 km/h
+        'duration': {'text': '{} mins'.format(int(meters / 833) + 1), 'value': int(meters / 13.9)},
+        'status': 'OK',
+    } for meters in haversine_distances(origin, destination_list)]
+
+    return {
+        'destination_addresses': destinations.split('|'),
+        'origin_addresses': [origins],
+        'rows': [{'elements': elements}],
+        'status': 'OK',
+    }
+
+
+class StubDistanceMatrixServer:
+    """
+    delay: seconds to wait before every response
+    error_rate: share of requests (0 to 1) answered with error_status instead
+    """
+
+    def __init__(self, port: int = 0, delay: float = 0, error_rate: float = 0, error_status: int = 500):
+        self.delay = delay
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests_received = 0
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests_received += 1
+
+                if stub.delay:
+                    sleep(stub.delay)
+
+                if random() < stub.error_rate:
+                    self.send_response(stub.error_status)
+                    self.end_headers()
+                    return
+
+                query = parse_qs(urlparse(self.path).query)
+                body = dumps(distance_matrix_response(query['origins'][0], query['destinations'][0]))
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body.encode('utf-8'))
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        return 'http://127.0.0.1:{}/'.format(self.server.server_port)
+
+    def start(self):
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--delay', type=float, default=0, help='seconds to wait before every response')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of requests that fail, 0 to 1')
+    parser.add_argument('--error-status', type=int, default=500)
+    arguments = parser.parse_args()
+
+    stub = StubDistanceMatrixServer(port=arguments.port, delay=arguments.delay,
+                                    error_rate=arguments.error_rate, error_status=arguments.error_status)
+    print('Distance Matrix stub listening on {}'.format(stub.url))
+    stub.server.serve_forever()
@@ -0,0 +1,87 @@
+from threading import Thread
+from time import sleep, time
+from unittest import TestCase
+
+from app import app
+from blacklist import (REVOKED_JTIS_CHANNEL, REVOKED_JTIS_KEY,
+                       RevokedTokenFilter, TokenWatermarks, is_token_revoked,
+                       listen, revoke_token, revoke_user_tokens, watermark_key)
+from extensions import redis_store
+
+
+def build_token(uuid, iat, jti='jti-1'):
+    return {'identity': uuid, 'iat': iat, 'jti': jti}
+
+
+def wait_for(condition, timeout=2):
+    deadline = time() + timeout
+
+    while not condition() and time() < deadline:
+        sleep(0.01)
+
+
+class TokenWatermarksTest(TestCase):
+
+    def setUp(self):
+        redis_store.delete(watermark_key('uuid-1'), watermark_key('uuid-2'), 'jti-1', 'jti-2', REVOKED_JTIS_KEY)
+
+    def test_revoke_user_tokens(self):
+        with app.app_context():
+            issued_at = int(time()) - 1
+
+            self.assertFalse(is_token_revoked(build_token('uuid-1', issued_at)))
+
+            revoke_user_tokens('uuid-1')
+
+            self.assertTrue(is_token_revoked(build_token('uuid-1', issued_at)))
+            # issued after the revocation, or to someone else
+            self.assertFalse(is_token_revoked(build_token('uuid-1', int(time()) + 1)))
+            self.assertFalse(is_token_revoked(build_token('uuid-2', issued_at)))
+
+    def test_revoke_token(self):
+        with app.app_context():
+            revoke_token('jti-1')
+
+            # only the token logged out with, the users other tokens still work
+            self.assertTrue(is_token_revoked(build_token('uuid-1', int(time()), jti='jti-1')))
+            self.assertFalse(is_token_revoked(build_token('uuid-1', int(time()), jti='jti-2')))
+
+    def test_listen(self):
+        watermarks = TokenWatermarks(size=1)
+        Thread(target=listen, args=('token_watermarks', watermarks), daemon=True).start()
+        wait_for(lambda: watermarks.is_listening)
+
+        # users without a watermark are remembered too
+        self.assertIsNone(watermarks.get('uuid-1'))
+        self.assertEqual(dict(watermarks.watermarks), {'uuid-1': None})
+
+        revoke_user_tokens('uuid-1')
+        wait_for(lambda: watermarks.watermarks.get('uuid-1'))
+
+        self.assertEqual(watermarks.get('uuid-1'), int(redis_store.get(watermark_key('uuid-1'))))
+
+        # the least recently used go first
+        watermarks.get('uuid-2')
+        self.assertEqual(list(watermarks.watermarks), ['uuid-2'])
+
+    def test_revoked_token_filter(self):
+        revoke_token('jti-1')
+
+        revoked = RevokedTokenFilter(capacity=1000, error_rate=0.001)
+
+        # looked up in redis until the filter is built
+        self.assertFalse(revoked.is_revoked('jti-2'))
+        self.assertEqual(revoked.counters['revoked_token_filter_fallbacks'], 1)
+
+        Thread(target=listen, args=(REVOKED_JTIS_CHANNEL, revoked), daemon=True).start()
+        wait_for(lambda: revoked.bloom_filter is not None)
+
+        # built from the jtis revoked before, and kept current with the ones revoked after
+        self.assertIn('jti-1', revoked.bloom_filter)
+        revoke_token('jti-2')
+        wait_for(lambda: 'jti-2' in revoked.bloom_filter)
+
+        self.assertTrue(revoked.is_revoked('jti-1'))
+        self.assertTrue(revoked.is_revoked('jti-2'))
+        self.assertFalse(revoked.is_revoked('jti-3'))
+        self.assertEqual(revoked.counters['revoked_token_redis_calls_avoided'], 1)
@@ -0,0 +1,29 @@
+from unittest import TestCase
+
+from bloom_filter import BloomFilter
+
+
+class BloomFilterTest(TestCase):
+
+    def test_sizing(self):
+        bloom_filter = BloomFilter(capacity=1000, error_rate=0.01)
+
+        # ~9.6 bits and 7 hashes per item
+        self.assertEqual(bloom_filter.size, 9586)
+        self.assertEqual(bloom_filter.hash_count, 7)
+        self.assertEqual(len(bloom_filter.bits), 1199)
+
+    def test_contains(self):
+        bloom_filter = BloomFilter(capacity=1000, error_rate=0.01)
+        items = ['jti-{}'.format(index) for index in range(1000)]
+
+        for item in items:
+            bloom_filter.add(item)
+
+        # never a false negative
+        self.assertTrue(all(item in bloom_filter for item in items))
+        self.assertEqual(bloom_filter.count, 1000)
+
+        false_positives = sum('other-{}'.format(index) in bloom_filter for index in range(10000))
+
+        self.assertLess(false_positives / 10000, 0.02)
@@ -0,0 +1,94 @@
+from unittest import TestCase
+
+from app import app
+
+import claims
+from claims import (CLAIMED_COLUMNS, ClaimsVersions, are_claims_current,
+                    build_claims, bump_claims_version, claims_version_key,
+                    get_claims_version)
+from extensions import redis_store
+from models.user import UserModel
+
+
+class ClaimsTest(TestCase):
+
+    def setUp(self):
+        self.user = UserModel(name='Provider', email='provider@icarusmed.com', password='123', uuid='uuid-claims')
+        self.user.id = 1
+        self.user.user_type = 0
+        self.user.is_verified_professional = True
+        redis_store.delete(claims_version_key(self.user.uuid))
+
+    def test_build_claims(self):
+        with app.app_context():
+            claims = build_claims(self.user)
+
+        self.assertEqual(set(claims), set(CLAIMED_COLUMNS) | {'version'})
+        self.assertEqual((claims['id'], claims['user_type'], claims['is_verified_professional']), (1, 0, True))
+        self.assertEqual(claims['version'], 0)
+
+    def test_are_claims_current(self):
+        with app.app_context():
+            claims = build_claims(self.user)
+            self.assertTrue(are_claims_current(self.user.uuid, claims))
+
+            # a claimed column changed since the token was issued
+            bump_claims_version(self.user.uuid)
+            self.assertFalse(are_claims_current(self.user.uuid, claims))
+            self.assertTrue(are_claims_current(self.user.uuid, build_claims(self.user)))
+
+            # tokens from before claims
+            self.assertFalse(are_claims_current(self.user.uuid, {}))
+
+
+class ClaimsVersionsTest(TestCase):
+
+    def setUp(self):
+        self.versions = ClaimsVersions(size=2)
+        redis_store.delete(*[claims_version_key(uuid) for uuid in ('uuid-1', 'uuid-2', 'uuid-3')])
+
+    def test_only_kept_while_listening(self):
+        self.assertEqual(self.versions.get('uuid-1'), 0)
+        self.assertEqual(self.versions.versions, {})
+
+        self.versions.subscribed()
+        self.versions.get('uuid-1')
+        self.assertEqual(self.versions.versions, {'uuid-1': 0})
+
+        self.versions.unsubscribed()
+        self.assertEqual(self.versions.versions, {})
+
+    def test_bumps_are_received(self):
+        self.versions.subscribed()
+        self.versions.get('uuid-1')
+
+        # another worker bumped it
+        redis_store.incr(claims_version_key('uuid-1'))
+        self.assertEqual(self.versions.get('uuid-1'), 0)
+
+        self.versions.receive(b'uuid-1')
+        self.assertEqual(self.versions.get('uuid-1'), 1)
+
+    def test_least_recently_used_go_first(self):
+        self.versions.subscribed()
+
+        for uuid in ('uuid-1', 'uuid-2', 'uuid-1', 'uuid-3'):
+            self.versions.get(uuid)
+
+        self.assertEqual(list(self.versions.versions), ['uuid-1', 'uuid-3'])
+
+    def test_failed_bumps_are_retried(self):
+        # bumps that failed while redis was unreachable
+        claims.pending_bumps.update({'uuid-1', 'uuid-2'})
+        self.addCleanup(claims.pending_bumps.clear)
+
+        self.versions.tick()
+
+        self.assertEqual((get_claims_version('uuid-1'), get_claims_version('uuid-2')), (1, 1))
+        self.assertEqual(claims.pending_bumps, set())
+
+        # and with the next bump
+        claims.pending_bumps.add('uuid-1')
+        bump_claims_version('uuid-3')
+
+        self.assertEqual((get_claims_version('uuid-1'), get_claims_version('uuid-3')), (2, 1))
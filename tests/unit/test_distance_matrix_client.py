@@ -0,0 +1,50 @@
+from unittest import TestCase
+
+from resources.user.utils.distance_matrix_client import (CircuitBreaker,
+                                                         DistanceMatrixClient)
+from tests.stubs.distance_matrix import StubDistanceMatrixServer
+
+WATERLOO = (43.4723, -80.5449)
+TORONTO = (43.6532, -79.3832)
+
+
+class DistanceMatrixClientTest(TestCase):
+
+    def setUp(self):
+        self.stub = StubDistanceMatrixServer().start()
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        self.client = DistanceMatrixClient(url=self.stub.url, api_key='', connect_timeout=0.5,
+                                           read_timeout=0.2, retries=1, breaker=self.breaker)
+
+    def tearDown(self):
+        self.stub.stop()
+
+    def test_get_distances(self):
+        self.assertEqual(self.client.get_distances(WATERLOO, [WATERLOO, TORONTO]), ['0 m', '95.7 km'])
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_slow_upstream_opens_the_breaker(self):
+        self.stub.delay = 0.3
+
+        self.assertIsNone(self.client.get_distances(WATERLOO, [TORONTO]))
+        self.assertIsNone(self.client.get_distances(WATERLOO, [TORONTO]))
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+        # one try and one retry for each of the two requests, then nothing while the breaker is open
+        self.assertEqual(self.stub.requests_received, 4)
+        self.assertIsNone(self.client.get_distances(WATERLOO, [TORONTO]))
+        self.assertEqual(self.stub.requests_received, 4)
+
+    def test_breaker_closes_after_a_successful_trial(self):
+        self.stub.error_rate = 1
+
+        self.assertIsNone(self.client.get_distances(WATERLOO, [TORONTO]))
+        self.assertIsNone(self.client.get_distances(WATERLOO, [TORONTO]))
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+        self.stub.error_rate = 0
+        self.breaker.reset_timeout = 0
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertEqual(self.client.get_distances(WATERLOO, [TORONTO]), ['95.7 km'])
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
@@ -0,0 +1,80 @@
+from unittest import TestCase
+
+from app import app
+from extensions import redis_store
+from resources.user.user_search import UserSearch
+from resources.user.utils.distance_cache import DistanceCache
+from resources.user.utils.distance_providers import (GoogleDistanceProvider,
+                                                     LocalDistanceProvider,
+                                                     format_distance,
+                                                     haversine_distances)
+
+WATERLOO = (43.4723, -80.5449)
+TORONTO = (43.6532, -79.3832)
+
+
+class DistanceProvidersTest(TestCase):
+
+    def test_haversine_distances(self):
+        distances = haversine_distances(WATERLOO, [WATERLOO, TORONTO])
+
+        self.assertAlmostEqual(distances[0], 0)
+        # ~95.7 km as the crow flies
+        self.assertAlmostEqual(distances[1] / 1000, 95.7, delta=0.5)
+
+    def test_format_distance(self):
+        self.assertEqual(format_distance(849.6), '850 m')
+        self.assertEqual(format_distance(12345), '12.3 km')
+
+    def test_local_distance_provider(self):
+        provider = LocalDistanceProvider()
+
+        self.assertEqual(provider.get_distances(WATERLOO, []), [])
+        self.assertEqual(provider.get_distances(WATERLOO, [WATERLOO, TORONTO]), ['0 m', '95.7 km'])
+
+    def test_add_distances(self):
+        def page(nearest_distance):
+            address = {'latitude': TORONTO[0], 'longitude': TORONTO[1]}
+            return {'specialists': [{'provider': {'addresses': [address], 'nearest_distance': nearest_distance}}]}
+
+        with app.app_context():
+            # just searched from waterloo, the searchs own distance is used
+            measured = UserSearch.add_distances(page(12345), WATERLOO, is_measured=True)
+            # cached from a neighbours search, it's measured again from waterloo
+            cached = UserSearch.add_distances(page(12345), WATERLOO, is_measured=False)
+
+        self.assertEqual(measured['specialists'][0]['provider']['addresses'][0]['distance'], '12.3 km')
+        self.assertEqual(cached['specialists'][0]['provider']['addresses'][0]['distance'], '95.7 km')
+        self.assertAlmostEqual(cached['specialists'][0]['provider']['nearest_distance'] / 1000, 95.7, delta=0.5)
+
+
+class CountingGoogleDistanceProvider(GoogleDistanceProvider):
+    """
+    Answers every destination with '1.0 km' instead of calling google, and remembers what it was asked
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requested = []
+
+    def get_distances_from_google(self, origin, destinations):
+        self.requested.append(destinations)
+        return ['1.0 km'] * len(destinations)
+
+
+class DistanceCacheTest(TestCase):
+
+    def setUp(self):
+        self.cache = DistanceCache(precision=4, ttl=60)
+        redis_store.delete(*[self.cache.key(WATERLOO, destination) for destination in (WATERLOO, TORONTO)])
+
+    def test_only_uncached_destinations_are_requested(self):
+        provider = CountingGoogleDistanceProvider(client=None, cache=self.cache)
+
+        self.assertEqual(provider.get_distances(WATERLOO, [TORONTO]), ['1.0 km'])
+        # toronto is cached now, and waterloo is asked for once even though it's there twice
+        self.assertEqual(provider.get_distances(WATERLOO, [WATERLOO, TORONTO, WATERLOO]), ['1.0 km'] * 3)
+        # a few meters away from toronto rounds to the same key
+        self.assertEqual(provider.get_distances(WATERLOO, [(43.65321, -79.38321)]), ['1.0 km'])
+
+        self.assertEqual(provider.requested, [[TORONTO], [WATERLOO]])
@@ -0,0 +1,48 @@
+from unittest import TestCase
+
+from app import app
+from extensions import redis_store
+from resources.user.utils.search_cache import (SearchCache, generation_key,
+                                               geohash, invalidate_search_cache)
+
+
+class GeohashTest(TestCase):
+
+    def test_geohash(self):
+        self.assertEqual(geohash(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(geohash(57.64911, 10.40744, 5), 'u4pru')
+
+
+class SearchCacheTest(TestCase):
+
+    def setUp(self):
+        self.cache = SearchCache(ttl=60, geohash_precision=7, radius_bucket=1000)
+        redis_store.delete(generation_key(1), generation_key(2))
+
+        # pages stored by an earlier run would be found again under the reset generations
+        for key in redis_store.scan_iter('search:[12]:*'):
+            redis_store.delete(key)
+
+    def test_quantize(self):
+        self.assertEqual(self.cache.quantize_origin(43.4723, -80.5449), geohash(43.4723, -80.5449, 7))
+        self.assertEqual(self.cache.quantize_radius(5000), 5000)
+        self.assertEqual(self.cache.quantize_radius(5001), 6000)
+
+    def test_lookup_and_invalidate(self):
+        parameters = {'cell': 'dpwh6mv', 'radius': 5000, 'page': 1, 'sort': 'dist'}
+
+        key, page = self.cache.lookup(1, parameters)
+        self.assertIsNone(page)
+
+        self.cache.store(key, {'specialists': [], 'numSpecialists': 0})
+        self.assertEqual(self.cache.lookup(1, dict(parameters))[1], {'specialists': [], 'numSpecialists': 0})
+        self.assertIsNone(self.cache.lookup(1, dict(parameters, page=2))[1])
+
+        # a change to another specialty leaves the page alone
+        with app.app_context():
+            invalidate_search_cache(2, None)
+        self.assertIsNotNone(self.cache.lookup(1, parameters)[1])
+
+        with app.app_context():
+            invalidate_search_cache(1)
+        self.assertIsNone(self.cache.lookup(1, parameters)[1])
@@ -0,0 +1,23 @@
+from unittest import TestCase
+
+from resources.user.utils.search_cursor import decode_cursor, encode_cursor
+
+ORIGIN = (43.4723, -80.5449)
+
+
+class SearchCursorTest(TestCase):
+
+    def test_round_trip(self):
+        self.assertEqual(decode_cursor(encode_cursor('dist', ORIGIN, (1234.5, 7)), sort='dist'), (ORIGIN, (1234.5, 7)))
+        # providers without a consultation wait sort as infinity
+        self.assertEqual(decode_cursor(encode_cursor('wait', ORIGIN, (float('inf'), 7)), sort='wait'),
+                         (ORIGIN, (float('inf'), 7)))
+
+    def test_invalid_cursors(self):
+        with self.assertRaises(ValueError):
+            decode_cursor(encode_cursor('dist', ORIGIN, (1234.5, 7)), sort='wait')
+
+        for cursor in ('', 'not a cursor', encode_cursor('dist', ORIGIN, ('1234.5', 7)),
+                       encode_cursor('dist', (91, 0), (1234.5, 7)), encode_cursor('dist', (float('nan'), 0), (1234.5, 7))):
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor, sort='dist')
@@ -0,0 +1,70 @@
+from os import _exit
+from time import sleep
+from unittest import TestCase
+
+from app import app
+
+import security
+from security import (PasswordHashingBusy, check_encrypted_password,
+                      encrypt_password, hash_in_pool)
+
+
+class PasswordHashingPoolTest(TestCase):
+
+    def setUp(self):
+        for key, value in (('PASSWORD_HASH_POOL_SIZE', 1), ('PASSWORD_HASH_QUEUE_SIZE', 0),
+                           ('PASSWORD_HASH_TIMEOUT', 5)):
+            self.addCleanup(app.config.__setitem__, key, app.config[key])
+            app.config[key] = value
+
+    def tearDown(self):
+        if security.pool is not None:
+            security.pool.shutdown()
+            security.pool = None
+
+        security.pool_slots = None
+
+    def test_hash_in_pool(self):
+        with app.app_context():
+            hashed = encrypt_password('password')
+
+            self.assertTrue(check_encrypted_password('password', hashed))
+            self.assertFalse(check_encrypted_password('not the password', hashed))
+
+    def test_busy(self):
+        with app.app_context():
+            encrypt_password('password')
+
+            # the only slot is taken, by a hash in progress
+            security.pool_slots.acquire()
+
+            with self.assertRaises(PasswordHashingBusy):
+                encrypt_password('password')
+
+            security.pool_slots.release()
+            encrypt_password('password')
+
+    def test_broken_pool(self):
+        with app.app_context():
+            # kills the pool process, and the one in the new pool it's tried again in
+            with self.assertRaises(PasswordHashingBusy):
+                hash_in_pool(_exit, 1)
+
+            # and the next hash starts another one
+            self.assertTrue(check_encrypted_password('password', encrypt_password('password')))
+
+    def test_timeout(self):
+        with app.app_context():
+            encrypt_password('password')
+
+            app.config['PASSWORD_HASH_TIMEOUT'] = 0.2
+
+            with self.assertRaises(PasswordHashingBusy):
+                hash_in_pool(sleep, 1)
+
+            # the slow hash still has the only process (and slot)
+            with self.assertRaises(PasswordHashingBusy):
+                encrypt_password('password')
+
+            sleep(1.5)
+            self.assertTrue(check_encrypted_password('password', encrypt_password('password')))
@@ -0,0 +1,116 @@
+from threading import Event, Thread
+from time import sleep
+from unittest import TestCase
+from uuid import uuid4
+
+from resources.user.utils.single_flight import SingleFlight
+
+
+class SingleFlightTest(TestCase):
+
+    def setUp(self):
+        self.key = str(uuid4())
+        self.calls = []
+
+    def compute(self, result='result', delay=0.2, error=None):
+        def function():
+            self.calls.append(result)
+            sleep(delay)
+
+            if error:
+                raise error
+
+            return result
+
+        return function
+
+    def run_in_threads(self, functions):
+        results = [None] * len(functions)
+
+        def run(index):
+            try:
+                results[index] = functions[index]()
+            except ValueError as error:
+                results[index] = error
+
+        threads = [Thread(target=run, args=(index,)) for index in range(len(functions))]
+        for thread in threads:
+            thread.start()
+            sleep(0.01)
+        for thread in threads:
+            thread.join()
+
+        return results
+
+    def test_threads_share_one_computation(self):
+        single_flight = SingleFlight(lock_ttl=1000, wait_timeout=1, poll_interval=0.01, max_poll_interval=0.05)
+
+        results = self.run_in_threads([lambda: single_flight.run(self.key, self.compute())] * 5)
+
+        self.assertEqual(results, ['result'] * 5)
+        self.assertEqual(self.calls, ['result'])
+
+        # finished flights aren't shared
+        self.assertEqual(single_flight.run(self.key, self.compute('again', delay=0)), 'again')
+
+    def test_followers_compute_when_the_leader_fails(self):
+        single_flight = SingleFlight(lock_ttl=1000, wait_timeout=1, poll_interval=0.01, max_poll_interval=0.05)
+
+        results = self.run_in_threads([
+            lambda: single_flight.run(self.key, self.compute(error=ValueError('leader failed'))),
+            lambda: single_flight.run(self.key, self.compute('follower')),
+        ])
+
+        self.assertIsInstance(results[0], ValueError)
+        self.assertEqual(results[1], 'follower')
+
+    def test_workers_share_one_computation(self):
+        # two workers, the second one finds the first ones result in the "cache"
+        first_worker = SingleFlight(lock_ttl=1000, wait_timeout=1, poll_interval=0.01, max_poll_interval=0.05)
+        second_worker = SingleFlight(lock_ttl=1000, wait_timeout=1, poll_interval=0.01, max_poll_interval=0.05)
+        cache = {}
+        stored = Event()
+
+        def compute_and_cache():
+            result = self.compute()()
+            cache['result'] = result
+            stored.set()
+            return result
+
+        results = self.run_in_threads([
+            lambda: first_worker.run(self.key, compute_and_cache, load=lambda: cache.get('result')),
+            lambda: second_worker.run(self.key, self.compute('second'), load=lambda: cache.get('result')),
+        ])
+
+        self.assertTrue(stored.is_set())
+        self.assertEqual(results, ['result', 'result'])
+        self.assertEqual(self.calls, ['result'])
+
+    def test_workers_stop_waiting_once_the_leader_is_gone(self):
+        first_worker = SingleFlight(lock_ttl=1000, wait_timeout=5, poll_interval=0.01, max_poll_interval=0.05)
+        second_worker = SingleFlight(lock_ttl=1000, wait_timeout=5, poll_interval=0.01, max_poll_interval=0.05)
+
+        results = self.run_in_threads([
+            lambda: first_worker.run(self.key, self.compute(error=ValueError('leader failed')), load=lambda: None),
+            lambda: second_worker.run(self.key, self.compute('second', delay=0), load=lambda: None),
+        ])
+
+        self.assertIsInstance(results[0], ValueError)
+        self.assertEqual(results[1], 'second')
+
+    def test_polls_back_off(self):
+        first_worker = SingleFlight(lock_ttl=1000, wait_timeout=1, poll_interval=0.01, max_poll_interval=0.08)
+        second_worker = SingleFlight(lock_ttl=1000, wait_timeout=1, poll_interval=0.01, max_poll_interval=0.08)
+        polls = []
+
+        def load():
+            polls.append(None)
+            return None
+
+        self.run_in_threads([
+            lambda: first_worker.run(self.key, self.compute(delay=0.5), load=load),
+            lambda: second_worker.run(self.key, self.compute('second', delay=0), load=load),
+        ])
+
+        # 0.01, 0.02, 0.04, 0.08, 0.08... instead of every 0.01 seconds for half a second
+        self.assertLess(len(polls), 12)
@@ -0,0 +1,65 @@
+from unittest import TestCase
+
+from app import app
+from extensions import redis_store
+from resources.user.utils.search_cache import (ALL_SPECIALTIES_GENERATION_KEY,
+                                               generation_key,
+                                               invalidate_search_cache)
+from resources.user.utils.tiles import (MERCATOR_EXTENT, TileCache,
+                                        is_valid_tile, tile_bounds,
+                                        tile_mercator_bounds)
+
+
+class TilesTest(TestCase):
+
+    def test_is_valid_tile(self):
+        self.assertTrue(is_valid_tile(0, 0, 0))
+        self.assertTrue(is_valid_tile(3, 7, 7))
+        self.assertFalse(is_valid_tile(3, 8, 0))
+        self.assertFalse(is_valid_tile(-1, 0, 0))
+        self.assertFalse(is_valid_tile(23, 0, 0))
+
+    def test_tile_mercator_bounds(self):
+        self.assertEqual(tile_mercator_bounds(0, 0, 0),
+                         (-MERCATOR_EXTENT, -MERCATOR_EXTENT, MERCATOR_EXTENT, MERCATOR_EXTENT))
+        self.assertEqual(tile_mercator_bounds(1, 1, 0), (0, 0, MERCATOR_EXTENT, MERCATOR_EXTENT))
+
+    def test_tile_bounds(self):
+        west, south, east, north = tile_bounds(0, 0, 0)
+
+        self.assertAlmostEqual(west, -180)
+        self.assertAlmostEqual(east, 180)
+        self.assertAlmostEqual(north, 85.0511, places=4)
+        self.assertAlmostEqual(south, -85.0511, places=4)
+
+        # the tile waterloo, ontario is on at zoom 10
+        west, south, east, north = tile_bounds(10, 282, 374)
+
+        self.assertTrue(west < -80.5449 < east)
+        self.assertTrue(south < 43.4723 < north)
+
+
+class TileCacheTest(TestCase):
+
+    def setUp(self):
+        self.cache = TileCache('test', ttl=60)
+        redis_store.delete(generation_key(1), ALL_SPECIALTIES_GENERATION_KEY)
+
+    def test_generation(self):
+        self.assertEqual(self.cache.generation(1), 0)
+        self.assertEqual(self.cache.generation(), 0)
+
+        with app.app_context():
+            invalidate_search_cache(1)
+
+        self.assertEqual(self.cache.generation(1), 1)
+        self.assertEqual(self.cache.generation(), 1)
+
+    def test_get_and_set(self):
+        key = self.cache.key(0, 10, 282, 374, {'language_ids': [1]})
+
+        self.assertNotEqual(key, self.cache.key(1, 10, 282, 374, {'language_ids': [1]}))
+        self.assertNotEqual(key, self.cache.key(0, 10, 282, 374))
+
+        self.cache.set(key, b'\x1a\x00')
+        self.assertEqual(self.cache.get(key), b'\x1a\x00')
@@ -0,0 +1,86 @@
+from time import sleep
+from unittest import TestCase
+
+from app import app
+from extensions import db
+from models.user import UserModel
+from models.user_cache import UserCache
+
+
+def build_user(id, name='Provider'):
+    user = UserModel(name=name, email='{}@icarusmed.com'.format(id), password='123', uuid='uuid-{}'.format(id))
+    user.id = id
+    return user
+
+
+def build_cache(size=10, ttl=60):
+    cache = UserCache(size=size, ttl=ttl)
+    cache.subscribed()
+    return cache
+
+
+class UserCacheTest(TestCase):
+
+    def test_get_and_set(self):
+        cache = build_cache()
+
+        with app.app_context():
+            self.assertIsNone(cache.get(UserModel, 'uuid-1'))
+
+            cache.set(build_user(1), cache.version)
+            user = cache.get(UserModel, 'uuid-1')
+
+            # adopted by the session as it is, without a query
+            self.assertIn(user, db.session)
+            self.assertNotIn(user, db.session.dirty)
+            self.assertEqual((user.id, user.name, user.email), (1, 'Provider', '1@icarusmed.com'))
+
+            db.session.remove()
+
+    def test_invalidate(self):
+        cache = build_cache()
+        cache.set(build_user(1), cache.version)
+        cache.invalidate('uuid-1')
+
+        with app.app_context():
+            self.assertIsNone(cache.get(UserModel, 'uuid-1'))
+
+    def test_changes_published_by_other_workers(self):
+        cache = build_cache()
+        cache.set(build_user(1), cache.version)
+        cache.receive(b'uuid-1')
+
+        self.assertEqual(list(cache.snapshots), [])
+
+    def test_read_before_an_invalidation_is_not_cached(self):
+        cache = build_cache()
+        version = cache.version
+
+        # another worker saved someone while the user was being read
+        cache.receive(b'uuid-2')
+        cache.set(build_user(1), version)
+
+        self.assertEqual(list(cache.snapshots), [])
+
+    def test_unused_while_not_listening(self):
+        cache = build_cache()
+        cache.set(build_user(1), cache.version)
+        cache.unsubscribed()
+
+        with app.app_context():
+            self.assertIsNone(cache.get(UserModel, 'uuid-1'))
+
+        cache.set(build_user(1), cache.version)
+        self.assertEqual(list(cache.snapshots), [])
+
+    def test_expiry_and_eviction(self):
+        cache = build_cache(size=2, ttl=0.05)
+
+        for id in (1, 2, 3):
+            cache.set(build_user(id), cache.version)
+
+        self.assertEqual(list(cache.snapshots), ['uuid-2', 'uuid-3'])
+
+        with app.app_context():
+            sleep(0.1)
+            self.assertIsNone(cache.get(UserModel, 'uuid-3'))
@@ -0,0 +1,38 @@
+"""
+Verifies a professional by their email, or takes it away with --revoke:
+
+heroku run python verify_professional.py doctor@example.com --app icarus-rest-api
+heroku run python verify_professional.py doctor@example.com --revoke --app icarus-rest-api
+
+Use this instead of changing is_verified_professional by hand in the database. Saved through the models,
+the providers search rows are rebuilt in the same transaction, the cached searches of their specialty are dropped,
+and tokens with their old claims are turned away.
+"""
+from sys import argv, exit
+
+from redis.exceptions import RedisError
+
+from app import app
+from claims import bump_claims_version
+from models.user import UserModel
+
+if len(argv) < 2 or argv[2:] not in ([], ['--revoke']):
+    exit('usage: python verify_professional.py EMAIL [--revoke]')
+
+with app.app_context():
+    user = UserModel.find_by_email(argv[1])
+
+    if user is None:
+        exit('no user with the email {}'.format(argv[1]))
+
+    user.is_verified_professional = argv[2:] != ['--revoke']
+    user.save_to_db()
+
+    # saving bumps it too, but a failed bump is only tried again by the next one in this process
+    try:
+        bump_claims_version(user.uuid)
+    except RedisError:
+        exit('{} is saved, but their tokens with the old claims could not be turned away '
+             '(redis is unreachable), run this again'.format(user.email))
+
+    print('{} is_verified_professional = {}'.format(user.email, user.is_verified_professional))